@@ -4,10 +4,11 @@
 使用人脸融合API实现发型迁移(不使用头发分割)
 """
 
+import asyncio
 import os
 import sys
 import time
-import requests
+import uuid
 from typing import Optional, Tuple
 import cv2
 import numpy as np
@@ -17,6 +18,8 @@ from alibabacloud_facebody20191230.client import Client as FaceBodyClient
 from alibabacloud_facebody20191230 import models as facebody_models
 from alibabacloud_tea_openapi import models as open_api_models
 
+from downloader import get_downloader
+
 # 导入自定义模块(容错)
 try:
     from image_preprocessor import ImagePreprocessor
@@ -48,6 +51,30 @@ except ImportError as e:
 
 SKETCH_AVAILABLE = BAILIAN_SKETCH_AVAILABLE or OPENCV_SKETCH_AVAILABLE
 
+try:
+    from face_template_registry import FaceTemplateRegistry
+    TEMPLATE_REGISTRY_AVAILABLE = True
+except ImportError as e:
+    TEMPLATE_REGISTRY_AVAILABLE = False
+    FaceTemplateRegistry = None
+    print(f"⚠️  模板注册表不可用: {e}")
+
+try:
+    from async_http import fetch_bytes
+    ASYNC_HTTP_AVAILABLE = True
+except ImportError as e:
+    ASYNC_HTTP_AVAILABLE = False
+    fetch_bytes = None
+    print(f"⚠️  异步HTTP不可用: {e}")
+
+try:
+    from image_pool import get_image_pool
+    IMAGE_POOL_AVAILABLE = True
+except ImportError as e:
+    IMAGE_POOL_AVAILABLE = False
+    get_image_pool = None
+    print(f"⚠️  图像进程池不可用: {e}")
+
 
 class AliyunHairTransferFixed:
     """阿里云发型迁移服务 - 修复版"""
@@ -88,6 +115,14 @@ class AliyunHairTransferFixed:
         else:
             self.preprocessor = None
         
+        # 模板注册表: 复用相同发型图的模板,配额满时淘汰冷模板
+        self.template_registry = None
+        if TEMPLATE_REGISTRY_AVAILABLE and os.getenv('FACE_TEMPLATE_REGISTRY', '1') != '0':
+            try:
+                self.template_registry = FaceTemplateRegistry(self)
+            except Exception as e:
+                print(f"⚠️  模板注册表初始化失败: {e}")
+        
         # 初始化素描转换器(优先百炼)
         if BAILIAN_SKETCH_AVAILABLE:
             try:
@@ -115,11 +150,17 @@ class AliyunHairTransferFixed:
         print(f"   地域: {self.region}")
     
     def _create_facebody_client(self) -> FaceBodyClient:
-        """创建人脸人体客户端"""
+        """
+        创建人脸人体客户端
+        
+        环境变量ALIYUN_FACEBODY_ENDPOINT / ALIYUN_API_PROTOCOL可覆盖默认接入点,
+        用于压测时指向本地模拟服务(见benchmarks/fake_upstream.py)
+        """
         config = open_api_models.Config(
             access_key_id=self.access_key_id,
             access_key_secret=self.access_key_secret,
-            endpoint=f'facebody.{self.region}.aliyuncs.com'
+            endpoint=os.getenv('ALIYUN_FACEBODY_ENDPOINT', f'facebody.{self.region}.aliyuncs.com'),
+            protocol=os.getenv('ALIYUN_API_PROTOCOL')
         )
         return FaceBodyClient(config)
     
@@ -160,6 +201,43 @@ class AliyunHairTransferFixed:
             print(f"❌ 模板创建失败: {e}")
             raise
     
+    async def add_face_template_async(self, image_url: str) -> str:
+        """添加人脸融合模板(协程版),参数与返回值同add_face_template"""
+        print(f"\n📋 步骤1: 创建人脸融合模板(异步)")
+        print(f"   模板图像: {image_url[:50]}...")
+        
+        try:
+            request = facebody_models.AddFaceImageTemplateRequest(
+                image_url=image_url
+            )
+            response = await self.facebody_client.add_face_image_template_async(request)
+            
+            if not response.body or not response.body.data:
+                raise Exception("API返回数据为空")
+            
+            template_id = response.body.data.template_id
+            print(f"✅ 模板创建成功")
+            print(f"   模板ID: {template_id}")
+            return template_id
+            
+        except Exception as e:
+            print(f"❌ 模板创建失败: {e}")
+            raise
+    
+    def delete_face_template(self, template_id: str):
+        """
+        删除人脸融合模板
+        
+        Args:
+            template_id: 模板ID
+        """
+        print(f"\n🗑️  删除人脸融合模板: {template_id}")
+        
+        request = facebody_models.DeleteFaceImageTemplateRequest(
+            template_id=template_id
+        )
+        self.facebody_client.delete_face_image_template(request)
+    
     def merge_face(
         self,
         template_id: str,
@@ -211,6 +289,73 @@ class AliyunHairTransferFixed:
             print(f"❌ 人脸融合失败: {e}")
             raise
     
+    async def merge_face_async(
+        self,
+        template_id: str,
+        user_image_url: str,
+        model_version: str = 'v1',
+        add_watermark: bool = False
+    ) -> str:
+        """人脸融合(协程版),等待API响应时不占用线程;参数与返回值同merge_face"""
+        print(f"\n🎨 步骤2: 人脸融合(异步)")
+        print(f"   模板ID: {template_id}")
+        print(f"   用户图像: {user_image_url[:50]}...")
+        
+        try:
+            request = facebody_models.MergeImageFaceRequest(
+                template_id=template_id,
+                image_url=user_image_url,
+                model_version=model_version,
+                add_watermark=add_watermark
+            )
+            response = await self.facebody_client.merge_image_face_async(request)
+            
+            if not response.body or not response.body.data:
+                raise Exception("API返回数据为空")
+            
+            result_url = response.body.data.image_url
+            print(f"✅ 人脸融合成功")
+            print(f"   结果URL: {result_url[:50]}...")
+            return result_url
+            
+        except Exception as e:
+            print(f"❌ 人脸融合失败: {e}")
+            raise
+    
+    def opencv_sketch(self, image: np.ndarray, style: str) -> np.ndarray:
+        """
+        OpenCV素描转换(有进程池时在工作进程中计算)
+        
+        Args:
+            image: 输入图像
+            style: 素描风格
+        
+        Returns:
+            sketch: 素描图像
+        """
+        image_pool = get_image_pool() if IMAGE_POOL_AVAILABLE else None
+        if image_pool:
+            return image_pool.sketch(image, style=style)
+        return self.sketch_converter.convert(image, style=style)
+    
+    @staticmethod
+    def _decode_image(content: bytes, save_path: Optional[str] = None) -> np.ndarray:
+        """解码下载的图像并(可选)保存"""
+        image_array = np.frombuffer(content, dtype=np.uint8)
+        image = cv2.imdecode(image_array, cv2.IMREAD_UNCHANGED)
+        
+        if image is None:
+            raise Exception("图像解码失败")
+        
+        # 保存到本地
+        if save_path:
+            cv2.imwrite(save_path, image)
+            print(f"✅ 图像已保存: {save_path}")
+        else:
+            print(f"✅ 图像下载成功: {image.shape}")
+        
+        return image
+    
     def download_image(self, url: str, save_path: Optional[str] = None) -> np.ndarray:
         """
         下载图像
@@ -226,29 +371,235 @@ class AliyunHairTransferFixed:
         print(f"   URL: {url[:50]}...")
         
         try:
-            # 下载图像
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
+            # 下载图像(共享连接池,瞬时错误自动重试并续传)
+            content = get_downloader().download_bytes(url)
             
             # 转换为OpenCV格式
-            image_array = np.frombuffer(response.content, dtype=np.uint8)
-            image = cv2.imdecode(image_array, cv2.IMREAD_UNCHANGED)
+            return self._decode_image(content, save_path)
+            
+        except Exception as e:
+            print(f"❌ 图像下载失败: {e}")
+            raise
+    
+    async def download_image_async(self, url: str, save_path: Optional[str] = None) -> np.ndarray:
+        """下载图像(协程版): 异步下载,解码和保存放到线程中"""
+        print(f"\n💾 下载图像(异步)")
+        print(f"   URL: {url[:50]}...")
+        
+        try:
+            content = await fetch_bytes(url)
+            return await asyncio.to_thread(self._decode_image, content, save_path)
+        except Exception as e:
+            print(f"❌ 图像下载失败: {e}")
+            raise
+    
+    # ===== 步骤4: 素描效果 =====
+    
+    @staticmethod
+    def _sketch_task_kwargs(checkpoint) -> dict:
+        """恢复执行时继续轮询已提交的百炼任务,新提交的任务ID立即记入检查点"""
+        if checkpoint is None:
+            return {}
+        return {
+            'task_id': checkpoint.get('sketch_task_id'),
+            'on_submit': lambda task_id: checkpoint.save('sketch_submitted', sketch_task_id=task_id),
+        }
+    
+    @staticmethod
+    def _save_sketch(image: np.ndarray, save_path: Optional[str], info: dict, method: str, sketch_style: str):
+        """保存素描版本并记录素描信息"""
+        if save_path:
+            sketch_path = save_path.replace('.png', '_sketch.png')
+            cv2.imwrite(sketch_path, image)
+            info['sketch_path'] = sketch_path
+            print(f"✅ 素描版本已保存: {sketch_path}")
+        
+        info['sketch_enabled'] = True
+        info['sketch_method'] = method
+        info['sketch_style'] = sketch_style
+    
+    def _opencv_sketch_fallback(
+        self,
+        result_image: np.ndarray,
+        save_path: Optional[str],
+        sketch_style: str,
+        info: dict,
+        bailian_error: Optional[Exception] = None
+    ) -> np.ndarray:
+        """OpenCV素描(百炼不可用或失败时),返回最终图像"""
+        if not self.sketch_converter:
+            info['sketch_enabled'] = False
+            info['sketch_error'] = str(bailian_error)
+            return result_image
+        
+        print(f"   降级使用OpenCV素描转换" if bailian_error else f"   使用: OpenCV素描转换")
+        try:
+            sketch = self.opencv_sketch(result_image, sketch_style)
+            self._save_sketch(sketch, save_path, info, 'opencv', sketch_style)
+            return sketch
+        except Exception as e:
+            print(f"⚠️  {'OpenCV素描也失败' if bailian_error else '素描转换失败'}: {e}")
+            info['sketch_enabled'] = False
+            info['sketch_error'] = f"Bailian: {bailian_error}, OpenCV: {e}" if bailian_error else str(e)
+            return result_image
+    
+    def _apply_sketch(
+        self,
+        result_image: np.ndarray,
+        result_url: str,
+        save_path: Optional[str],
+        sketch_style: str,
+        info: dict,
+        checkpoint=None
+    ) -> np.ndarray:
+        """步骤4: 素描效果(优先百炼,失败降级OpenCV),返回最终图像;百炼任务ID记入检查点"""
+        print(f"\n🎨 步骤4: 素描效果转换")
+        
+        if not self.bailian_sketch:
+            if not self.sketch_converter:
+                print(f"⚠️  没有可用的素描转换器")
+                info['sketch_enabled'] = False
+                info['sketch_skipped'] = True
+                return result_image
+            return self._opencv_sketch_fallback(result_image, save_path, sketch_style, info)
+        
+        try:
+            print(f"   使用: 百炼大模型素描转换")
             
-            if image is None:
-                raise Exception("图像解码失败")
+            # 百炼需要图像URL,使用融合结果URL;本地结果文件用于确定性种子和缓存
+            sketch_url, sketch_info = self.bailian_sketch.convert(
+                image_url=result_url,
+                style=sketch_style,
+                image_path=save_path,
+                **self._sketch_task_kwargs(checkpoint)
+            )
+            if not sketch_info['success']:
+                raise Exception(sketch_info.get('error', '未知错误'))
             
-            # 保存到本地
-            if save_path:
-                cv2.imwrite(save_path, image)
-                print(f"✅ 图像已保存: {save_path}")
+            # 读取缓存的素描结果,无缓存时下载
+            if sketch_info.get('cache_path'):
+                sketch = cv2.imread(sketch_info['cache_path'], cv2.IMREAD_UNCHANGED)
             else:
-                print(f"✅ 图像下载成功: {image.shape}")
+                sketch = self.download_image(sketch_url)
+            
+            self._save_sketch(sketch, save_path, info, 'bailian', sketch_style)
+            info['sketch_info'] = sketch_info
+            return sketch
+        
+        except Exception as e:
+            print(f"⚠️  百炼素描转换失败: {e}")
+            return self._opencv_sketch_fallback(result_image, save_path, sketch_style, info, e)
+    
+    async def _apply_sketch_async(
+        self,
+        result_image: np.ndarray,
+        result_url: str,
+        save_path: Optional[str],
+        sketch_style: str,
+        info: dict,
+        checkpoint=None
+    ) -> np.ndarray:
+        """_apply_sketch的协程版: 百炼任务异步轮询,OpenCV计算放到线程中"""
+        print(f"\n🎨 步骤4: 素描效果转换")
+        
+        if not self.bailian_sketch:
+            if not self.sketch_converter:
+                print(f"⚠️  没有可用的素描转换器")
+                info['sketch_enabled'] = False
+                info['sketch_skipped'] = True
+                return result_image
+            return await asyncio.to_thread(
+                self._opencv_sketch_fallback, result_image, save_path, sketch_style, info
+            )
+        
+        try:
+            print(f"   使用: 百炼大模型素描转换")
+            sketch_url, sketch_info = await self.bailian_sketch.convert_async(
+                image_url=result_url,
+                style=sketch_style,
+                image_path=save_path,
+                **self._sketch_task_kwargs(checkpoint)
+            )
+            if not sketch_info['success']:
+                raise Exception(sketch_info.get('error', '未知错误'))
             
-            return image
+            if sketch_info.get('cache_path'):
+                sketch = await asyncio.to_thread(cv2.imread, sketch_info['cache_path'], cv2.IMREAD_UNCHANGED)
+            else:
+                sketch = await self.download_image_async(sketch_url)
             
+            await asyncio.to_thread(self._save_sketch, sketch, save_path, info, 'bailian', sketch_style)
+            info['sketch_info'] = sketch_info
+            return sketch
+        
         except Exception as e:
-            print(f"❌ 图像下载失败: {e}")
-            raise
+            print(f"⚠️  百炼素描转换失败: {e}")
+            return await asyncio.to_thread(
+                self._opencv_sketch_fallback, result_image, save_path, sketch_style, info, e
+            )
+    
+    # ===== 完整流程 =====
+    
+    @staticmethod
+    def _start_info(hairstyle_image_url: str, customer_image_url: str) -> dict:
+        print(f"\n" + "="*60)
+        print(f"🚀 开始发型迁移(修复版)")
+        print(f"="*60)
+        print(f"\n💡 流程说明:")
+        print(f"   1. 使用发型参考图创建模板(完整图像,包含人脸)")
+        print(f"   2. 将客户人脸融合到模板图")
+        print(f"   3. 结果: 客户人脸 + 发型参考图的发型")
+        
+        return {
+            'start_time': time.time(),
+            'hairstyle_url': hairstyle_image_url,
+            'customer_url': customer_image_url
+        }
+    
+    @staticmethod
+    def _result_save_path(save_dir: Optional[str]) -> Optional[str]:
+        if not save_dir:
+            return None
+        os.makedirs(save_dir, exist_ok=True)
+        timestamp = int(time.time())
+        # 同一秒内的并发请求(异步服务模式下很常见)不能写到同一个文件
+        return os.path.join(save_dir, f'result_{timestamp}_{uuid.uuid4().hex[:6]}.png')
+    
+    @staticmethod
+    def _skip_sketch(enable_sketch: bool, info: dict):
+        """未启用素描或素描模块不可用时记录原因"""
+        if enable_sketch:
+            print(f"\n⚠️  素描模块不可用,跳过素描转换")
+            info['sketch_enabled'] = False
+            info['sketch_skipped'] = True
+        else:
+            info['sketch_enabled'] = False
+    
+    @staticmethod
+    def _finish_info(info: dict, save_path: Optional[str]):
+        # 计算耗时
+        info['elapsed_time'] = time.time() - info['start_time']
+        
+        print(f"\n" + "="*60)
+        print(f"🎉 发型迁移完成!")
+        print(f"   总耗时: {info['elapsed_time']:.2f}秒")
+        if save_path:
+            print(f"   结果保存: {save_path}")
+        print(f"="*60)
+    
+    @staticmethod
+    def _fail_info(info: dict, error: Exception):
+        info['error'] = str(error)
+        info['elapsed_time'] = time.time() - info['start_time']
+        print(f"\n" + "="*60)
+        print(f"❌ 发型迁移失败: {error}")
+        print(f"   总耗时: {info['elapsed_time']:.2f}秒")
+        print(f"="*60)
+    
+    @staticmethod
+    def _is_template_error(use_registry: bool, error: Exception) -> bool:
+        """复用的模板可能已在云端失效"""
+        return use_registry and 'template' in str(error).lower()
     
     def transfer_hairstyle(
         self,
@@ -258,7 +609,10 @@ class AliyunHairTransferFixed:
         face_blend_ratio: float = 0.5,
         save_dir: Optional[str] = None,
         enable_sketch: bool = False,
-        sketch_style: str = 'artistic'
+        sketch_style: str = 'artistic',
+        hairstyle_key: Optional[str] = None,
+        template_id: Optional[str] = None,
+        checkpoint=None
     ) -> Tuple[np.ndarray, dict]:
         """
         完整的发型迁移流程(修复版)
@@ -277,164 +631,192 @@ class AliyunHairTransferFixed:
             save_dir: 保存目录(可选)
             enable_sketch: 是否启用素描效果
             sketch_style: 素描风格(pencil/detailed/artistic/color)
+            hairstyle_key: 发型图内容哈希,提供时通过模板注册表复用模板
+            template_id: 已创建的模板ID(如发型目录预建的模板),未启用注册表时直接使用
+            checkpoint: 任务检查点(job_store.JobCheckpoint),各阶段产出写入其中;
+                        恢复执行时跳过已完成的阶段
         
         Returns:
             (result_image, info): 结果图像和处理信息
         """
-        print(f"\n" + "="*60)
-        print(f"🚀 开始发型迁移(修复版)")
-        print(f"="*60)
-        print(f"\n💡 流程说明:")
-        print(f"   1. 使用发型参考图创建模板(完整图像,包含人脸)")
-        print(f"   2. 将客户人脸融合到模板图")
-        print(f"   3. 结果: 客户人脸 + 发型参考图的发型")
-        
-        info = {
-            'start_time': time.time(),
-            'hairstyle_url': hairstyle_image_url,
-            'customer_url': customer_image_url
-        }
+        info = self._start_info(hairstyle_image_url, customer_image_url)
+        done = checkpoint.outputs if checkpoint else {}
         
         try:
-            # 步骤1: 创建模板(使用完整的发型参考图)
-            template_id = self.add_face_template(hairstyle_image_url)
+            # 步骤1: 创建模板(使用完整的发型参考图,相同发型复用已有模板)
+            use_registry = bool(hairstyle_key and self.template_registry)
+            if done.get('template_id'):
+                template_id = done['template_id']
+            elif use_registry:
+                template_id = self.template_registry.acquire(hairstyle_key, hairstyle_image_url)
+            elif not template_id:
+                template_id = self.add_face_template(hairstyle_image_url)
             info['template_id'] = template_id
+            if checkpoint and not done.get('template_id'):
+                checkpoint.save('template', template_id=template_id)
             
             # 步骤2: 人脸融合(将客户人脸融合到模板)
-            result_url = self.merge_face(
+            result_url = done.get('merge_url')
+            if result_url:
+                print(f"\n♻️  步骤2: 使用已完成的人脸融合结果")
+            else:
+                result_url = self._merge_with_retry(
+                    info, template_id, customer_image_url, model_version,
+                    use_registry, hairstyle_key, hairstyle_image_url
+                )
+                if checkpoint:
+                    checkpoint.save('merged', merge_url=result_url, template_id=info['template_id'])
+            info['result_url'] = result_url
+            
+            # 步骤3: 下载结果(恢复执行时本地文件已存在则直接读取)
+            save_path = done.get('save_path')
+            if save_path and os.path.exists(save_path):
+                result_image = cv2.imread(save_path, cv2.IMREAD_UNCHANGED)
+            else:
+                save_path = self._result_save_path(save_dir)
+                result_image = self.download_image(result_url, save_path)
+                if checkpoint:
+                    checkpoint.save('downloaded', save_path=save_path)
+            info['save_path'] = save_path
+            
+            # 步骤4: 素描效果(可选)
+            if enable_sketch and SKETCH_AVAILABLE:
+                result_image = self._apply_sketch(result_image, result_url, save_path, sketch_style, info, checkpoint)
+            else:
+                self._skip_sketch(enable_sketch, info)
+            
+            self._finish_info(info, save_path)
+            return result_image, info
+            
+        except Exception as e:
+            self._fail_info(info, e)
+            raise
+    
+    def _merge_with_retry(
+        self,
+        info: dict,
+        template_id: str,
+        customer_image_url: str,
+        model_version: str,
+        use_registry: bool,
+        hairstyle_key: Optional[str],
+        hairstyle_image_url: str
+    ) -> str:
+        """人脸融合;复用的模板已失效时重新创建并重试一次"""
+        try:
+            return self.merge_face(
+                template_id=template_id,
+                user_image_url=customer_image_url,
+                model_version=model_version
+            )
+        except Exception as e:
+            # 复用的模板可能已在云端失效,重新创建后重试一次
+            if not self._is_template_error(use_registry, e):
+                raise
+            print(f"⚠️  模板可能已失效,重新创建后重试")
+            self.template_registry.invalidate(hairstyle_key)
+            template_id = self.template_registry.acquire(hairstyle_key, hairstyle_image_url)
+            info['template_id'] = template_id
+            return self.merge_face(
                 template_id=template_id,
                 user_image_url=customer_image_url,
                 model_version=model_version
             )
+    
+    async def transfer_hairstyle_async(
+        self,
+        hairstyle_image_url: str,
+        customer_image_url: str,
+        model_version: str = 'v1',
+        face_blend_ratio: float = 0.5,
+        save_dir: Optional[str] = None,
+        enable_sketch: bool = False,
+        sketch_style: str = 'artistic',
+        hairstyle_key: Optional[str] = None,
+        template_id: Optional[str] = None,
+        checkpoint=None
+    ) -> Tuple[np.ndarray, dict]:
+        """
+        完整的发型迁移流程(协程版,异步服务模式使用),参数与返回值同transfer_hairstyle
+        
+        人脸融合、结果下载、百炼素描轮询均为异步等待,不占用线程;
+        模板注册表(SQLite + 跨进程合并)和图像编解码放到线程中执行
+        """
+        info = self._start_info(hairstyle_image_url, customer_image_url)
+        done = checkpoint.outputs if checkpoint else {}
+        
+        try:
+            # 步骤1: 创建模板
+            use_registry = bool(hairstyle_key and self.template_registry)
+            if done.get('template_id'):
+                template_id = done['template_id']
+            elif use_registry:
+                template_id = await asyncio.to_thread(
+                    self.template_registry.acquire, hairstyle_key, hairstyle_image_url
+                )
+            elif not template_id:
+                template_id = await self.add_face_template_async(hairstyle_image_url)
+            info['template_id'] = template_id
+            if checkpoint and not done.get('template_id'):
+                await asyncio.to_thread(checkpoint.save, 'template', template_id=template_id)
+            
+            # 步骤2: 人脸融合
+            result_url = done.get('merge_url')
+            if result_url:
+                print(f"\n♻️  步骤2: 使用已完成的人脸融合结果")
+            else:
+                try:
+                    result_url = await self.merge_face_async(
+                        template_id=template_id,
+                        user_image_url=customer_image_url,
+                        model_version=model_version
+                    )
+                except Exception as e:
+                    if not self._is_template_error(use_registry, e):
+                        raise
+                    print(f"⚠️  模板可能已失效,重新创建后重试")
+                    await asyncio.to_thread(self.template_registry.invalidate, hairstyle_key)
+                    template_id = await asyncio.to_thread(
+                        self.template_registry.acquire, hairstyle_key, hairstyle_image_url
+                    )
+                    info['template_id'] = template_id
+                    result_url = await self.merge_face_async(
+                        template_id=template_id,
+                        user_image_url=customer_image_url,
+                        model_version=model_version
+                    )
+                if checkpoint:
+                    await asyncio.to_thread(
+                        checkpoint.save, 'merged', merge_url=result_url, template_id=info['template_id']
+                    )
             info['result_url'] = result_url
             
             # 步骤3: 下载结果
-            save_path = None
-            if save_dir:
-                os.makedirs(save_dir, exist_ok=True)
-                timestamp = int(time.time())
-                save_path = os.path.join(save_dir, f'result_{timestamp}.png')
-            
-            result_image = self.download_image(result_url, save_path)
+            save_path = done.get('save_path')
+            if save_path and os.path.exists(save_path):
+                result_image = await asyncio.to_thread(cv2.imread, save_path, cv2.IMREAD_UNCHANGED)
+            else:
+                save_path = self._result_save_path(save_dir)
+                result_image = await self.download_image_async(result_url, save_path)
+                if checkpoint:
+                    await asyncio.to_thread(checkpoint.save, 'downloaded', save_path=save_path)
             info['save_path'] = save_path
             
             # 步骤4: 素描效果(可选)
             if enable_sketch and SKETCH_AVAILABLE:
-                print(f"\n🎨 步骤4: 素描效果转换")
-                
-                # 优先使用百炼素描转换器
-                if self.bailian_sketch:
-                    try:
-                        print(f"   使用: 百炼大模型素描转换")
-                        
-                        # 百炼需要图像URL,使用融合结果URL
-                        sketch_url, sketch_info = self.bailian_sketch.convert(
-                            image_url=result_url,
-                            style=sketch_style
-                        )
-                        
-                        if sketch_info['success']:
-                            # 下载素描结果
-                            result_image = self.download_image(sketch_url)
-                            
-                            # 保存素描版本
-                            if save_path:
-                                sketch_path = save_path.replace('.png', '_sketch.png')
-                                cv2.imwrite(sketch_path, result_image)
-                                info['sketch_path'] = sketch_path
-                                print(f"✅ 素描版本已保存: {sketch_path}")
-                            
-                            info['sketch_enabled'] = True
-                            info['sketch_method'] = 'bailian'
-                            info['sketch_style'] = sketch_style
-                            info['sketch_info'] = sketch_info
-                        else:
-                            raise Exception(sketch_info.get('error', '未知错误'))
-                            
-                    except Exception as e:
-                        print(f"⚠️  百炼素描转换失败: {e}")
-                        
-                        # 降级使用OpenCV
-                        if self.sketch_converter:
-                            print(f"   降级使用OpenCV素描转换")
-                            try:
-                                result_image = self.sketch_converter.convert(
-                                    result_image,
-                                    style=sketch_style
-                                )
-                                
-                                if save_path:
-                                    sketch_path = save_path.replace('.png', '_sketch.png')
-                                    cv2.imwrite(sketch_path, result_image)
-                                    info['sketch_path'] = sketch_path
-                                
-                                info['sketch_enabled'] = True
-                                info['sketch_method'] = 'opencv'
-                                info['sketch_style'] = sketch_style
-                            except Exception as e2:
-                                print(f"⚠️  OpenCV素描也失败: {e2}")
-                                info['sketch_enabled'] = False
-                                info['sketch_error'] = f"Bailian: {e}, OpenCV: {e2}"
-                        else:
-                            info['sketch_enabled'] = False
-                            info['sketch_error'] = str(e)
-                
-                # 只有OpenCV素描转换器
-                elif self.sketch_converter:
-                    try:
-                        print(f"   使用: OpenCV素描转换")
-                        result_image = self.sketch_converter.convert(
-                            result_image,
-                            style=sketch_style
-                        )
-                        
-                        if save_path:
-                            sketch_path = save_path.replace('.png', '_sketch.png')
-                            cv2.imwrite(sketch_path, result_image)
-                            info['sketch_path'] = sketch_path
-                        
-                        info['sketch_enabled'] = True
-                        info['sketch_method'] = 'opencv'
-                        info['sketch_style'] = sketch_style
-                    except Exception as e:
-                        print(f"⚠️  素描转换失败: {e}")
-                        info['sketch_enabled'] = False
-                        info['sketch_error'] = str(e)
-                
-                else:
-                    print(f"⚠️  没有可用的素描转换器")
-                    info['sketch_enabled'] = False
-                    info['sketch_skipped'] = True
-            
-            elif enable_sketch and not SKETCH_AVAILABLE:
-                print(f"\n⚠️  素描模块不可用,跳过素描转换")
-                info['sketch_enabled'] = False
-                info['sketch_skipped'] = True
+                result_image = await self._apply_sketch_async(
+                    result_image, result_url, save_path, sketch_style, info, checkpoint
+                )
             else:
-                info['sketch_enabled'] = False
-            
-            # 计算耗时
-            info['elapsed_time'] = time.time() - info['start_time']
-            
-            print(f"\n" + "="*60)
-            print(f"🎉 发型迁移完成!")
-            print(f"   总耗时: {info['elapsed_time']:.2f}秒")
-            if save_path:
-                print(f"   结果保存: {save_path}")
-            print(f"="*60)
+                self._skip_sketch(enable_sketch, info)
             
+            self._finish_info(info, save_path)
             return result_image, info
             
         except Exception as e:
-            info['error'] = str(e)
-            info['elapsed_time'] = time.time() - info['start_time']
-            print(f"\n" + "="*60)
-            print(f"❌ 发型迁移失败: {e}")
-            print(f"   总耗时: {info['elapsed_time']:.2f}秒")
-            print(f"="*60)
+            self._fail_info(info, e)
             raise
 
-
 def main():
     """测试函数"""
     print("阿里云发型迁移模块 - 修复版")
@@ -8,7 +8,17 @@ import os
 import sys
 import time
 import uuid
-from flask import Flask, render_template, request, jsonify, send_file
+import hashlib
+import json
+import math
+import multiprocessing
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+from flask import Flask, render_template, request, jsonify, send_file, send_from_directory, Response, stream_with_context
 from werkzeug.utils import secure_filename
 import cv2
 import numpy as np
@@ -16,6 +26,7 @@ from PIL import Image
 
 # 导入阿里云发型迁移模块(修复版)
 from aliyun_hair_transfer_fixed import AliyunHairTransferFixed
+from file_hash import compute_file_hash
 
 # 导入头发分割模块
 try:
@@ -43,6 +54,106 @@ except ImportError as e:
     SketchConverter = None
     print(f"⚠️  素描转换模块不可用: {e}")
 
+try:
+    from bailian_sketch_converter import BailianSketchConverter
+    BAILIAN_SKETCH_AVAILABLE = True
+except ImportError as e:
+    BAILIAN_SKETCH_AVAILABLE = False
+    BailianSketchConverter = None
+    print(f"⚠️  百炼素描转换器不可用: {e}")
+
+try:
+    from face_template_registry import FaceTemplateRegistry
+    TEMPLATE_REGISTRY_AVAILABLE = True
+except ImportError as e:
+    TEMPLATE_REGISTRY_AVAILABLE = False
+    FaceTemplateRegistry = None
+    print(f"⚠️  模板注册表不可用: {e}")
+
+try:
+    from hairstyle_catalog import HairstyleCatalog
+    CATALOG_AVAILABLE = True
+except ImportError as e:
+    CATALOG_AVAILABLE = False
+    HairstyleCatalog = None
+    print(f"⚠️  发型目录不可用: {e}")
+
+try:
+    from result_renditions import ResultRenditions
+    RENDITIONS_AVAILABLE = True
+except ImportError as e:
+    RENDITIONS_AVAILABLE = False
+    ResultRenditions = None
+    print(f"⚠️  结果多规格输出不可用: {e}")
+
+try:
+    from image_pool import get_image_pool
+    IMAGE_POOL_AVAILABLE = True
+except ImportError as e:
+    IMAGE_POOL_AVAILABLE = False
+    get_image_pool = None
+    print(f"⚠️  图像进程池不可用: {e}")
+
+try:
+    from face_validator import get_face_validator, FaceValidationError
+    FACE_VALIDATOR_AVAILABLE = True
+except ImportError as e:
+    FACE_VALIDATOR_AVAILABLE = False
+    get_face_validator = None
+    print(f"⚠️  人脸预检不可用: {e}")
+
+    class FaceValidationError(ValueError):
+        report = None
+
+try:
+    from single_flight import get_single_flight
+    SINGLE_FLIGHT_AVAILABLE = True
+except ImportError as e:
+    SINGLE_FLIGHT_AVAILABLE = False
+    get_single_flight = None
+    print(f"⚠️  请求合并不可用: {e}")
+
+try:
+    from job_store import get_job_store, ResumeWorker
+    JOB_STORE_AVAILABLE = True
+except ImportError as e:
+    JOB_STORE_AVAILABLE = False
+    get_job_store = None
+    ResumeWorker = None
+    print(f"⚠️  任务存储不可用: {e}")
+
+try:
+    from memory_budget import estimate_request, get_memory_budget, image_dimensions, MemoryBudgetExceeded
+    MEMORY_BUDGET_AVAILABLE = True
+except ImportError as e:
+    MEMORY_BUDGET_AVAILABLE = False
+    get_memory_budget = None
+    print(f"⚠️  内存预算不可用: {e}")
+
+try:
+    from transfer_scheduler import get_transfer_scheduler, SchedulerBusy, PRIORITIES
+    TRANSFER_SCHEDULER_AVAILABLE = True
+except ImportError as e:
+    TRANSFER_SCHEDULER_AVAILABLE = False
+    get_transfer_scheduler = None
+    print(f"⚠️  迁移调度器不可用: {e}")
+
+try:
+    from direct_upload import get_direct_uploads, DirectUploadError, LocalBackend
+    DIRECT_UPLOAD_AVAILABLE = True
+except ImportError as e:
+    DIRECT_UPLOAD_AVAILABLE = False
+    get_direct_uploads = None
+    print(f"⚠️  浏览器直传不可用: {e}")
+
+try:
+    from hair_preview import get_hair_preview, HairPreviewError
+    HAIR_PREVIEW_AVAILABLE = True
+except ImportError as e:
+    HAIR_PREVIEW_AVAILABLE = False
+    get_hair_preview = None
+    print(f"⚠️  发型叠加预览不可用: {e}")
+
 
 # Flask应用配置
 app = Flask(__name__)
@@ -60,14 +171,53 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['RESULT_FOLDER'], exist_ok=True)
 os.makedirs(app.config['HAIR_EXTRACTED_FOLDER'], exist_ok=True)
 
+# 发型目录: 进程内共用一个实例,索引文件未变化时直接使用内存缓存
+hairstyle_catalog = HairstyleCatalog() if CATALOG_AVAILABLE else None
+
 
 def allowed_file(filename):
     """检查文件扩展名是否允许"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def save_upload_file(file, prefix='image'):
-    """保存上传的文件并预处理"""
+def read_for_face_check(path: str, long_edge: int, detect_edge: int):
+    """
+    按人脸检测所需的尺寸解码: JPEG在解码阶段直接按1/2、1/4、1/8缩小,
+    比全尺寸解码后再缩放省去大部分解码时间和内存
+    
+    Args:
+        path: 图像路径
+        long_edge: 原图长边
+        detect_edge: 检测所需的长边(缩小后不低于此值)
+    
+    Returns:
+        BGR图像,无法读取时为None
+    """
+    for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                         (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if long_edge / factor >= detect_edge:
+            return cv2.imread(path, flag)
+    return cv2.imread(path)
+
+
+def save_upload_file(file, prefix='image', face_check=False, profiles=('facebody',)):
+    """
+    保存上传的文件并预处理
+    
+    Args:
+        file: 上传的文件
+        prefix: 文件名前缀
+        face_check: 是否在预处理前做本地人脸预检(需要人脸的照片)
+        profiles: 需要生成的上游规格(见ImagePreprocessor.PROFILES),一次解码全部生成,
+                  第一个规格的文件作为主文件返回
+    
+    Returns:
+        (filepath, face_report, variants): 主文件路径、人脸预检结果(未预检时为None)、
+        {规格名: 文件路径}(预处理不可用时为空)
+    
+    Raises:
+        FaceValidationError: 人脸预检未通过
+    """
     if not file or not allowed_file(file.filename):
         raise ValueError("不支持的文件格式")
     
@@ -79,30 +229,82 @@ def save_upload_file(file, prefix='image'):
     # 保存原始文件
     file.save(filepath)
     
-    # 图像预处理(如果可用)
-    if PREPROCESSOR_AVAILABLE:
-        try:
-            preprocessor = ImagePreprocessor()
-            processed_path, info = preprocessor.preprocess_image(filepath)
-            
-            print(f"✅ 图像预处理完成:")
-            print(f"   原始: {info['original_size']/1024:.1f}KB")
-            print(f"   最终: {info['final_size']/1024:.1f}KB")
-            
-            # 如果进行了处理,删除原始文件
-            if info['resized'] or info['compressed']:
-                if os.path.exists(filepath) and filepath != processed_path:
-                    os.remove(filepath)
-                return processed_path
-            else:
-                return filepath
-        except Exception as e:
-            print(f"⚠️  图像预处理失败: {e}")
-            print(f"   使用原始文件")
-            return filepath
+    validator = get_face_validator() if (face_check and FACE_VALIDATOR_AVAILABLE) else None
+    if not PREPROCESSOR_AVAILABLE and validator is None:
+        print(f"   跳过预处理(模块不可用)")
+        return filepath, None, {}
+    
+    # 浏览器端已按规格缩放压缩的上传: 只读文件头即可确认,无需全尺寸解码和重新编码
+    compliant = ImagePreprocessor().source_compliance(filepath, profiles) if PREPROCESSOR_AVAILABLE else None
+    if compliant is not None:
+        width, height = compliant[profiles[0]]['width'], compliant[profiles[0]]['height']
+        image = read_for_face_check(filepath, max(width, height), validator.DETECT_LONG_EDGE) if validator else None
     else:
+        # 只解码一次: 人脸预检和各规格生成共用同一份像素
+        image = cv2.imread(filepath)
+        if image is not None:
+            height, width = image.shape[:2]
+    if image is None and (compliant is None or validator is not None):
+        os.remove(filepath)
+        raise ValueError("无法读取图像,文件可能已损坏")
+    
+    # 人脸预检: 在任何付费API调用之前拒绝不合格的照片
+    face_report = None
+    if validator is not None:
+        scale = 1.0
+        if PREPROCESSOR_AVAILABLE:
+            # 人脸框为解码图像(可能是缩小解码)的坐标,换算到预处理后的尺寸
+            target_width, _ = ImagePreprocessor().fit_size(width, height, profiles[0])
+            scale = target_width / image.shape[1]
+        face_report = validator.validate(image, scale)
+        print(f"🙂 人脸预检: {face_report['level']}, {face_report['face_count']}张人脸, {face_report['elapsed_ms']}ms")
+        if face_report['level'] == 'reject':
+            os.remove(filepath)
+            raise FaceValidationError(face_report['messages'][0], face_report)
+    
+    if not PREPROCESSOR_AVAILABLE:
         print(f"   跳过预处理(模块不可用)")
-        return filepath
+        if face_report:
+            validator.save_report(filepath, face_report)
+        return filepath, face_report, {}
+    
+    if compliant is not None:
+        print(f"✅ 上传已符合规格({width}x{height}, {os.path.getsize(filepath)/1024:.1f}KB),跳过预处理")
+        if face_report:
+            validator.save_report(filepath, face_report)
+        return filepath, face_report, {name: info['path'] for name, info in compliant.items()}
+    
+    # 各规格由同一次解码级联生成,优先放到进程池中执行(共享内存传图),不占用请求线程
+    variants = {}
+    try:
+        base, _ = os.path.splitext(filepath)
+        image_pool = get_image_pool() if IMAGE_POOL_AVAILABLE else None
+        if image_pool:
+            generated = image_pool.profiles(image, base, profiles, filepath)
+        else:
+            generated = ImagePreprocessor().generate_profiles(image, base, profiles, filepath)
+        variants = {name: info['path'] for name, info in generated.items()}
+        saved_path = variants[profiles[0]]
+        
+        print(f"✅ 图像预处理完成:")
+        print(f"   原始: {os.path.getsize(filepath)/1024:.1f}KB")
+        for name, info in generated.items():
+            print(f"   {name}: {info['width']}x{info['height']}, {info['size']/1024:.1f}KB")
+        
+        # 原始文件未被任何规格直接使用时删除
+        if filepath not in variants.values():
+            os.remove(filepath)
+    except Exception as e:
+        print(f"⚠️  图像预处理失败: {e}")
+        print(f"   使用原始文件")
+        saved_path = filepath
+        if face_report and scale != 1.0:
+            # 使用原始文件时人脸框需按原图坐标重新计算
+            face_report = validator.validate(image)
+    
+    if face_report:
+        validator.save_report(saved_path, face_report)
+    return saved_path, face_report, variants
 
 
 def upload_to_oss(local_path: str) -> str:
@@ -132,9 +334,9 @@ def upload_to_oss(local_path: str) -> str:
         access_key_id = os.getenv('ALIBABA_CLOUD_ACCESS_KEY_ID')
         access_key_secret = os.getenv('ALIBABA_CLOUD_ACCESS_KEY_SECRET')
         
-        # OSS配置
-        endpoint = 'oss-cn-shanghai.aliyuncs.com'  # 上海区域
-        bucket_name = 'hair-transfer-bucket'        # Bucket名称
+        # OSS配置(可通过环境变量覆盖,压测时指向本地模拟服务)
+        endpoint = os.getenv('OSS_ENDPOINT', 'oss-cn-shanghai.aliyuncs.com')  # 上海区域
+        bucket_name = os.getenv('OSS_BUCKET', 'hair-transfer-bucket')          # Bucket名称
         
         # 检查配置
         if not access_key_id or not access_key_secret:
@@ -173,7 +375,9 @@ def upload_to_oss(local_path: str) -> str:
         
         # ===== 生成公网URL =====
         # 直接拼接URL (需要Bucket设置为公共读)
-        public_url = f'https://{bucket_name}.{endpoint}/{object_name}'
+        # OSS_PUBLIC_BASE_URL用于自定义域名或本地模拟服务(路径风格)
+        public_base = os.getenv('OSS_PUBLIC_BASE_URL', f'https://{bucket_name}.{endpoint}')
+        public_url = f'{public_base.rstrip("/")}/{object_name}'
         
         # 如果需要签名URL (更安全),使用下面的代码:
         # signed_url = bucket.sign_url('GET', object_name, 3600)  # 有效期3600秒
@@ -206,78 +410,388 @@ def upload_to_oss(local_path: str) -> str:
         raise Exception(f"上传失败: {e}")
 
 
+def upload_to_oss_shared(local_path: str, content_hash: Optional[str] = None) -> str:
+    """
+    上传到OSS,相同内容的并发上传(跨线程/进程)合并为一次
+    
+    Args:
+        local_path: 本地文件路径
+        content_hash: 文件内容哈希,未提供时计算
+    
+    Returns:
+        oss_url: OSS公网URL地址
+    """
+    if not SINGLE_FLIGHT_AVAILABLE:
+        return upload_to_oss(local_path)
+    content_hash = content_hash or compute_file_hash(local_path)
+    return get_single_flight().do('oss_upload', content_hash, lambda: upload_to_oss(local_path))
+
+
+def segment_hair_shared(hair_seg, image_url: str, content_hash: str) -> dict:
+    """头发分割,相同发型图的并发分割合并为一次API调用"""
+    if not SINGLE_FLIGHT_AVAILABLE:
+        return hair_seg.segment_hair(image_url=image_url)
+    return get_single_flight().do('segment_hair', content_hash, lambda: hair_seg.segment_hair(image_url=image_url))
+
+
 @app.route('/')
 def index():
     """首页"""
-    return render_template('index.html')
+    # 浏览器端按人脸融合规格缩放压缩后再上传,与服务端预处理使用同一组上限
+    upload_limits = ImagePreprocessor.PROFILES['facebody'] if PREPROCESSOR_AVAILABLE else None
+    return render_template('index.html', upload_limits=upload_limits)
+
+
+class TransferRequestError(Exception):
+    """请求无法处理(参数缺失、上游准备失败等),携带返回给前端的JSON、状态码和响应头"""
+    
+    def __init__(self, payload: dict, status: int, headers: Optional[dict] = None):
+        super().__init__(payload.get('error'))
+        self.payload = payload
+        self.status = status
+        self.headers = headers or {}
+
+
+def admit_request(route: str, files):
+    """
+    内存预算准入: 只读上传图文件头估算本次请求的内存占用,预算不足时排队
+    
+    Args:
+        route: 路由名('extract' / 'transfer')
+        files: 上传文件字典(文件对象需有stream)
+    
+    Returns:
+        预算占用(交给release_admission归还);内存预算不可用时为None
+    
+    Raises:
+        TransferRequestError: 排队已满或等待超时(503 + Retry-After)
+    """
+    if not MEMORY_BUDGET_AVAILABLE:
+        return None
+    estimate = request_estimate(route, files)
+    try:
+        return get_memory_budget().acquire(route, estimate)
+    except MemoryBudgetExceeded as e:
+        raise memory_budget_error(e, route, estimate)
+
+
+async def admit_request_async(route: str, files):
+    """
+    内存预算准入(协程版,异步服务使用): 排队时不占用线程池中的线程
+    
+    Args / Returns / Raises: 同admit_request
+    """
+    if not MEMORY_BUDGET_AVAILABLE:
+        return None
+    # 只读本地文件头,耗时可忽略
+    estimate = request_estimate(route, files)
+    try:
+        return await get_memory_budget().acquire_async(route, estimate)
+    except MemoryBudgetExceeded as e:
+        raise memory_budget_error(e, route, estimate)
+
+
+def request_estimate(route: str, files) -> int:
+    """按上传图文件头和大小估算本次请求的内存占用(字节)"""
+    dimensions, body_bytes = [], 0
+    for upload in files.values():
+        size = image_dimensions(upload.stream)
+        if size:
+            dimensions.append(size)
+        upload.stream.seek(0, os.SEEK_END)
+        body_bytes += upload.stream.tell()
+        upload.stream.seek(0)
+    return estimate_request(route, dimensions, body_bytes)['total']
+
+
+def memory_budget_error(e, route: str, estimate: int) -> TransferRequestError:
+    """内存预算拒绝 -> 503 + Retry-After"""
+    print(f"🚫 内存预算不足,拒绝请求: {route} ({estimate / 1024 / 1024:.0f}MB)")
+    return TransferRequestError(
+        {'error': str(e), 'retry_after': e.retry_after}, 503, {'Retry-After': str(e.retry_after)}
+    )
+
+
+def release_admission(reservation):
+    """归还admit_request占用的内存预算"""
+    if reservation is not None:
+        get_memory_budget().release(reservation)
+
+
+# 直传对象键字段 -> 对应的上传文件字段
+DIRECT_UPLOAD_FIELDS = {
+    'hairstyle_key': 'hairstyle_image',
+    'customer_key': 'customer_image',
+}
+
+
+def resolve_direct_uploads(form, files) -> dict:
+    """
+    把浏览器直传的对象键换成本地文件(与上传文件接口相同),未直传的字段原样保留
+    
+    Args:
+        form: 表单字典(可含hairstyle_key / customer_key)
+        files: 上传文件字典
+    
+    Returns:
+        dict: {字段名: 上传文件或StoredUpload},请求结束后交给close_direct_uploads
+    
+    Raises:
+        DirectUploadError(ValueError): 对象键无效、对象不存在或过大
+    """
+    resolved = files.to_dict() if hasattr(files, 'to_dict') else dict(files)
+    for key_field, file_field in DIRECT_UPLOAD_FIELDS.items():
+        key = form.get(key_field)
+        if not key or file_field in resolved:
+            continue
+        if not DIRECT_UPLOAD_AVAILABLE:
+            raise TransferRequestError({'error': '浏览器直传不可用,请直接上传文件'}, 503)
+        try:
+            resolved[file_field] = get_direct_uploads().open(key, app.config['UPLOAD_FOLDER'])
+        except Exception:
+            close_direct_uploads(resolved)
+            raise
+    return resolved
+
+
+def close_direct_uploads(files: dict):
+    """清理直传文件的临时副本(已保存到上传目录的不受影响)"""
+    for upload in files.values():
+        if hasattr(upload, 'object_url'):
+            upload.close()
+
+
+@contextmanager
+def memory_admission(route: str, files):
+    """admit_request/release_admission的上下文管理器形式(Flask路由使用)"""
+    reservation = admit_request(route, files)
+    try:
+        yield reservation
+    finally:
+        release_admission(reservation)
+
+
+def request_tenant(headers, form) -> tuple:
+    """
+    识别请求所属租户与优先级
+    
+    租户依次取 X-Tenant-ID 请求头、表单tenant字段、X-API-Key(取哈希),都没有时为default;
+    优先级取 X-Priority 请求头或表单priority字段,默认interactive(店内实时请求)
+    
+    Returns:
+        (tenant, priority)
+    """
+    tenant = headers.get('X-Tenant-ID') or form.get('tenant')
+    if not tenant and headers.get('X-API-Key'):
+        tenant = 'key-' + hashlib.sha256(headers['X-API-Key'].encode('utf-8')).hexdigest()[:12]
+    priority = (headers.get('X-Priority') or form.get('priority') or 'interactive').lower()
+    if TRANSFER_SCHEDULER_AVAILABLE and priority not in PRIORITIES:
+        raise TransferRequestError({'error': f'未知的优先级: {priority}'}, 400)
+    return (tenant or 'default')[:64], priority
+
+
+def acquire_transfer_slot(headers, form):
+    """
+    领取迁移执行槽位(实时请求优先,同一优先级内按租户加权公平排队)
+    
+    Returns:
+        槽位(交给release_transfer_slot归还);调度器不可用时为None
+    
+    Raises:
+        TransferRequestError: 队列已满或等待超时(429 + Retry-After)
+    """
+    if not TRANSFER_SCHEDULER_AVAILABLE:
+        return None
+    tenant, priority = request_tenant(headers, form)
+    try:
+        return get_transfer_scheduler().acquire(tenant, priority)
+    except SchedulerBusy as e:
+        raise scheduler_busy_error(e, tenant, priority)
+
+
+async def acquire_transfer_slot_async(headers, form):
+    """
+    领取迁移执行槽位(协程版,异步服务使用): 排队时不占用线程池中的线程
+    
+    Returns / Raises: 同acquire_transfer_slot
+    """
+    if not TRANSFER_SCHEDULER_AVAILABLE:
+        return None
+    tenant, priority = request_tenant(headers, form)
+    try:
+        return await get_transfer_scheduler().acquire_async(tenant, priority)
+    except SchedulerBusy as e:
+        raise scheduler_busy_error(e, tenant, priority)
+
+
+def scheduler_busy_error(e, tenant: str, priority: str) -> TransferRequestError:
+    """调度器拒绝 -> 429 + Retry-After"""
+    print(f"🚫 迁移队列已满,拒绝请求: {tenant} ({priority})")
+    return TransferRequestError(
+        {'error': str(e), 'retry_after': e.retry_after}, 429, {'Retry-After': str(e.retry_after)}
+    )
+
+
+def release_transfer_slot(ticket):
+    """归还acquire_transfer_slot领取的槽位"""
+    if ticket is not None:
+        get_transfer_scheduler().release(ticket)
+
+
+@contextmanager
+def transfer_slot(headers, form):
+    """acquire_transfer_slot/release_transfer_slot的上下文管理器形式(Flask路由使用)"""
+    ticket = acquire_transfer_slot(headers, form)
+    try:
+        yield ticket
+    finally:
+        release_transfer_slot(ticket)
+
+
+def prepare_extract(files) -> dict:
+    """
+    发型提取的同步准备阶段: 保存发型图、人脸预检、生成规格并上传分割规格到OSS
+    
+    Flask和异步服务(asgi_app.py)共用,返回给前端的错误保持一致
+    
+    Args:
+        files: 上传文件字典(需含hairstyle_image)
+    
+    Returns:
+        dict: {'hairstyle_path', 'face_check', 'segment_path', 'segment_url', 'segment_key'}
+    
+    Raises:
+        TransferRequestError: 模块不可用/缺少文件/OSS上传失败
+        FaceValidationError: 人脸预检未通过
+    """
+    # 检查头发分割模块是否可用
+    if not HAIR_SEG_AVAILABLE:
+        raise TransferRequestError({
+            'error': '头发分割功能不可用',
+            'message': '请检查hair_segmentation模块是否正确安装'
+        }, 503)
+    
+    # 检查文件
+    if 'hairstyle_image' not in files:
+        raise TransferRequestError({'error': '缺少发型参考图'}, 400)
+    
+    hairstyle_file = files['hairstyle_image']
+    
+    # 保存上传的文件
+    print(f"\n📤 保存发型参考图...")
+    # 发型图会用于创建人脸融合模板,同样需要一张清晰的人脸
+    # 同时生成头发分割用的较小规格,分割请求只上传所需大小
+    hairstyle_path, hairstyle_face, hairstyle_variants = save_upload_file(
+        hairstyle_file, 'hairstyle', face_check=True, profiles=('facebody', 'imageseg')
+    )
+    print(f"   发型图: {hairstyle_path}")
+    segment_path = hairstyle_variants.get('imageseg', hairstyle_path)
+    segment_key = compute_file_hash(segment_path)
+    
+    # 上传分割规格到OSS获取URL(热门发型的并发上传合并为一次)
+    print(f"\n☁️  上传到OSS...")
+    try:
+        if getattr(hairstyle_file, 'object_url', None) and segment_path == hairstyle_file.saved_path:
+            # 浏览器已直传到OSS且原图即可用于分割: 直接使用该对象
+            segment_url = hairstyle_file.object_url
+        else:
+            segment_url = upload_to_oss_shared(segment_path, segment_key)
+    except Exception as e:
+        raise TransferRequestError({
+            'error': 'OSS上传失败',
+            'message': str(e)
+        }, 500)
+    
+    return {
+        'hairstyle_path': hairstyle_path,
+        'face_check': hairstyle_face,
+        'segment_path': segment_path,
+        'segment_url': segment_url,
+        'segment_key': segment_key,
+    }
+
+
+def new_extracted_path() -> str:
+    """提取结果的保存路径"""
+    output_filename = f"hair_extracted_{uuid.uuid4().hex[:8]}.png"
+    return os.path.join(app.config['HAIR_EXTRACTED_FOLDER'], output_filename)
+
+
+def save_hair_layout(job: dict, result: dict, extracted_path: str):
+    """
+    保存头发图的位置和参考图人脸(旁路文件),供发型叠加预览对齐使用
+    
+    Args:
+        job: prepare_extract的返回
+        result: 头发分割结果(含头发框 x/y/width/height,分割输入图坐标)
+        extracted_path: 提取的头发图路径
+    """
+    face_check = job.get('face_check')
+    box = [result.get(k) for k in ('x', 'y', 'width', 'height')]
+    if not HAIR_PREVIEW_AVAILABLE or not face_check or not face_check['faces'] or None in box:
+        return
+    try:
+        # 人脸框为参考图(人脸融合规格)坐标,头发框为分割规格坐标
+        with Image.open(job['segment_path']) as segment, Image.open(job['hairstyle_path']) as reference:
+            scale = segment.width / reference.width
+        get_hair_preview().save_layout(extracted_path, box, face_check['faces'][0], scale)
+    except Exception as e:
+        print(f"⚠️  保存发型位置失败(不影响提取): {e}")
+
+
+def build_extract_response(job: dict, extracted_path: str, result: dict) -> dict:
+    """发型提取成功的返回数据"""
+    print(f"✅ 发型提取成功!")
+    print(f"   提取的发型: {extracted_path}")
+    save_hair_layout(job, result, extracted_path)
+    
+    original_filename = os.path.basename(job['hairstyle_path'])
+    extracted_filename = os.path.basename(extracted_path)
+    
+    return {
+        'success': True,
+        'original_url': f'/static/uploads/{original_filename}',
+        'extracted_url': f'/static/hair_extracted/{extracted_filename}',
+        'face_check': job['face_check'],
+        'message': '发型提取成功'
+    }
 
 
 @app.route('/api/extract-hair', methods=['POST'])
 def extract_hair():
     """提取发型API"""
+    files = {}
     try:
-        # 检查头发分割模块是否可用
-        if not HAIR_SEG_AVAILABLE:
-            return jsonify({
-                'error': '头发分割功能不可用',
-                'message': '请检查hair_segmentation模块是否正确安装'
-            }), 503
-        
-        # 检查文件
-        if 'hairstyle_image' not in request.files:
-            return jsonify({'error': '缺少发型参考图'}), 400
-        
-        hairstyle_file = request.files['hairstyle_image']
+        # 浏览器直传的发型图按对象键取回
+        files = resolve_direct_uploads(request.form, request.files)
+        # 解码上传图之前按内存预算准入
+        with memory_admission('extract', files):
+            job = prepare_extract(files)
         
-        # 保存上传的文件
-        print(f"\n📤 保存发型参考图...")
-        hairstyle_path = save_upload_file(hairstyle_file, 'hairstyle')
-        print(f"   发型图: {hairstyle_path}")
+            # 提取发型
+            print(f"\n✂️  提取发型...")
+            hair_seg = HairSegmentation()
         
-        # 上传到OSS获取URL
-        print(f"\n☁️  上传到OSS...")
-        try:
-            hairstyle_url = upload_to_oss(hairstyle_path)
-        except Exception as e:
-            return jsonify({
-                'error': 'OSS上传失败',
-                'message': str(e)
-            }), 500
-        
-        # 提取发型
-        print(f"\n✂️  提取发型...")
-        hair_seg = HairSegmentation()
-        
-        # 调用头发分割API
-        result = hair_seg.segment_hair(image_url=hairstyle_url)
-        
-        if not result['success']:
-            return jsonify({
-                'error': '发型提取失败',
-                'message': result['message']
-            }), 500
-        
-        # 下载提取的发型图
-        print(f"\n📥 下载提取的发型...")
-        output_filename = f"hair_extracted_{uuid.uuid4().hex[:8]}.png"
-        extracted_path = os.path.join(app.config['HAIR_EXTRACTED_FOLDER'], output_filename)
+            # 调用头发分割API(相同发型图的并发请求共享结果)
+            result = segment_hair_shared(hair_seg, job['segment_url'], job['segment_key'])
         
-        hair_seg.download_hair_image(result['hair_url'], extracted_path)
+            if not result['success']:
+                return jsonify({
+                    'error': '发型提取失败',
+                    'message': result['message']
+                }), 500
         
-        print(f"✅ 发型提取成功!")
-        print(f"   提取的发型: {extracted_path}")
+            # 下载提取的发型图
+            print(f"\n📥 下载提取的发型...")
+            extracted_path = new_extracted_path()
+            hair_seg.download_hair_image(result['hair_url'], extracted_path)
         
-        # 返回结果
-        original_filename = os.path.basename(hairstyle_path)
-        extracted_filename = os.path.basename(extracted_path)
-        
-        return jsonify({
-            'success': True,
-            'original_url': f'/static/uploads/{original_filename}',
-            'extracted_url': f'/static/hair_extracted/{extracted_filename}',
-            'message': '发型提取成功'
-        })
+            return jsonify(build_extract_response(job, extracted_path, result))
         
+    except TransferRequestError as e:
+        return jsonify(e.payload), e.status, e.headers
+    except FaceValidationError as e:
+        return jsonify({'error': str(e), 'face_check': e.report}), 422
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
     except Exception as e:
@@ -285,119 +799,658 @@ def extract_hair():
         import traceback
         traceback.print_exc()
         return jsonify({'error': f'发型提取失败: {str(e)}'}), 500
+    finally:
+        close_direct_uploads(files)
 
 
-@app.route('/api/transfer', methods=['POST'])
-def transfer_hairstyle():
-    """发型迁移API"""
-    try:
-        # 检查文件
-        if 'customer_image' not in request.files:
-            return jsonify({'error': '缺少客户照片'}), 400
-        
-        # 检查是否提供了原始发型图路径
-        original_hair_url = request.form.get('original_hair_url')
-        if not original_hair_url:
-            return jsonify({'error': '缺少原始发型图'}), 400
-        
-        customer_file = request.files['customer_image']
-        
-        # 保存客户照片
-        print(f"\n📤 保存客户照片...")
-        customer_path = save_upload_file(customer_file, 'customer')
-        print(f"   客户图: {customer_path}")
-        
+def prepare_transfer(form, files) -> dict:
+    """
+    发型迁移的同步准备阶段: 校验参数、保存客户照片、上传OSS
+    
+    Flask和异步服务(asgi_app.py)共用,返回给前端的错误保持一致
+    
+    Args:
+        form: 表单字典
+        files: 上传文件字典(需含customer_image)
+    
+    Returns:
+        dict: {'transfer_args': transfer_hairstyle的参数, 'catalog_id', 'customer_face',
+               'model_version', 'enable_sketch', 'sketch_style'}
+    
+    Raises:
+        TransferRequestError: 参数缺失/发型不存在/OSS未配置
+        FaceValidationError: 人脸预检未通过
+        ValueError: 文件格式或参数不合法
+    """
+    # 检查文件
+    if 'customer_image' not in files:
+        raise TransferRequestError({'error': '缺少客户照片'}, 400)
+    
+    # 检查是否提供了原始发型图路径或发型目录ID
+    original_hair_url = form.get('original_hair_url')
+    catalog_id = form.get('catalog_id')
+    if not original_hair_url and not catalog_id:
+        raise TransferRequestError({'error': '缺少原始发型图'}, 400)
+    
+    # 发型目录: 已预处理、已上传、已建模板,只需处理客户照片
+    catalog_entry = None
+    if catalog_id:
+        catalog_entry = hairstyle_catalog.get(catalog_id) if CATALOG_AVAILABLE else None
+        if not catalog_entry:
+            raise TransferRequestError({'error': f'发型目录中不存在: {catalog_id}'}, 404)
+    
+    customer_file = files['customer_image']
+    
+    # 保存客户照片
+    print(f"\n📤 保存客户照片...")
+    customer_path, customer_face, _ = save_upload_file(customer_file, 'customer', face_check=True)
+    print(f"   客户图: {customer_path}")
+    
+    if catalog_entry:
+        print(f"   发型(目录): {catalog_id}")
+    else:
         # 从URL获取原始发型图本地路径
         # original_hair_url格式: /static/uploads/xxxx.jpg
         original_filename = original_hair_url.split('/')[-1]
         hairstyle_path = os.path.join(app.config['UPLOAD_FOLDER'], original_filename)
         
         if not os.path.exists(hairstyle_path):
-            return jsonify({'error': '原始发型图不存在,请重新上传'}), 400
+            raise TransferRequestError({'error': '原始发型图不存在,请重新上传'}, 400)
         
         print(f"   发型图(原始): {hairstyle_path}")
-        
-        # 上传到OSS获取URL
-        print(f"\n☁️  上传到OSS...")
+    
+    # 上传到OSS获取URL
+    print(f"\n☁️  上传到OSS...")
+    try:
+        if catalog_entry:
+            hairstyle_url = catalog_entry['oss_url']
+            hairstyle_key = catalog_entry['content_hash']
+        else:
+            hairstyle_key = compute_file_hash(hairstyle_path)
+            hairstyle_url = upload_to_oss_shared(hairstyle_path, hairstyle_key)  # 使用原始发型图
+        if getattr(customer_file, 'object_url', None) and customer_path == customer_file.saved_path:
+            # 浏览器已直传到OSS且原图无需重新编码: 直接使用该对象,不再转传
+            customer_url = customer_file.object_url
+            print(f"   客户图(直传): {customer_url}")
+        else:
+            customer_url = upload_to_oss_shared(customer_path)
+    except NotImplementedError as e:
+        raise TransferRequestError({
+            'error': '请先配置OSS上传功能',
+            'message': str(e),
+            'help': '阿里云API需要公网可访问的图像URL,请配置OSS后重试'
+        }, 501)
+    
+    # 获取参数
+    model_version = form.get('model_version', 'v1')
+    face_blend_ratio = float(form.get('face_blend_ratio', '0.5'))
+    enable_sketch = form.get('enable_sketch', 'false').lower() == 'true'
+    sketch_style = form.get('sketch_style', 'artistic')
+    
+    # 检查素描功能是否可用
+    if enable_sketch and not SKETCH_AVAILABLE:
+        print(f"\n⚠️  素描模块不可用,将跳过素描转换")
+        enable_sketch = False
+    
+    print(f"\n⚙️  处理参数:")
+    print(f"   模型版本: {model_version}")
+    print(f"   脸型融合权重: {face_blend_ratio}")
+    print(f"   素描效果: {enable_sketch}")
+    if enable_sketch:
+        print(f"   素描风格: {sketch_style}")
+    
+    return {
+        'transfer_args': {
+            'hairstyle_image_url': hairstyle_url,
+            'customer_image_url': customer_url,
+            'model_version': model_version,
+            'face_blend_ratio': face_blend_ratio,
+            'save_dir': app.config['RESULT_FOLDER'],
+            'enable_sketch': enable_sketch,
+            'sketch_style': sketch_style,
+            'hairstyle_key': hairstyle_key,
+            'template_id': catalog_entry['template_id'] if catalog_entry else None,
+        },
+        'catalog_id': catalog_id if catalog_entry else None,
+        'customer_face': customer_face,
+        'model_version': model_version,
+        'enable_sketch': enable_sketch,
+        'sketch_style': sketch_style,
+    }
+
+
+def build_transfer_response(job: dict, info: dict) -> dict:
+    """
+    发型迁移成功的返回数据(含多规格结果图,CPU密集,异步服务中在线程池执行)
+    
+    Args:
+        job: prepare_transfer的返回值
+        info: transfer_hairstyle返回的处理信息
+    """
+    # 返回结果
+    result_filename = os.path.basename(info['save_path'])
+    result_url = f'/static/results/{result_filename}'
+    
+    # 构建返回信息
+    response_data = {
+        'success': True,
+        'result_url': result_url,
+        'info': {
+            'elapsed_time': info['elapsed_time'],
+            'template_id': info['template_id'],
+            'model_version': job['model_version']
+        }
+    }
+    if job['catalog_id']:
+        response_data['info']['catalog_id'] = job['catalog_id']
+    if job['customer_face']:
+        response_data['face_check'] = job['customer_face']
+    
+    # 人脸融合结果URL,可用于多风格素描预览
+    if info.get('result_url'):
+        response_data['merge_url'] = info['result_url']
+    
+    # 生成多规格结果图(预览/屏幕尺寸/原图),结果与素描并行生成
+    if RENDITIONS_AVAILABLE:
         try:
-            hairstyle_url = upload_to_oss(hairstyle_path)  # 使用原始发型图
-            customer_url = upload_to_oss(customer_path)
-        except NotImplementedError as e:
-            return jsonify({
-                'error': '请先配置OSS上传功能',
-                'message': str(e),
-                'help': '阿里云API需要公网可访问的图像URL,请配置OSS后重试'
-            }), 501
+            rendition_paths = [info['save_path']]
+            if 'sketch_path' in info:
+                rendition_paths.append(info['sketch_path'])
+            renditions = ResultRenditions().generate_many(rendition_paths)
+            response_data['renditions'] = renditions[0]
+            if len(renditions) > 1:
+                response_data['sketch_renditions'] = renditions[1]
+        except Exception as e:
+            print(f"⚠️  多规格结果图生成失败: {e}")
+    
+    # 添加素描信息
+    if job['enable_sketch']:
+        response_data['info']['sketch_enabled'] = True
+        response_data['info']['sketch_style'] = job['sketch_style']
+        response_data['info']['sketch_method'] = info.get('sketch_method', 'unknown')
         
-        # 获取参数
-        model_version = request.form.get('model_version', 'v1')
-        face_blend_ratio = float(request.form.get('face_blend_ratio', '0.5'))
-        enable_sketch = request.form.get('enable_sketch', 'false').lower() == 'true'
-        sketch_style = request.form.get('sketch_style', 'artistic')
+        # 如果有素描图片，添加URL
+        if 'sketch_path' in info:
+            sketch_filename = os.path.basename(info['sketch_path'])
+            response_data['sketch_url'] = f'/static/results/{sketch_filename}'
+            print(f"✅ 素描图片URL: {response_data['sketch_url']}")
+    
+    return response_data
+
+
+def create_transfer_checkpoint(job: dict):
+    """
+    登记发型迁移任务(参数中已含上传到OSS的URL),返回检查点;任务存储不可用时返回None
+    
+    进程在处理中途退出时,恢复工作线程从最后完成的阶段继续(见run_transfer_job)
+    """
+    if not JOB_STORE_AVAILABLE:
+        return None
+    try:
+        return get_job_store().create('transfer', job, stage='uploaded')
+    except Exception as e:
+        print(f"⚠️  任务登记失败,本次不做检查点: {e}")
+        return None
+
+
+def run_transfer_job(job: dict, checkpoint) -> dict:
+    """恢复执行发型迁移任务(跳过已完成的阶段),返回与 /api/transfer 相同的结果"""
+    service = AliyunHairTransferFixed()
+    _, info = service.transfer_hairstyle(**job['transfer_args'], checkpoint=checkpoint)
+    response_data = build_transfer_response(job, info)
+    response_data['job_id'] = checkpoint.job_id
+    return response_data
+
+
+# 任务类型 -> 恢复处理函数(job_store.py worker 使用)
+JOB_HANDLERS = {'transfer': run_transfer_job}
+
+
+@app.route('/api/transfer', methods=['POST'])
+def transfer_hairstyle():
+    """发型迁移API"""
+    files = {}
+    try:
+        # 先按优先级/租户领取执行槽位,再在解码上传图之前按内存预算准入
+        with transfer_slot(request.headers, request.form):
+            # 浏览器直传的客户照片按对象键取回
+            files = resolve_direct_uploads(request.form, request.files)
+            with memory_admission('transfer', files):
+                job = prepare_transfer(request.form, files)
+                checkpoint = create_transfer_checkpoint(job)
         
-        # 检查素描功能是否可用
-        if enable_sketch and not SKETCH_AVAILABLE:
-            print(f"\n⚠️  素描模块不可用,将跳过素描转换")
-            enable_sketch = False
+                # 创建发型迁移服务(修复版)
+                print(f"\n🔧 初始化服务...")
+                service = AliyunHairTransferFixed()
         
-        print(f"\n⚙️  处理参数:")
-        print(f"   模型版本: {model_version}")
-        print(f"   脸型融合权重: {face_blend_ratio}")
-        print(f"   素描效果: {enable_sketch}")
-        if enable_sketch:
-            print(f"   素描风格: {sketch_style}")
+                # 执行发型迁移(各阶段产出写入检查点)
+                try:
+                    result_image, info = service.transfer_hairstyle(**job['transfer_args'], checkpoint=checkpoint)
+                    response_data = build_transfer_response(job, info)
+                except Exception as e:
+                    if checkpoint:
+                        checkpoint.fail(str(e))
+                    raise
+                if checkpoint:
+                    response_data['job_id'] = checkpoint.job_id
+                    checkpoint.complete(response_data)
         
-        # 创建发型迁移服务(修复版)
-        print(f"\n🔧 初始化服务...")
-        service = AliyunHairTransferFixed()
+                return jsonify(response_data)
         
-        # 执行发型迁移
-        result_image, info = service.transfer_hairstyle(
-            hairstyle_image_url=hairstyle_url,
-            customer_image_url=customer_url,
-            model_version=model_version,
-            face_blend_ratio=face_blend_ratio,
-            save_dir=app.config['RESULT_FOLDER'],
-            enable_sketch=enable_sketch,
-            sketch_style=sketch_style
+    except TransferRequestError as e:
+        return jsonify(e.payload), e.status, e.headers
+    except FaceValidationError as e:
+        return jsonify({'error': str(e), 'face_check': e.report}), 422
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"❌ 处理失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': f'处理失败: {str(e)}'}), 500
+    finally:
+        close_direct_uploads(files)
+
+
+@app.route('/api/upload-url', methods=['POST'])
+def create_upload_url():
+    """
+    签发浏览器直传地址: 浏览器PUT到返回的upload_url,之后接口只需提交key
+    (发型提取用hairstyle_key,发型迁移用customer_key)
+    """
+    if not DIRECT_UPLOAD_AVAILABLE or os.getenv('DIRECT_UPLOAD', '1') == '0':
+        return jsonify({'error': '浏览器直传不可用'}), 503
+    params = request.get_json(silent=True) or request.form
+    size = params.get('size')
+    try:
+        ticket = get_direct_uploads().create(
+            filename=params.get('filename', ''),
+            content_type=params.get('content_type', ''),
+            size=int(size) if size not in (None, '') else None
         )
+    except DirectUploadError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"❌ 签发直传地址失败: {e}")
+        return jsonify({'error': f'签发直传地址失败: {str(e)}'}), 503
+    return jsonify(ticket)
+
+
+@app.route('/storage/<path:key>', methods=['PUT'])
+def storage_put(key):
+    """本地直传替身(未配置OSS时): 校验签名后保存浏览器上传的文件"""
+    if not DIRECT_UPLOAD_AVAILABLE:
+        return jsonify({'error': '浏览器直传不可用'}), 503
+    uploads = get_direct_uploads()
+    backend = uploads.backend
+    if not isinstance(backend, LocalBackend):
+        return jsonify({'error': '当前直传后端不是本地存储'}), 404
+    if not backend.verify(key, request.content_type or '', request.args.get('expires', ''),
+                          request.args.get('signature', '')):
+        return jsonify({'error': '签名无效或已过期'}), 403
+    try:
+        size = backend.store(key, request.stream, uploads.max_bytes)
+    except DirectUploadError as e:
+        return jsonify({'error': str(e)}), 413
+    return jsonify({'success': True, 'key': key, 'size': size})
+
+
+# 发型叠加预览的平移范围(单位为眼距): 超出后发型已完全移出人脸,没有预览意义
+PREVIEW_MAX_OFFSET = 5.0
+
+
+def preview_param(form, name: str, default: float, low: float, high: float) -> float:
+    """
+    读取发型叠加预览的数值参数并限制到 [low, high]
+
+    Raises:
+        ValueError: 不是有限数值(如 abc、inf、nan)
+    """
+    raw = form.get(name, default)
+    try:
+        value = float(raw)
+    except (TypeError, ValueError):
+        value = math.nan
+    if not math.isfinite(value):
+        raise ValueError(f'参数{name}无效: {raw}')
+    return min(high, max(low, value))
+
+
+@app.route('/api/preview-hair', methods=['POST'])
+def preview_hair():
+    """
+    发型叠加预览: 把已提取的发型按人脸关键点叠加到客户照片上,直接返回JPEG
+    
+    纯本地计算(不调用上游、不保存文件),造型师可反复调整后再提交付费的发型迁移
+    
+    表单参数:
+        customer_image / customer_key: 客户照片(上传或直传对象键)
+        extracted_url: 发型提取返回的extracted_url
+        scale: 额外缩放,默认1.0
+        offset_x / offset_y: 额外平移,单位为眼距,默认0,限制在±5以内
+    """
+    if not HAIR_PREVIEW_AVAILABLE:
+        return jsonify({'error': '发型叠加预览不可用'}), 503
+    
+    files = {}
+    try:
+        files = resolve_direct_uploads(request.form, request.files)
+        customer_file = files.get('customer_image')
+        if not customer_file or not allowed_file(customer_file.filename):
+            return jsonify({'error': '缺少客户照片'}), 400
+        extracted_url = request.form.get('extracted_url', '')
+        hair_path = os.path.join(app.config['HAIR_EXTRACTED_FOLDER'], os.path.basename(extracted_url))
+        if not extracted_url or not os.path.isfile(hair_path):
+            return jsonify({'error': '缺少已提取的发型'}), 400
+        scale = preview_param(request.form, 'scale', 1.0, 0.5, 2.0)
+        offset = (preview_param(request.form, 'offset_x', 0.0, -PREVIEW_MAX_OFFSET, PREVIEW_MAX_OFFSET),
+                  preview_param(request.form, 'offset_y', 0.0, -PREVIEW_MAX_OFFSET, PREVIEW_MAX_OFFSET))
         
-        # 返回结果
-        result_filename = os.path.basename(info['save_path'])
-        result_url = f'/static/results/{result_filename}'
-        
-        # 构建返回信息
-        response_data = {
-            'success': True,
-            'result_url': result_url,
-            'info': {
-                'elapsed_time': info['elapsed_time'],
-                'template_id': info['template_id'],
-                'model_version': model_version
-            }
-        }
-        
-        # 添加素描信息
-        if enable_sketch:
-            response_data['info']['sketch_enabled'] = True
-            response_data['info']['sketch_style'] = sketch_style
-            response_data['info']['sketch_method'] = info.get('sketch_method', 'unknown')
-            
-            # 如果有素描图片，添加URL
-            if 'sketch_path' in info:
-                sketch_filename = os.path.basename(info['sketch_path'])
-                response_data['sketch_url'] = f'/static/results/{sketch_filename}'
-                print(f"✅ 素描图片URL: {response_data['sketch_url']}")
-        
+        data, info = get_hair_preview().render(customer_file.stream.read(), hair_path, scale, offset)
+        print(f"⚡ 发型叠加预览: {info['width']}x{info['height']}, {info['elapsed_ms']}ms")
+        response = Response(data, mimetype='image/jpeg')
+        response.headers['X-Preview-Ms'] = str(info['elapsed_ms'])
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    except TransferRequestError as e:
+        return jsonify(e.payload), e.status, e.headers
+    except HairPreviewError as e:
+        return jsonify({'error': str(e)}), 422
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"❌ 发型叠加预览错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': f'发型叠加预览失败: {str(e)}'}), 500
+    finally:
+        close_direct_uploads(files)
+
+
+# 本地素描两阶段预览: 最近解码的融合结果(切换风格时不重复解码)与正在后台渲染的完整结果
+SKETCH_SOURCE_CACHE_SIZE = int(os.getenv('SKETCH_SOURCE_CACHE', '2'))
+SKETCH_TOKEN_PATTERN = re.compile(r'^[0-9A-Za-z]+_[a-z]+$')
+_sketch_sources = OrderedDict()
+_sketch_finalizing = set()
+_sketch_lock = threading.Lock()
+
+
+def load_sketch_source(path: str) -> np.ndarray:
+    """读取融合结果(按路径和修改时间缓存最近几张)"""
+    key = (path, os.path.getmtime(path))
+    with _sketch_lock:
+        if key in _sketch_sources:
+            _sketch_sources.move_to_end(key)
+            return _sketch_sources[key]
+    image = cv2.imread(path)
+    if image is None:
+        raise ValueError("无法读取融合结果")
+    with _sketch_lock:
+        _sketch_sources[key] = image
+        while len(_sketch_sources) > SKETCH_SOURCE_CACHE_SIZE:
+            _sketch_sources.popitem(last=False)
+    return image
+
+
+def sketch_preview_paths(token: str) -> dict:
+    """两阶段素描的文件路径: 预览图、完整结果、失败标记"""
+    final_path = os.path.join(app.config['RESULT_FOLDER'], f'sketch_local_{token}.png')
+    return {
+        'preview': os.path.join(app.config['RESULT_FOLDER'], f'sketch_local_{token}_preview.jpg'),
+        'final': final_path,
+        'error': final_path + '.error',
+    }
+
+
+def finalize_sketch(token: str, future):
+    """后台完整渲染完成: 先写临时文件再原子替换,轮询方只会看到完整文件"""
+    paths = sketch_preview_paths(token)
+    try:
+        sketch = future.result()
+        part_path = f"{paths['final']}.{threading.get_ident()}.part.png"
+        cv2.imwrite(part_path, sketch)
+        os.replace(part_path, paths['final'])
+        print(f"✅ 素描完整结果: {paths['final']}")
+    except Exception as e:
+        print(f"❌ 素描完整渲染失败: {e}")
+        with open(paths['error'], 'w', encoding='utf-8') as f:
+            f.write(str(e))
+    finally:
+        with _sketch_lock:
+            _sketch_finalizing.discard(token)
+
+
+@app.route('/api/sketch-preview', methods=['POST'])
+def sketch_preview():
+    """
+    本地素描两阶段预览: 立即返回低分辨率预览,完整分辨率在后台渲染
+    
+    浏览风格时等待时间与融合结果分辨率基本无关;完整结果完成后
+    GET status_url 返回 ready=true 和 sketch_url,页面替换显示
+    
+    表单参数:
+        result_url: 融合结果(/static/results/xxx.png)
+        style: 本地素描风格(pencil/detailed/artistic/color)
+    """
+    if not SKETCH_AVAILABLE:
+        return jsonify({'error': '本地素描转换器不可用'}), 503
+    
+    style = request.form.get('style', 'pencil')
+    if style not in SketchConverter.STYLES:
+        return jsonify({'error': f'未知的素描风格: {style}'}), 400
+    result_url = request.form.get('result_url', '')
+    result_path = os.path.join(app.config['RESULT_FOLDER'], os.path.basename(result_url))
+    if not result_url or not os.path.isfile(result_path):
+        return jsonify({'error': '缺少融合结果'}), 400
+    
+    stem = re.sub(r'[^0-9A-Za-z]', '', os.path.splitext(os.path.basename(result_path))[0])
+    token = f'{stem}_{style}'
+    paths = sketch_preview_paths(token)
+    response_data = {
+        'success': True,
+        'style': style,
+        'sketch_url': f"/static/results/{os.path.basename(paths['final'])}",
+        'status_url': f'/api/sketch-preview/{token}',
+    }
+    if os.path.exists(paths['final']):
+        # 该风格已渲染过: 直接返回完整结果
+        response_data.update(ready=True, preview_url=response_data['sketch_url'], preview_ms=0)
         return jsonify(response_data)
-        
+    
+    with _sketch_lock:
+        # 同一结果同一风格只在后台渲染一次,重复请求只生成预览
+        first = token not in _sketch_finalizing
+        _sketch_finalizing.add(token)
+    # 完整渲染已交给后台(由finalize_sketch移除标记)之前出错时,这里移除标记,否则该风格再也不会渲染
+    scheduled = False
+    try:
+        image = load_sketch_source(result_path)
+        converter = SketchConverter()
+        if first:
+            if os.path.exists(paths['error']):
+                os.remove(paths['error'])
+            job = converter.convert(image, style, preview=True)
+            job.add_done_callback(lambda future: finalize_sketch(token, future))
+            scheduled = True
+            preview, preview_ms = job.preview, job.elapsed_ms
+        else:
+            start = time.time()
+            preview, _ = converter.convert_preview(image, style)
+            preview_ms = round((time.time() - start) * 1000, 1)
+        cv2.imwrite(paths['preview'], preview, [cv2.IMWRITE_JPEG_QUALITY, 85])
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
     except Exception as e:
-        print(f"❌ 处理失败: {e}")
+        print(f"❌ 素描预览失败: {e}")
         import traceback
         traceback.print_exc()
-        return jsonify({'error': f'处理失败: {str(e)}'}), 500
+        return jsonify({'error': f'素描预览失败: {str(e)}'}), 500
+    finally:
+        if first and not scheduled:
+            with _sketch_lock:
+                _sketch_finalizing.discard(token)
+    
+    response_data.update(
+        ready=False,
+        preview_url=f"/static/results/{os.path.basename(paths['preview'])}",
+        preview_ms=preview_ms,
+    )
+    return jsonify(response_data)
+
+
+@app.route('/api/sketch-preview/<token>', methods=['GET'])
+def sketch_preview_status(token):
+    """两阶段素描的完整结果状态(页面轮询)"""
+    if not SKETCH_TOKEN_PATTERN.match(token):
+        return jsonify({'error': '无效的素描标识'}), 400
+    paths = sketch_preview_paths(token)
+    if os.path.exists(paths['final']):
+        return jsonify({'ready': True, 'sketch_url': f"/static/results/{os.path.basename(paths['final'])}"})
+    if os.path.exists(paths['error']):
+        with open(paths['error'], 'r', encoding='utf-8') as f:
+            return jsonify({'ready': False, 'error': f'完整渲染失败: {f.read()}'})
+    return jsonify({'ready': False})
+
+
+@app.route('/api/sketch-styles', methods=['POST'])
+def sketch_styles():
+    """
+    多风格素描预览: 对同一张融合结果并发提交全部风格,
+    按完成顺序以NDJSON逐行返回(每行一个风格)
+    """
+    if not BAILIAN_SKETCH_AVAILABLE:
+        return jsonify({'error': '百炼素描转换器不可用'}), 503
+    
+    image_url = request.form.get('image_url')
+    if not image_url:
+        return jsonify({'error': '缺少融合结果URL'}), 400
+    styles = [s for s in request.form.get('styles', '').split(',') if s.strip()] or None
+    
+    # 本地融合结果(/static/results/xxx.png),用于确定性种子和素描缓存
+    image_path = None
+    result_url = request.form.get('result_url')
+    if result_url:
+        candidate = os.path.join(app.config['RESULT_FOLDER'], os.path.basename(result_url))
+        if os.path.exists(candidate):
+            image_path = candidate
+    
+    try:
+        converter = BailianSketchConverter()
+    except Exception as e:
+        return jsonify({'error': f'素描转换器初始化失败: {str(e)}'}), 503
+    
+    batch_id = uuid.uuid4().hex[:8]
+    
+    def generate():
+        start = time.time()
+        for style, sketch_url, sketch_info in converter.convert_styles(image_url, styles, image_path=image_path):
+            line = {'style': style, 'success': sketch_info['success']}
+            if sketch_info['success']:
+                filename = f'sketch_{batch_id}_{style}.png'
+                save_path = os.path.join(app.config['RESULT_FOLDER'], filename)
+                if sketch_info.get('cache_path'):
+                    shutil.copyfile(sketch_info['cache_path'], save_path)
+                    saved = True
+                else:
+                    saved = converter.download_result(sketch_url, save_path)
+                if saved:
+                    line['sketch_url'] = f'/static/results/{filename}'
+                    line['elapsed_time'] = sketch_info['elapsed_time']
+                    line['cached'] = sketch_info.get('cached', False)
+                else:
+                    line.update(success=False, error='素描结果下载失败')
+            else:
+                line['error'] = sketch_info.get('error')
+            yield json.dumps(line, ensure_ascii=False) + '\n'
+        yield json.dumps({'done': True, 'elapsed_time': round(time.time() - start, 2)}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/renditions/<path:filename>', methods=['GET'])
+def serve_rendition(filename):
+    """
+    多规格结果图
+    
+    文件名含内容哈希,内容永不变化: 使用强ETag + immutable长期缓存,支持条件请求
+    """
+    if not RENDITIONS_AVAILABLE:
+        return jsonify({'error': '结果多规格输出不可用'}), 503
+    renditions = ResultRenditions()
+    response = send_from_directory(
+        os.path.abspath(renditions.output_dir),
+        filename,
+        etag=renditions.etag_from_filename(filename) or True,
+        max_age=365 * 24 * 3600,
+        conditional=True
+    )
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+@app.route('/api/catalog', methods=['GET'])
+def list_catalog():
+    """发型目录列表(缩略图、发型预览)"""
+    if not CATALOG_AVAILABLE:
+        return jsonify({'error': '发型目录不可用'}), 503
+    return jsonify({
+        'success': True,
+        'hairstyles': [hairstyle_catalog.to_public(entry) for entry in hairstyle_catalog.list_entries()]
+    })
+
+
+@app.route('/api/templates/stats', methods=['GET'])
+def template_stats():
+    """人脸融合模板占用统计"""
+    if not TEMPLATE_REGISTRY_AVAILABLE:
+        return jsonify({'error': '模板注册表不可用'}), 503
+    try:
+        return jsonify(FaceTemplateRegistry().stats())
+    except Exception as e:
+        return jsonify({'error': f'获取模板统计失败: {str(e)}'}), 500
+
+
+@app.route('/api/single-flight/stats', methods=['GET'])
+def single_flight_stats():
+    """相同上游请求合并统计(当前工作进程)"""
+    if not SINGLE_FLIGHT_AVAILABLE:
+        return jsonify({'error': '请求合并不可用'}), 503
+    return jsonify(get_single_flight().stats())
+
+
+@app.route('/api/scheduler/stats', methods=['GET'])
+def scheduler_stats():
+    """迁移调度统计: 各优先级排队/执行数与等待时间,各租户放行/拒绝数(当前工作进程)"""
+    if not TRANSFER_SCHEDULER_AVAILABLE:
+        return jsonify({'error': '迁移调度器不可用'}), 503
+    return jsonify(get_transfer_scheduler().stats())
+
+
+@app.route('/api/memory-stats', methods=['GET'])
+def memory_stats():
+    """内存预算占用与各路由的估算/实测峰值统计(当前工作进程)"""
+    if not MEMORY_BUDGET_AVAILABLE:
+        return jsonify({'error': '内存预算不可用'}), 503
+    return jsonify(get_memory_budget().stats())
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """任务状态与结果(请求中断或进程重启后可按job_id取回结果)"""
+    if not JOB_STORE_AVAILABLE:
+        return jsonify({'error': '任务存储不可用'}), 503
+    job = get_job_store().get(job_id)
+    if not job:
+        return jsonify({'error': f'任务不存在: {job_id}'}), 404
+    return jsonify(job)
+
+
+@app.route('/api/jobs/stats', methods=['GET'])
+def job_stats():
+    """各状态任务数"""
+    if not JOB_STORE_AVAILABLE:
+        return jsonify({'error': '任务存储不可用'}), 503
+    return jsonify(get_job_store().stats())
 
 
 @app.route('/api/health', methods=['GET'])
@@ -421,6 +1474,42 @@ def health_check():
         }), 500
 
 
+_resume_worker = None
+_resume_worker_lock = threading.Lock()
+
+
+def start_resume_worker(reloader: bool = False):
+    """
+    在本进程中运行恢复工作线程(JOB_RESUME_WORKER=1;也可单独运行: python job_store.py worker)
+    
+    以下进程不启动:
+    - multiprocessing子进程: 图像进程池用spawn启动,会重新导入本模块
+    - Werkzeug重载器的父进程: 只负责监视文件,应用运行在WERKZEUG_RUN_MAIN=true的子进程中
+    
+    Args:
+        reloader: 是否由开启重载器的app.run启动
+    
+    Returns:
+        ResumeWorker,未启动时为None
+    """
+    global _resume_worker
+    if not JOB_STORE_AVAILABLE or os.getenv('JOB_RESUME_WORKER', '0') != '1':
+        return None
+    if multiprocessing.parent_process() is not None:
+        return None
+    if reloader and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        return None
+    with _resume_worker_lock:
+        if _resume_worker is None:
+            _resume_worker = ResumeWorker(get_job_store(), JOB_HANDLERS).start()
+        return _resume_worker
+
+
+# 由WSGI/ASGI服务器导入时启动;直接运行本文件时在下方按是否开启重载器启动
+if __name__ != '__main__':
+    start_resume_worker()
+
+
 if __name__ == '__main__':
     print("\n" + "="*60)
     print("🚀 发型迁移系统 - 阿里云API版本")
@@ -447,6 +1536,7 @@ if __name__ == '__main__':
     print("   访问地址: http://localhost:5002")
     print("="*60 + "\n")
     
+    start_resume_worker(reloader=True)
     app.run(
         host='0.0.0.0',
         port=5002,
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+异步服务模式(ASGI)
+/api/extract-hair 与 /api/transfer 由协程处理: 等待头发分割、人脸融合、百炼素描和结果下载时
+不占用线程,单个进程即可同时挂起大量慢上游请求;其余路由原样交给Flask应用处理。
+路由、请求参数、返回JSON和状态码与 app.py 一致,前端无需改动。
+
+启动:
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5002
+"""
+
+import os
+import shutil
+import traceback
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    # starlette自带的WSGI适配(已弃用,但无需额外依赖)
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+import app as flask_module
+from app import (
+    AliyunHairTransferFixed,
+    FaceValidationError,
+    HairSegmentation,
+    TransferRequestError,
+    acquire_transfer_slot_async,
+    admit_request_async,
+    build_extract_response,
+    build_transfer_response,
+    close_direct_uploads,
+    create_transfer_checkpoint,
+    new_extracted_path,
+    prepare_extract,
+    prepare_transfer,
+    release_admission,
+    release_transfer_slot,
+    resolve_direct_uploads,
+)
+from async_http import close_sessions
+
+try:
+    from single_flight import get_single_flight
+    SINGLE_FLIGHT_AVAILABLE = True
+except ImportError as e:
+    SINGLE_FLIGHT_AVAILABLE = False
+    get_single_flight = None
+    print(f"⚠️  请求合并不可用: {e}")
+
+
+class _UploadAdapter:
+    """将Starlette的UploadFile包装为save_upload_file使用的接口(filename + save)"""
+
+    def __init__(self, upload: UploadFile):
+        self._upload = upload
+        self.filename = upload.filename
+        # 内存预算估算时只读文件头
+        self.stream = upload.file
+
+    def save(self, path: str):
+        self._upload.file.seek(0)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(self._upload.file, f)
+
+
+async def read_form(request: Request):
+    """
+    解析multipart表单
+
+    请求体大小按实际收到的字节数限制(分块传输没有Content-Length,与Flask一致也要拦截)
+
+    Returns:
+        (form, files, data): 普通字段字典、{字段名: _UploadAdapter}、
+        原始FormData(上传内容在临时文件中,用完后交给close_form)
+
+    Raises:
+        TransferRequestError: 请求体超过MAX_CONTENT_LENGTH
+    """
+    max_length = flask_module.app.config['MAX_CONTENT_LENGTH']
+    too_large = TransferRequestError({'error': f'上传文件过大(上限{max_length // 1024 // 1024}MB)'}, 413)
+    length = request.headers.get('content-length')
+    if length and length.isdigit() and int(length) > max_length:
+        raise too_large
+
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message['type'] == 'http.request':
+            received += len(message.get('body', b''))
+            if received > max_length:
+                raise too_large
+        return message
+
+    data = await Request(request.scope, receive).form()
+    form, files = {}, {}
+    for name, value in data.items():
+        if isinstance(value, UploadFile):
+            files[name] = _UploadAdapter(value)
+        else:
+            form[name] = value
+    return form, files, data
+
+
+async def close_form(data):
+    """关闭表单中的上传文件(SpooledTemporaryFile),不等垃圾回收"""
+    if data is not None:
+        await data.close()
+
+
+async def segment_hair_shared_async(hair_seg, image_url: str, content_hash: str) -> dict:
+    """头发分割(协程版),相同发型图的并发分割合并为一次API调用"""
+    if not SINGLE_FLIGHT_AVAILABLE:
+        return await hair_seg.segment_hair_async(image_url)
+    return await get_single_flight().do_async(
+        'segment_hair', content_hash, lambda: hair_seg.segment_hair_async(image_url)
+    )
+
+
+def error_response(e: Exception, label: str) -> JSONResponse:
+    """与Flask路由相同的异常 -> 状态码映射"""
+    if isinstance(e, TransferRequestError):
+        return JSONResponse(e.payload, status_code=e.status, headers=e.headers)
+    if isinstance(e, FaceValidationError):
+        return JSONResponse({'error': str(e), 'face_check': e.report}, status_code=422)
+    if isinstance(e, ValueError):
+        return JSONResponse({'error': str(e)}, status_code=400)
+    print(f"❌ {label}: {e}")
+    traceback.print_exc()
+    return JSONResponse({'error': f'{label}: {str(e)}'}, status_code=500)
+
+
+async def extract_hair(request: Request) -> JSONResponse:
+    """提取发型API(异步)"""
+    reservation, files, data = None, {}, None
+    try:
+        form, uploads, data = await read_form(request)
+        # 浏览器直传的发型图按对象键取回(下载在线程池中进行)
+        files = await run_in_threadpool(resolve_direct_uploads, form, uploads)
+        # 内存预算排队在事件循环中等待,不占用处理请求的线程池
+        reservation = await admit_request_async('extract', files)
+        # 保存/预检/生成规格/上传OSS: 本地计算和同步SDK,放到线程池
+        job = await run_in_threadpool(prepare_extract, files)
+
+        print(f"\n✂️  提取发型...")
+        hair_seg = HairSegmentation()
+        result = await segment_hair_shared_async(hair_seg, job['segment_url'], job['segment_key'])
+
+        if not result['success']:
+            return JSONResponse({
+                'error': '发型提取失败',
+                'message': result['message']
+            }, status_code=500)
+
+        print(f"\n📥 下载提取的发型...")
+        extracted_path = new_extracted_path()
+        await hair_seg.download_hair_image_async(result['hair_url'], extracted_path)
+
+        return JSONResponse(build_extract_response(job, extracted_path, result))
+
+    except Exception as e:
+        return error_response(e, '发型提取失败')
+    finally:
+        release_admission(reservation)
+        close_direct_uploads(files)
+        await close_form(data)
+
+
+async def transfer_hairstyle(request: Request) -> JSONResponse:
+    """发型迁移API(异步)"""
+    reservation, ticket, files, data = None, None, {}, None
+    try:
+        form, uploads, data = await read_form(request)
+        # 槽位/内存预算排队在事件循环中等待,不占用处理请求的线程池
+        ticket = await acquire_transfer_slot_async(request.headers, form)
+        files = await run_in_threadpool(resolve_direct_uploads, form, uploads)
+        reservation = await admit_request_async('transfer', files)
+        job = await run_in_threadpool(prepare_transfer, form, files)
+        checkpoint = await run_in_threadpool(create_transfer_checkpoint, job)
+
+        print(f"\n🔧 初始化服务...")
+        service = await run_in_threadpool(AliyunHairTransferFixed)
+
+        # 人脸融合、结果下载、百炼素描轮询均在事件循环中等待
+        try:
+            _, info = await service.transfer_hairstyle_async(**job['transfer_args'], checkpoint=checkpoint)
+            # 多规格结果图编码为CPU密集操作
+            response_data = await run_in_threadpool(build_transfer_response, job, info)
+        except Exception as e:
+            if checkpoint:
+                await run_in_threadpool(checkpoint.fail, str(e))
+            raise
+        if checkpoint:
+            response_data['job_id'] = checkpoint.job_id
+            await run_in_threadpool(checkpoint.complete, response_data)
+
+        return JSONResponse(response_data)
+
+    except Exception as e:
+        return error_response(e, '处理失败')
+    finally:
+        release_admission(reservation)
+        release_transfer_slot(ticket)
+        close_direct_uploads(files)
+        await close_form(data)
+
+
+app = Starlette(
+    routes=[
+        Route('/api/extract-hair', extract_hair, methods=['POST']),
+        Route('/api/transfer', transfer_hairstyle, methods=['POST']),
+        # 其余路由(首页、素描预览、发型目录、统计等)沿用Flask实现
+        Mount('/', app=WSGIMiddleware(flask_module.app)),
+    ],
+    on_shutdown=[close_sessions],
+)
+
+
+def main():
+    """
+    启动异步服务
+
+    环境变量:
+        ASGI_HOST: 监听地址,默认0.0.0.0
+        ASGI_PORT: 监听端口,默认5002
+    """
+    import uvicorn
+
+    host = os.getenv('ASGI_HOST', '0.0.0.0')
+    port = int(os.getenv('ASGI_PORT', '5002'))
+    print("\n🚀 发型迁移系统 - 异步服务模式(ASGI)")
+    print(f"   访问地址: http://localhost:{port}")
+    uvicorn.run(app, host=host, port=port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+异步HTTP下载
+异步服务模式(asgi_app.py)下载融合结果/头发图/素描结果时使用,
+每个事件循环共享一个aiohttp连接池,等待下载时不占用线程;
+瞬时错误(断线、超时、429/5xx)的重试、HTTP Range续传与同步下载器(downloader.py)一致,
+保存到文件时按块流式写入
+"""
+
+import asyncio
+import io
+import os
+import threading
+from typing import Optional
+
+import aiohttp
+
+from downloader import RETRY_STATUS, _Retryable, backoff_delay, expected_total, resumed_at
+
+
+DEFAULT_TIMEOUT = 30
+CHUNK_SIZE = 64 * 1024
+# 单个事件循环的连接池上限(同一主机)
+CONNECTIONS_PER_HOST = 64
+
+_sessions = {}
+
+
+def get_session() -> aiohttp.ClientSession:
+    """获取当前事件循环的共享会话(懒加载)"""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=CONNECTIONS_PER_HOST),
+            timeout=aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT)
+        )
+        _sessions[loop] = session
+    return session
+
+
+async def _fetch(url: str, out, timeout: Optional[float] = None,
+                 max_retries: Optional[int] = None) -> int:
+    """
+    下载到可写、可seek的对象(文件或BytesIO),瞬时错误按指数退避重试,从已写入的位置续传
+
+    Returns:
+        int: 总字节数
+
+    Raises:
+        aiohttp.ClientError: 不可重试的错误(如404),或重试次数用尽
+        asyncio.TimeoutError: 重试次数用尽时的最后一次超时
+    """
+    if max_retries is None:
+        max_retries = int(os.getenv('DOWNLOAD_MAX_RETRIES', '4'))
+    client_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+
+    attempt = 0
+    while True:
+        offset = out.tell()
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        try:
+            async with get_session().get(url, headers=headers, timeout=client_timeout) as response:
+                if response.status in RETRY_STATUS:
+                    if attempt >= max_retries:
+                        response.raise_for_status()
+                    retry_after = response.headers.get('Retry-After', '')
+                    raise _Retryable(f'HTTP {response.status}',
+                                     float(retry_after) if retry_after.isdigit() else None)
+                response.raise_for_status()
+
+                if offset and not resumed_at(response.status, response.headers, offset):
+                    # 服务端不支持Range(或返回了其他范围),从头开始
+                    out.seek(0)
+                    out.truncate()
+                    offset = 0
+
+                expected = expected_total(response.status, response.headers, offset)
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    out.write(chunk)
+                if expected is not None and out.tell() < expected:
+                    raise _Retryable(f'内容不完整({out.tell()}/{expected}字节)')
+                return out.tell()
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError, _Retryable) as e:
+            if attempt >= max_retries:
+                if isinstance(e, _Retryable):
+                    raise aiohttp.ClientPayloadError(str(e)) from e
+                raise
+            error, delay = str(e) or repr(e), getattr(e, 'retry_after', None)
+
+        attempt += 1
+        delay = delay or backoff_delay(attempt)
+        print(f"⚠️  下载中断: {error}, {delay:.1f}秒后第{attempt}次重试"
+              + (f"(从{out.tell()}字节续传)" if out.tell() else ''))
+        await asyncio.sleep(delay)
+
+
+async def fetch_bytes(url: str, timeout: Optional[float] = None,
+                      max_retries: Optional[int] = None) -> bytes:
+    """
+    下载URL内容到内存(需要解码的图像)
+
+    Args:
+        url: 资源URL
+        timeout: 单次请求超时(秒),默认30
+        max_retries: 最大重试次数,默认环境变量DOWNLOAD_MAX_RETRIES或4
+
+    Returns:
+        bytes: 响应内容
+
+    Raises:
+        aiohttp.ClientError: 不可重试的错误(如404),或重试次数用尽
+        asyncio.TimeoutError: 重试次数用尽时的最后一次超时
+    """
+    buffer = io.BytesIO()
+    await _fetch(url, buffer, timeout, max_retries)
+    return buffer.getvalue()
+
+
+async def fetch_to_file(url: str, save_path: str, timeout: Optional[float] = None,
+                        max_retries: Optional[int] = None) -> int:
+    """
+    流式下载到文件: 先写入 <save_path>.part,完整后原子替换(参数同fetch_bytes)
+
+    Returns:
+        int: 文件字节数
+    """
+    part_path = f'{save_path}.{threading.get_ident()}.{id(asyncio.current_task())}.part'
+    try:
+        with open(part_path, 'wb') as f:
+            size = await _fetch(url, f, timeout, max_retries)
+        os.replace(part_path, save_path)
+        return size
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+
+async def close_sessions():
+    """关闭当前事件循环的会话(服务停止时调用)"""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+def main():
+    """测试函数: 并发下载同一URL"""
+    import sys
+    import time
+
+    if len(sys.argv) < 2:
+        print("用法: python async_http.py <URL> [并发数]")
+        return
+    url, count = sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    async def run():
+        start = time.time()
+        try:
+            results = await asyncio.gather(*[fetch_bytes(url) for _ in range(count)])
+        finally:
+            await close_sessions()
+        print(f"✅ {count}个并发下载完成, 每个{len(results[0])/1024:.1f}KB, 耗时{time.time() - start:.2f}秒")
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
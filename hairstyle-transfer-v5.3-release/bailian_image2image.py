@@ -6,14 +6,46 @@ import numpy as np
 from io import BytesIO
 from PIL import Image
 import os
+import tempfile
 import time
 
+from downloader import get_downloader
+
+try:
+    from image_preprocessor import ImagePreprocessor
+    PREPROCESSOR_AVAILABLE = True
+except ImportError as e:
+    PREPROCESSOR_AVAILABLE = False
+    print(f"⚠️  图像预处理模块不可用: {e}")
+
 
 class BailianImage2ImageHairTransfer:
-    def __init__(self, api_key=None, endpoint=None):
+    # 图像传递方式: url(上传到存储后传URL) / jpeg(按目标大小压缩后内联) / png(无损内联)
+    PAYLOAD_MODES = ('url', 'jpeg', 'png')
+    # jpeg模式单张图的目标大小
+    DEFAULT_JPEG_TARGET_KB = 300
+
+    def __init__(self, api_key=None, endpoint=None, payload_mode=None, uploader=None, jpeg_target_kb=None):
+        """
+        Args:
+            api_key: 百炼API密钥
+            endpoint: 图生图接口地址
+            payload_mode: 图像传递方式,默认环境变量BAILIAN_PAYLOAD_MODE;
+                          未设置时有uploader用url,否则用jpeg
+            uploader: 上传函数,接收本地文件路径返回公网URL(如 app.upload_to_oss),url模式必需
+            jpeg_target_kb: jpeg模式单张图目标大小(KB)
+        """
         self.api_key = api_key or os.getenv('BAILIAN_API_KEY')
         self.endpoint = endpoint or os.getenv('BAILIAN_ENDPOINT',
                                               'https://dashscope.aliyuncs.com/api/v1/services/aigc/image2image/image-synthesis')
+        self.task_base_url = os.getenv('DASHSCOPE_BASE_URL', 'https://dashscope.aliyuncs.com/api/v1')
+        self.uploader = uploader
+        self.payload_mode = payload_mode or os.getenv('BAILIAN_PAYLOAD_MODE') or ('url' if uploader else 'jpeg')
+        if self.payload_mode not in self.PAYLOAD_MODES:
+            raise ValueError(f"不支持的图像传递方式: {self.payload_mode}")
+        if self.payload_mode == 'url' and not uploader:
+            raise ValueError("url模式需要提供uploader")
+        self.jpeg_target_kb = jpeg_target_kb or int(os.getenv('BAILIAN_JPEG_TARGET_KB', self.DEFAULT_JPEG_TARGET_KB))
 
         if not self.api_key:
             print("⚠️  警告: 未设置百炼API密钥")
@@ -22,6 +54,7 @@ class BailianImage2ImageHairTransfer:
             print(f"✅ 初始化百炼发型迁移服务 (理发师专用)")
             print(f"   API Key: {self.api_key[:10]}...")
             print(f"   Endpoint: {self.endpoint}")
+            print(f"   图像传递方式: {self.payload_mode}")
 
     def image_to_base64(self, image_array):
         """将OpenCV图像转换为base64 (优化为PNG格式)"""
@@ -33,11 +66,65 @@ class BailianImage2ImageHairTransfer:
 
         # 保存为PNG避免压缩失真
         _, buffer = cv2.imencode('.png', image_array)
-        base64_data = base64.b64encode(buffer).decode('utf-8')
-        return f"data:image/png;base64,{base64_data}"
+        return self._data_uri(buffer.tobytes(), 'image/png')
+
+    def _data_uri(self, data, mime_type):
+        return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+    def encode_jpeg_to_target(self, image_array, target_bytes):
+        """二分查找不超过目标大小的最高JPEG质量 (质量下限60)"""
+        low, high = 60, 95
+        best = None
+        while low <= high:
+            quality = (low + high) // 2
+            _, buffer = cv2.imencode('.jpg', image_array, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if buffer.nbytes <= target_bytes:
+                best = buffer
+                low = quality + 1
+            else:
+                high = quality - 1
+        if best is None:
+            best = buffer  # 最低质量仍超出目标,使用最低质量结果
+        return best.tobytes()
+
+    def build_image_payload(self, image_array):
+        """
+        构建请求体中的单张图像 (图像须已经过 _preprocess_image)
+
+        Returns:
+            str: 公网URL或data URI
+        """
+        if image_array is None or image_array.size == 0:
+            raise ValueError("无效的图像数据")
 
-    def call_image2image_api(self, prompt, src_image_base64, dst_image_base64):
-        """调用百炼API (理发师专用优化)"""
+        if self.payload_mode == 'png':
+            _, buffer = cv2.imencode('.png', image_array)
+            payload = self._data_uri(buffer.tobytes(), 'image/png')
+        elif self.payload_mode == 'jpeg':
+            data = self.encode_jpeg_to_target(image_array, self.jpeg_target_kb * 1024)
+            payload = self._data_uri(data, 'image/jpeg')
+        else:
+            # url模式: 以高质量JPEG上传,请求体中只有URL
+            _, buffer = cv2.imencode('.jpg', image_array, [cv2.IMWRITE_JPEG_QUALITY, 92])
+            fd, temp_path = tempfile.mkstemp(suffix='.jpg', prefix='bailian_')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(buffer.tobytes())
+                payload = self.uploader(temp_path)
+            finally:
+                os.remove(temp_path)
+
+        print(f"📦 图像载荷 ({self.payload_mode}): {len(payload) / 1024:.1f}KB")
+        return payload
+
+    def call_image2image_api(self, prompt, src_image_base64, dst_image_base64, on_submit=None):
+        """
+        调用百炼API (理发师专用优化),图像参数可以是data URI或公网URL
+
+        Args:
+            on_submit: 任务提交成功后的回调 on_submit(task_id),用于记录检查点,
+                       进程重启后可用resume_task继续等待同一任务
+        """
         if not self.api_key:
             raise Exception("百炼API密钥未设置")
 
@@ -82,6 +169,8 @@ class BailianImage2ImageHairTransfer:
                 # 处理异步任务
                 if "output" in result_data and "task_id" in result_data["output"]:
                     task_id = result_data["output"]["task_id"]
+                    if on_submit:
+                        on_submit(task_id)
                     return self._wait_for_async_task(task_id)
                 else:
                     print(f"❌ 无效响应: {json.dumps(result_data, indent=2)}")
@@ -109,7 +198,7 @@ class BailianImage2ImageHairTransfer:
             "Content-Type": "application/json"
         }
 
-        query_url = f"https://dashscope.aliyuncs.com/api/v1/tasks/{task_id}"
+        query_url = f"{self.task_base_url}/tasks/{task_id}"
         start_time = time.time()
         poll_count = 0
 
@@ -152,45 +241,59 @@ class BailianImage2ImageHairTransfer:
 
         raise Exception(f"任务等待超时 (超过 {max_wait_time} 秒)")
 
+    def resume_task(self, task_id):
+        """继续等待已提交的任务(不重新提交),返回结果图像"""
+        print(f"🔁 继续等待已提交的任务: {task_id}")
+        return self._wait_for_async_task(task_id)
+
     def _download_image(self, image_url):
         """下载生成的图像 (理发师专用优化)"""
         print(f"📥 下载专业发型迁移结果: {image_url}")
         try:
-            response = requests.get(image_url, timeout=30)
-            if response.status_code == 200:
-                image_array = np.frombuffer(response.content, np.uint8)
-                result_image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+            image_array = np.frombuffer(get_downloader().download_bytes(image_url), np.uint8)
+            result_image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
 
-                if result_image is not None:
-                    print(f"✅ 图像下载成功，尺寸: {result_image.shape}")
-                    return result_image
-                else:
-                    raise Exception("图像解码失败")
+            if result_image is not None:
+                print(f"✅ 图像下载成功，尺寸: {result_image.shape}")
+                return result_image
             else:
-                raise Exception(f"下载失败: {response.status_code}")
+                raise Exception("图像解码失败")
 
         except Exception as e:
             raise Exception(f"图像下载失败: {str(e)}")
 
-    def transfer_hair(self, src_image, dst_image, strength=0.8):
-        """核心功能：发型迁移 (理发师专用优化)"""
+    def transfer_hair(self, src_image, dst_image, strength=0.8, checkpoint=None):
+        """
+        核心功能：发型迁移 (理发师专用优化)
+
+        Args:
+            checkpoint: 任务检查点(job_store.JobCheckpoint),提交后记录任务ID;
+                        恢复执行时继续等待已提交的任务
+        """
         print("💇‍♂️ 开始专业发型迁移 (理发师专用模式)")
         print(f"💪 迁移强度: {strength:.1f} (0.0-1.0)")
 
         try:
-            # 1. 预处理图像 (确保尺寸合规)
+            # 1. 预处理图像 (确保尺寸合规,每张图只处理一次)
             src_image = self._preprocess_image(src_image)
             dst_image = self._preprocess_image(dst_image)
 
-            # 2. 生成专业提示词 (关键优化点)
-            prompt = self._generate_hair_prompt()
+            task_id = checkpoint.get('image2image_task_id') if checkpoint else None
+            if task_id:
+                result_image = self.resume_task(task_id)
+            else:
+                # 2. 生成专业提示词 (关键优化点)
+                prompt = self._generate_hair_prompt()
 
-            # 3. 转换图像为base64
-            src_base64 = self.image_to_base64(src_image)
-            dst_base64 = self.image_to_base64(dst_image)
+                # 3. 构建图像载荷 (URL或按目标大小压缩的JPEG)
+                src_payload = self.build_image_payload(src_image)
+                dst_payload = self.build_image_payload(dst_image)
 
-            # 4. 调用API
-            result_image = self.call_image2image_api(prompt, src_base64, dst_base64)
+                # 4. 调用API
+                on_submit = None
+                if checkpoint:
+                    on_submit = lambda tid: checkpoint.save('image2image_submitted', image2image_task_id=tid)
+                result_image = self.call_image2image_api(prompt, src_payload, dst_payload, on_submit)
 
             # 5. 调整尺寸匹配客户照片
             target_height, target_width = dst_image.shape[:2]
@@ -217,8 +320,21 @@ class BailianImage2ImageHairTransfer:
         )
 
     def _preprocess_image(self, image):
-        """图像预处理 (理发师专用优化)"""
+        """
+        图像预处理 (理发师专用优化)
+
+        尺寸规则与 ImagePreprocessor.PROFILES['wan25'] 一致;
+        传入已按该规格生成的图像时不会再次缩放
+        """
         h, w = image.shape[:2]
+        if PREPROCESSOR_AVAILABLE:
+            target_w, target_h = ImagePreprocessor().fit_size(w, h, 'wan25')
+            if (target_w, target_h) != (w, h):
+                interpolation = cv2.INTER_AREA if target_w < w else cv2.INTER_LANCZOS4
+                image = cv2.resize(image, (target_w, target_h), interpolation=interpolation)
+                print(f"🖼️  图像已调整至: {target_w}x{target_h} (满足API尺寸要求)")
+            return image
+
         min_size = 384
         max_size = 1024
 
@@ -255,8 +371,8 @@ class BailianImage2ImageHairTransfer:
             # 测试调用
             result = self.call_image2image_api(
                 self._generate_hair_prompt(),
-                self.image_to_base64(test_image1),
-                self.image_to_base64(test_image2)
+                self.build_image_payload(self._preprocess_image(test_image1)),
+                self.build_image_payload(self._preprocess_image(test_image2))
             )
 
             if result is not None:
@@ -269,14 +385,14 @@ class BailianImage2ImageHairTransfer:
 
 
 # 工厂函数 (自动检测API配置)
-def create_image2image_transfer():
+def create_image2image_transfer(uploader=None):
     api_key = os.getenv('BAILIAN_API_KEY')
     endpoint = os.getenv('BAILIAN_ENDPOINT',
                          'https://dashscope.aliyuncs.com/api/v1/services/aigc/image2image/image-synthesis')
 
     if api_key:
         print("🔑 检测到API配置，使用专业发型迁移服务")
-        return BailianImage2ImageHairTransfer(api_key, endpoint)
+        return BailianImage2ImageHairTransfer(api_key, endpoint, uploader=uploader)
     else:
         print("🔧 未检测到API配置，使用演示模式 (仅用于验证)")
         return _DemoHairTransfer()
@@ -285,7 +401,7 @@ def create_image2image_transfer():
 class _DemoHairTransfer:
     """演示模式 (仅用于验证流程，不生成真实效果)"""
 
-    def transfer_hair(self, src_image, dst_image, strength=0.8):
+    def transfer_hair(self, src_image, dst_image, strength=0.8, checkpoint=None):
         print("🎭 演示模式: 模拟发型迁移效果 (实际使用需设置API密钥)")
         result = dst_image.copy()
 
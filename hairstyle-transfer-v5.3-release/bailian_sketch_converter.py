@@ -1,4 +1,3 @@
-import hashlib
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
@@ -6,39 +5,212 @@ import hashlib
 使用阿里云通义万相图生图API实现高质量素描效果
 """
 
+import asyncio
+import hashlib
 import os
+import threading
 import time
-import requests
 from http import HTTPStatus
 import dashscope
 from dashscope import ImageSynthesis
 
+from downloader import get_downloader
+from file_hash import compute_file_hash
+
+try:
+    from async_http import fetch_bytes
+    ASYNC_HTTP_AVAILABLE = True
+except ImportError as e:
+    ASYNC_HTTP_AVAILABLE = False
+    fetch_bytes = None
+    print(f"⚠️  异步HTTP不可用: {e}")
+
+
+class DashScopeRateLimiter:
+    """
+    DashScope调用限流(进程内共享)
+    令牌桶控制任务提交QPS,信号量控制同时进行的任务数
+    """
+    
+    def __init__(self, qps=2.0, max_concurrent=4):
+        """
+        Args:
+            qps: 每秒最多提交的任务数
+            max_concurrent: 同时进行(已提交未完成)的任务数上限
+        """
+        self.qps = qps
+        self.capacity = max(1.0, qps)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+    
+    # 协程等待任务名额时的检查间隔(秒)
+    SLOT_POLL_INTERVAL = 0.05
+    
+    def _take_token(self):
+        """尝试取一个提交令牌,成功返回0,否则返回需要等待的秒数"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.qps)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.qps
+    
+    def wait_submit(self):
+        """等待一个提交令牌"""
+        while True:
+            wait = self._take_token()
+            if not wait:
+                return
+            time.sleep(wait)
+    
+    async def wait_submit_async(self):
+        """等待一个提交令牌(协程版,不阻塞事件循环)"""
+        while True:
+            wait = self._take_token()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+    
+    def acquire_slot(self, blocking=True, timeout=None):
+        """占用一个任务名额"""
+        if not blocking:
+            return self.slots.acquire(False)
+        return self.slots.acquire(True, timeout)
+    
+    async def acquire_slot_async(self, timeout=None):
+        """占用一个任务名额(协程版): 与线程共用同一信号量,名额已满时定期重试"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while not self.slots.acquire(False):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(self.SLOT_POLL_INTERVAL)
+        return True
+    
+    def release_slot(self):
+        self.slots.release()
+
+
+class SketchResultCache:
+    """
+    素描结果缓存(本地文件)
+    键由 输入内容哈希、风格、种子、提示词版本 组成,命中时无需再次调用模型
+    """
+    
+    def __init__(self, cache_dir=None, max_mb=None):
+        """
+        Args:
+            cache_dir: 缓存目录,默认环境变量SKETCH_CACHE_DIR或instance/sketch_cache
+            max_mb: 缓存总大小上限(MB),超出时删除最久未使用的结果,默认环境变量SKETCH_CACHE_MAX_MB或512
+        """
+        self.cache_dir = cache_dir or os.getenv('SKETCH_CACHE_DIR', 'instance/sketch_cache')
+        self.max_bytes = int(max_mb or os.getenv('SKETCH_CACHE_MAX_MB', '512')) * 1024 * 1024
+        os.makedirs(self.cache_dir, exist_ok=True)
+    
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.img')
+    
+    def get(self, key):
+        """查询缓存,命中返回文件路径并刷新访问时间"""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        return path
+    
+    def put(self, key, data):
+        """写入缓存(先写临时文件再替换,避免并发读到半个文件)"""
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._prune()
+        return path
+    
+    def _prune(self):
+        """超出上限时按访问时间淘汰,降到上限的90%"""
+        entries = [e for e in os.scandir(self.cache_dir) if e.name.endswith('.img')]
+        total = sum(e.stat().st_size for e in entries)
+        if total <= self.max_bytes:
+            return
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                total -= entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                pass
+
 
 class BailianSketchConverter:
     """百炼素描转换器"""
     
-    def get_deterministic_seed(self, image_path):
+    MODEL = "wan2.5-i2i-preview"
+    # 提示词版本: 修改 style_prompts / NEGATIVE_PROMPT / MODEL 时递增,使旧缓存失效
+    PROMPT_VERSION = 'v1'
+    # 通义万相 seed 取值范围 [0, 2147483647]
+    SEED_RANGE = 2147483648
+    NEGATIVE_PROMPT = "低分辨率,模糊,失真,变形,五官改变"
+    
+    # 多风格并发时的任务状态轮询间隔和超时(秒)
+    POLL_INTERVAL = 2.0
+    TASK_TIMEOUT = 300.0
+    
+    _rate_limiter = None
+    _rate_limiter_lock = threading.Lock()
+    
+    @classmethod
+    def get_rate_limiter(cls):
+        """
+        获取共享限流器
+        
+        环境变量:
+            DASHSCOPE_SUBMIT_QPS: 任务提交QPS,默认2
+            DASHSCOPE_MAX_CONCURRENT_TASKS: 同时进行的任务数,默认4
+        """
+        with cls._rate_limiter_lock:
+            if cls._rate_limiter is None:
+                cls._rate_limiter = DashScopeRateLimiter(
+                    qps=float(os.getenv('DASHSCOPE_SUBMIT_QPS', '2')),
+                    max_concurrent=int(os.getenv('DASHSCOPE_MAX_CONCURRENT_TASKS', '4'))
+                )
+            return cls._rate_limiter
+    
+    def get_deterministic_seed(self, image_path, content_hash=None):
         """基于图片内容生成确定性种子，确保相同输入产生相同输出"""
         try:
-            with open(image_path, 'rb') as f:
-                file_hash = hashlib.md5(f.read()).hexdigest()
-            seed = int(file_hash[:8], 16) % 10000
-            return seed
-        except:
+            content_hash = content_hash or compute_file_hash(image_path)
+            return int(content_hash[:8], 16) % self.SEED_RANGE
+        except OSError:
             return 42
+    
+    def cache_key(self, content_hash, style, seed):
+        """缓存键: (内容哈希, 风格, 种子, 提示词版本)"""
+        raw = f'{content_hash}:{style}:{seed}:{self.PROMPT_VERSION}'
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
 
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, cache=None):
         """
         初始化
         
         Args:
             api_key: 百炼API Key,如果不提供则从环境变量DASHSCOPE_API_KEY读取
+            cache: 素描结果缓存,默认创建SketchResultCache;环境变量SKETCH_CACHE=0时不缓存
         """
         self.api_key = api_key or os.getenv('DASHSCOPE_API_KEY')
         if not self.api_key:
             raise ValueError("未找到DASHSCOPE_API_KEY,请设置环境变量或传入api_key参数")
         
-        dashscope.base_http_api_url = 'https://dashscope.aliyuncs.com/api/v1'
+        if cache is None and os.getenv('SKETCH_CACHE', '1') != '0':
+            cache = SketchResultCache()
+        self.cache = cache
+        
+        dashscope.base_http_api_url = os.getenv('DASHSCOPE_BASE_URL', 'https://dashscope.aliyuncs.com/api/v1')
         
         # 素描风格prompt模板 - 已重命名
         self.style_prompts = {
@@ -48,7 +220,65 @@ class BailianSketchConverter:
             'vivid': 'Vibrant colored sketch style with 10 to 30 percent COLOR SATURATION, pencil sketch foundation with SUBTLE COLOR ACCENTS, maintaining clear sketch lines with LIGHT PASTEL COLOR TOUCHES, preserving character features with GENTLE COLOR HINTS, artistic beauty with RESTRAINED COLORFUL ELEMENTS, soft color wash over detailed pencil work, MUTED COLOR PALETTE with delicate hues, sketch texture visible through LIGHT COLOR LAYERS, balanced monochrome and SUBTLE COLOR combination'
         }
     
-    def convert(self, image_url, style='ink', watermark=False):
+    def _prepare_deterministic(self, image_path):
+        """计算输入内容哈希和种子;未提供本地文件时返回 (None, None)"""
+        if not image_path:
+            return None, None
+        try:
+            content_hash = compute_file_hash(image_path)
+        except OSError as e:
+            print(f"   ⚠️  无法读取输入文件,跳过确定性种子: {e}")
+            return None, None
+        return content_hash, self.get_deterministic_seed(image_path, content_hash)
+    
+    def _lookup_cache(self, content_hash, style, seed):
+        if not (self.cache and content_hash):
+            return None, None
+        key = self.cache_key(content_hash, style if style in self.style_prompts else 'ink', seed)
+        return key, self.cache.get(key)
+    
+    def _store_cache(self, key, result_url):
+        """下载模型结果写入缓存,返回缓存文件路径(失败时返回None)"""
+        if not key:
+            return None
+        try:
+            return self.cache.put(key, get_downloader().download_bytes(result_url))
+        except Exception as e:
+            print(f"   ⚠️  素描结果缓存失败: {e}")
+            return None
+    
+    async def _store_cache_async(self, key, result_url):
+        """_store_cache的协程版: 异步下载,写文件放到线程中"""
+        if not key:
+            return None
+        try:
+            data = await fetch_bytes(result_url)
+            return await asyncio.to_thread(self.cache.put, key, data)
+        except Exception as e:
+            print(f"   ⚠️  素描结果缓存失败: {e}")
+            return None
+    
+    def _poll_task(self, task_id, deadline):
+        """
+        轮询任务直到结束
+        
+        Returns:
+            tuple: (状态, 最后一次查询响应);超时状态为 'TIMEOUT'
+        """
+        rsp = None
+        while time.time() < deadline:
+            time.sleep(self.POLL_INTERVAL)
+            try:
+                rsp = ImageSynthesis.fetch(task_id, api_key=self.api_key)
+                status = rsp.output.task_status if rsp.status_code == HTTPStatus.OK else None
+            except Exception as e:
+                print(f"   ⚠️  查询失败: {e}")
+                continue
+            if status in ('SUCCEEDED', 'FAILED', 'CANCELED', 'UNKNOWN'):
+                return status, rsp
+        return 'TIMEOUT', rsp
+    
+    def convert(self, image_url, style='ink', watermark=False, image_path=None, task_id=None, on_submit=None):
         """
         将图像转换为素描风格
         
@@ -56,9 +286,13 @@ class BailianSketchConverter:
             image_url: 图像URL(支持公网URL、Base64、本地文件路径)
             style: 素描风格,可选值: pencil, anime, ink, vivid
             watermark: 是否添加水印
+            image_path: 与image_url内容相同的本地文件(可选);提供时由内容哈希生成确定性种子,
+                        并按 (内容哈希, 风格, 种子, 提示词版本) 缓存结果
+            task_id: 已提交的任务ID(进程重启后恢复),提供时继续轮询而不重新提交
+            on_submit: 任务提交成功后的回调 on_submit(task_id),用于记录检查点
         
         Returns:
-            tuple: (素描图像URL, 处理信息dict)
+            tuple: (素描图像URL, 处理信息dict);有缓存时info['cache_path']为本地结果文件
         """
         print(f"\n🎨 开始百炼素描转换...")
         print(f"   风格: {style}")
@@ -69,21 +303,46 @@ class BailianSketchConverter:
         try:
             prompt = self.style_prompts.get(style, self.style_prompts['ink'])
             
-            print(f"   📤 调用通义万相API...")
-            rsp = ImageSynthesis.call(
-                api_key=self.api_key,
-                model="wan2.5-i2i-preview",
-                prompt=prompt,
-                images=[image_url],
-                negative_prompt="低分辨率,模糊,失真,变形,五官改变",
-                n=1,
-                watermark=watermark
-            )
-            
-            if rsp.status_code != HTTPStatus.OK:
-                error_msg = f"API调用失败: {rsp.code} - {rsp.message}"
+            content_hash, seed = self._prepare_deterministic(image_path)
+            key, cached = self._lookup_cache(content_hash, style, seed)
+            if cached:
+                print(f"   ♻️  命中素描缓存 (seed={seed})")
+                return None, {
+                    'success': True,
+                    'style': style,
+                    'elapsed_time': f"{time.time() - start_time:.2f}秒",
+                    'cached': True,
+                    'cache_path': cached,
+                    'seed': seed,
+                    'prompt': prompt
+                }
+            
+            limiter = self.get_rate_limiter()
+            limiter.acquire_slot()
+            try:
+                if task_id:
+                    print(f"   🔁 继续轮询已提交的任务: {task_id}")
+                else:
+                    print(f"   📤 调用通义万相API...")
+                    limiter.wait_submit()
+                    rsp = ImageSynthesis.async_call(**self._task_kwargs(image_url, style, watermark, seed))
+                    if rsp.status_code != HTTPStatus.OK:
+                        error_msg = f"API调用失败: {rsp.code} - {rsp.message}"
+                        print(f"   ❌ {error_msg}")
+                        return None, {'success': False, 'error': error_msg}
+                    task_id = rsp.output.task_id
+                    if on_submit:
+                        on_submit(task_id)
+                
+                status, rsp = self._poll_task(task_id, start_time + self.TASK_TIMEOUT)
+            finally:
+                limiter.release_slot()
+            
+            if status != 'SUCCEEDED':
+                message = getattr(getattr(rsp, 'output', None), 'message', None) or status
+                error_msg = '任务超时' if status == 'TIMEOUT' else f"任务失败: {message}"
                 print(f"   ❌ {error_msg}")
-                return None, {'success': False, 'error': error_msg}
+                return None, {'success': False, 'task_id': task_id, 'error': error_msg}
             
             result_url = rsp.output.results[0].url
             elapsed = time.time() - start_time
@@ -97,9 +356,108 @@ class BailianSketchConverter:
                 'style': style,
                 'elapsed_time': f"{elapsed:.2f}秒",
                 'result_url': result_url,
-                'task_id': rsp.output.task_id,
+                'task_id': task_id,
+                'seed': seed,
+                'prompt': prompt
+            }
+            cache_path = self._store_cache(key, result_url)
+            if cache_path:
+                info['cache_path'] = cache_path
+            
+            return result_url, info
+            
+        except Exception as e:
+            error_msg = f"素描转换异常: {str(e)}"
+            print(f"   ❌ {error_msg}")
+            return None, {'success': False, 'error': error_msg}
+    
+    async def convert_async(self, image_url, style='ink', watermark=False, image_path=None,
+                            task_id=None, on_submit=None):
+        """
+        将图像转换为素描风格(协程版,异步服务模式使用)
+        
+        以异步任务提交,用asyncio.sleep按POLL_INTERVAL轮询状态,等待模型期间不占用线程;
+        参数与返回值同convert(on_submit在线程中调用)
+        """
+        print(f"\n🎨 开始百炼素描转换(异步)...")
+        print(f"   风格: {style}")
+        
+        start_time = time.time()
+        
+        try:
+            prompt = self.style_prompts.get(style, self.style_prompts['ink'])
+            
+            content_hash, seed = await asyncio.to_thread(self._prepare_deterministic, image_path)
+            key, cached = self._lookup_cache(content_hash, style, seed)
+            if cached:
+                print(f"   ♻️  命中素描缓存 (seed={seed})")
+                return None, {
+                    'success': True,
+                    'style': style,
+                    'elapsed_time': f"{time.time() - start_time:.2f}秒",
+                    'cached': True,
+                    'cache_path': cached,
+                    'seed': seed,
+                    'prompt': prompt
+                }
+            
+            limiter = self.get_rate_limiter()
+            if not await limiter.acquire_slot_async(self.TASK_TIMEOUT):
+                return None, {'success': False, 'error': '等待任务名额超时'}
+            try:
+                if task_id:
+                    print(f"   🔁 继续轮询已提交的任务: {task_id}")
+                else:
+                    await limiter.wait_submit_async()
+                    print(f"   📤 提交通义万相任务...")
+                    rsp = await asyncio.to_thread(
+                        ImageSynthesis.async_call, **self._task_kwargs(image_url, style, watermark, seed)
+                    )
+                    if rsp.status_code != HTTPStatus.OK:
+                        error_msg = f"API调用失败: {rsp.code} - {rsp.message}"
+                        print(f"   ❌ {error_msg}")
+                        return None, {'success': False, 'error': error_msg}
+                    task_id = rsp.output.task_id
+                    if on_submit:
+                        await asyncio.to_thread(on_submit, task_id)
+                
+                deadline = start_time + self.TASK_TIMEOUT
+                while True:
+                    await asyncio.sleep(self.POLL_INTERVAL)
+                    try:
+                        rsp = await asyncio.to_thread(ImageSynthesis.fetch, task_id, api_key=self.api_key)
+                        status = rsp.output.task_status if rsp.status_code == HTTPStatus.OK else None
+                    except Exception as e:
+                        print(f"   ⚠️  查询失败: {e}")
+                        status = None
+                    
+                    if status == 'SUCCEEDED':
+                        break
+                    if status in ('FAILED', 'CANCELED', 'UNKNOWN'):
+                        message = getattr(rsp.output, 'message', None) or status
+                        print(f"   ❌ 任务失败: {message}")
+                        return None, {'success': False, 'task_id': task_id, 'error': f"任务失败: {message}"}
+                    if time.time() >= deadline:
+                        return None, {'success': False, 'task_id': task_id, 'error': '任务超时'}
+            finally:
+                limiter.release_slot()
+            
+            result_url = rsp.output.results[0].url
+            elapsed = time.time() - start_time
+            print(f"   ✅ 素描转换成功! 耗时: {elapsed:.2f}秒")
+            
+            info = {
+                'success': True,
+                'style': style,
+                'elapsed_time': f"{elapsed:.2f}秒",
+                'result_url': result_url,
+                'task_id': task_id,
+                'seed': seed,
                 'prompt': prompt
             }
+            cache_path = await self._store_cache_async(key, result_url)
+            if cache_path:
+                info['cache_path'] = cache_path
             
             return result_url, info
             
@@ -108,6 +466,129 @@ class BailianSketchConverter:
             print(f"   ❌ {error_msg}")
             return None, {'success': False, 'error': error_msg}
     
+    def _task_kwargs(self, image_url, style, watermark, seed=None):
+        """构建通义万相图生图任务参数"""
+        kwargs = {
+            'api_key': self.api_key,
+            'model': self.MODEL,
+            'prompt': self.style_prompts.get(style, self.style_prompts['ink']),
+            'images': [image_url],
+            'negative_prompt': self.NEGATIVE_PROMPT,
+            'n': 1,
+            'watermark': watermark
+        }
+        if seed is not None:
+            kwargs['seed'] = seed
+        return kwargs
+    
+    def convert_styles(self, image_url, styles=None, watermark=False, timeout=None, image_path=None):
+        """
+        多风格并发转换: 所有风格作为异步任务提交(受共享限流约束),按完成顺序逐个返回
+        
+        Args:
+            image_url: 图像URL(通常为人脸融合结果URL)
+            styles: 风格列表,默认全部风格
+            watermark: 是否添加水印
+            timeout: 整体超时(秒),默认TASK_TIMEOUT
+            image_path: 与image_url内容相同的本地文件(可选),用于确定性种子和结果缓存
+        
+        Yields:
+            tuple: (风格, 素描图像URL, 处理信息dict),失败时URL为None;有缓存时info['cache_path']为本地结果文件
+        """
+        styles = [s for s in (styles or list(self.style_prompts)) if s in self.style_prompts]
+        deadline = time.time() + (timeout or self.TASK_TIMEOUT)
+        limiter = self.get_rate_limiter()
+        content_hash, seed = self._prepare_deterministic(image_path)
+        waiting = []
+        keys = {}
+        running = {}  # 风格 -> (task_id, 提交时间)
+        
+        print(f"\n🎨 百炼多风格素描转换: {', '.join(styles)}")
+        
+        # 已缓存的风格立即返回,其余提交任务
+        for style in styles:
+            key, cached = self._lookup_cache(content_hash, style, seed)
+            if cached:
+                print(f"   ♻️  [{style}] 命中素描缓存")
+                yield style, None, {'success': True, 'style': style, 'elapsed_time': "0.00秒",
+                                    'cached': True, 'cache_path': cached, 'seed': seed}
+            else:
+                keys[style] = key
+                waiting.append(style)
+        
+        try:
+            while waiting or running:
+                # 提交: 有空闲名额就提交;没有进行中的任务时阻塞等待名额
+                while waiting:
+                    if not limiter.acquire_slot(blocking=not running, timeout=max(0.0, deadline - time.time())):
+                        break
+                    style = waiting.pop(0)
+                    start = time.time()
+                    try:
+                        limiter.wait_submit()
+                        rsp = ImageSynthesis.async_call(**self._task_kwargs(image_url, style, watermark, seed))
+                        if rsp.status_code != HTTPStatus.OK:
+                            raise Exception(f"{rsp.code} - {rsp.message}")
+                    except Exception as e:
+                        limiter.release_slot()
+                        print(f"   ❌ [{style}] 提交失败: {e}")
+                        yield style, None, {'success': False, 'style': style, 'error': f"任务提交失败: {e}"}
+                        continue
+                    running[style] = (rsp.output.task_id, start)
+                    print(f"   📤 [{style}] 已提交: {rsp.output.task_id}")
+                
+                if not running:
+                    if waiting and time.time() >= deadline:
+                        for style in waiting:
+                            yield style, None, {'success': False, 'style': style, 'error': '等待任务名额超时'}
+                        waiting = []
+                    continue
+                
+                time.sleep(self.POLL_INTERVAL)
+                
+                # 轮询: 完成的任务立即返回
+                for style, (task_id, start) in list(running.items()):
+                    try:
+                        rsp = ImageSynthesis.fetch(task_id, api_key=self.api_key)
+                        status = rsp.output.task_status if rsp.status_code == HTTPStatus.OK else None
+                    except Exception as e:
+                        print(f"   ⚠️  [{style}] 查询失败: {e}")
+                        status = None
+                    
+                    if status == 'SUCCEEDED':
+                        result_url = rsp.output.results[0].url
+                        elapsed = time.time() - start
+                        print(f"   ✅ [{style}] 完成, 耗时: {elapsed:.2f}秒")
+                        result = (style, result_url, {
+                            'success': True,
+                            'style': style,
+                            'elapsed_time': f"{elapsed:.2f}秒",
+                            'result_url': result_url,
+                            'task_id': task_id,
+                            'seed': seed
+                        })
+                        cache_path = self._store_cache(keys[style], result_url)
+                        if cache_path:
+                            result[2]['cache_path'] = cache_path
+                    elif status in ('FAILED', 'CANCELED', 'UNKNOWN'):
+                        message = getattr(rsp.output, 'message', None) or status
+                        print(f"   ❌ [{style}] 任务失败: {message}")
+                        result = (style, None, {'success': False, 'style': style, 'task_id': task_id,
+                                                'error': f"任务失败: {message}"})
+                    elif time.time() >= deadline:
+                        result = (style, None, {'success': False, 'style': style, 'task_id': task_id,
+                                                'error': '任务超时'})
+                    else:
+                        continue
+                    
+                    del running[style]
+                    limiter.release_slot()
+                    yield result
+        finally:
+            # 调用方提前停止迭代(如客户端断开)时归还名额
+            for _ in running:
+                limiter.release_slot()
+    
     def download_result(self, result_url, save_path):
         """
         下载素描结果图像
@@ -124,11 +605,7 @@ class BailianSketchConverter:
             print(f"   URL: {result_url[:100]}...")
             print(f"   保存到: {save_path}")
             
-            response = requests.get(result_url, timeout=30)
-            response.raise_for_status()
-            
-            with open(save_path, 'wb') as f:
-                f.write(response.content)
+            get_downloader().download_to_file(result_url, save_path)
             
             print(f"   ✅ 下载成功!")
             return True
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+批量离线处理
+对整个目录树的作品集图片做预处理(ImagePreprocessor.preprocess_image)和素描转换,
+按CPU核数启动工作进程并行处理,终端显示进度;
+每完成一张就追加写入清单(manifest),中断后重新运行会跳过已完成的文件,
+结束时输出吞吐量汇总(张/秒、MB/秒)
+
+用法:
+    python batch_process.py ./portfolio ./portfolio_out
+    python batch_process.py ./portfolio ./portfolio_out --sketch pencil,artistic
+    python batch_process.py ./portfolio ./sketches --no-preprocess --sketch pencil --workers 8
+"""
+
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+from typing import Dict, List, Optional
+
+import cv2
+
+from hairstyle_catalog import SOURCE_EXTENSIONS
+from metrics import percentile
+
+
+MANIFEST_NAME = 'manifest.jsonl'
+SUMMARY_NAME = 'summary.json'
+SKETCH_JPEG_QUALITY = 95
+
+
+def available_cpus() -> int:
+    """本进程可用的CPU核数(考虑taskset/cgroup的CPU亲和性限制)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+
+# ===== 工作进程 =====
+
+_worker = {}
+
+
+def _init_worker(cv2_threads: int):
+    """
+    工作进程初始化
+
+    - OpenCV线程数限制为 CPU核数 / 工作进程数,由进程数占满CPU,避免 进程数 x 线程数 超订
+    - 忽略Ctrl-C,由主进程决定是等待进行中的任务还是退出
+    - 预处理/素描模块每张图都会打印日志,工作进程内丢弃,避免冲掉进度显示
+    """
+    cv2.setNumThreads(cv2_threads)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sys.stdout = open(os.devnull, 'w')
+
+    from image_preprocessor import ImagePreprocessor
+    from sketch_converter import SketchConverter
+    _worker['preprocess'] = ImagePreprocessor()
+    _worker['sketch'] = SketchConverter()
+
+
+def _process_one(task: dict) -> dict:
+    """
+    处理一张图片(在工作进程中执行)
+
+    Args:
+        task: {'path', 'source', 'preprocessed', 'sketches': {风格: 输出路径}}
+
+    Returns:
+        dict: 清单记录(不含源文件签名,由主进程补充)
+    """
+    start = time.time()
+    outputs = []
+    try:
+        os.makedirs(os.path.dirname(task['preprocessed'] or next(iter(task['sketches'].values()))), exist_ok=True)
+
+        sketch_input = task['source']
+        if task['preprocessed']:
+            sketch_input, _ = _worker['preprocess'].preprocess_image(task['source'], task['preprocessed'])
+            outputs.append(sketch_input)
+
+        if task['sketches']:
+            # 多个风格共用一次解码(与 SketchConverter.convert_file 的读写方式一致)
+            image = cv2.imread(sketch_input)
+            if image is None:
+                raise ValueError(f"无法读取图像: {sketch_input}")
+            for style, output_path in task['sketches'].items():
+                sketch = _worker['sketch'].convert(image, style)
+                if not cv2.imwrite(output_path, sketch, [cv2.IMWRITE_JPEG_QUALITY, SKETCH_JPEG_QUALITY]):
+                    raise ValueError(f"无法写入: {output_path}")
+                outputs.append(output_path)
+
+        return {
+            'path': task['path'],
+            'status': 'ok',
+            'outputs': outputs,
+            'bytes_out': sum(os.path.getsize(p) for p in outputs),
+            'seconds': round(time.time() - start, 3),
+        }
+    except Exception as e:
+        return {
+            'path': task['path'],
+            'status': 'failed',
+            'error': f'{type(e).__name__}: {e}',
+            'seconds': round(time.time() - start, 3),
+        }
+
+
+# ===== 清单 =====
+
+def load_manifest(manifest_path: str) -> Dict[str, dict]:
+    """
+    读取清单,同一文件以最后一条记录为准
+
+    中断时最后一行可能只写了一半,无法解析的行直接忽略
+    """
+    records = {}
+    if not os.path.exists(manifest_path):
+        return records
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                records[record['path']] = record
+            except (ValueError, KeyError, TypeError):
+                continue
+    return records
+
+
+def is_finished(record: Optional[dict], size: int, mtime_ns: int, operations: str) -> bool:
+    """清单记录是否对应当前源文件和处理选项,且输出文件仍在"""
+    return (
+        record is not None
+        and record.get('status') == 'ok'
+        and record.get('size') == size
+        and record.get('mtime_ns') == mtime_ns
+        and record.get('operations') == operations
+        and all(os.path.exists(p) for p in record.get('outputs', []))
+    )
+
+
+# ===== 扫描 =====
+
+def scan_sources(source_dir: str, output_dir: str, preprocess: bool, styles: List[str]) -> List[dict]:
+    """
+    遍历目录树,生成任务列表(输出目录镜像源目录结构)
+
+    同目录下主名相同的文件(如 a.jpg 与 a.png)输出名追加原扩展名,避免互相覆盖
+
+    Returns:
+        list: [{'path', 'source', 'size', 'mtime_ns', 'preprocessed', 'sketches'}]
+    """
+    source_dir = os.path.abspath(source_dir)
+    output_dir = os.path.abspath(output_dir)
+    tasks = []
+    for root, dirs, files in os.walk(source_dir):
+        # 输出目录位于源目录内时不处理自己的输出
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != output_dir)
+        rel_dir = os.path.relpath(root, source_dir)
+        target_dir = output_dir if rel_dir == '.' else os.path.join(output_dir, rel_dir)
+        used_stems = set()
+        for name in sorted(files):
+            if not name.lower().endswith(SOURCE_EXTENSIONS):
+                continue
+            stem, ext = os.path.splitext(name)
+            if stem in used_stems:
+                stem = f'{stem}_{ext[1:].lower()}'
+            used_stems.add(stem)
+
+            source = os.path.join(root, name)
+            stat = os.stat(source)
+            tasks.append({
+                'path': os.path.relpath(source, source_dir),
+                'source': source,
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'preprocessed': os.path.join(target_dir, f'{stem}.jpg') if preprocess else None,
+                'sketches': {style: os.path.join(target_dir, f'{stem}_{style}.jpg') for style in styles},
+            })
+    return tasks
+
+
+# ===== 进度 =====
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f'{seconds // 3600}h{seconds % 3600 // 60:02d}m'
+    if seconds >= 60:
+        return f'{seconds // 60}m{seconds % 60:02d}s'
+    return f'{seconds}s'
+
+
+class Progress:
+    """单行进度显示(非终端输出时每隔一段时间打印一行)"""
+
+    BAR_WIDTH = 30
+    LOG_INTERVAL = 10.0
+
+    def __init__(self, total: int, stream=None):
+        self.total = total
+        self.stream = stream or sys.stderr
+        self.interactive = self.stream.isatty()
+        self.start = time.time()
+        self.done = 0
+        self.failed = 0
+        self.bytes_in = 0
+        self._last_draw = 0.0
+
+    def update(self, record: dict):
+        self.done += 1
+        self.bytes_in += record['size']
+        if record['status'] != 'ok':
+            self.failed += 1
+        now = time.time()
+        interval = 0.1 if self.interactive else self.LOG_INTERVAL
+        if now - self._last_draw >= interval or self.done == self.total:
+            self._last_draw = now
+            self.draw(now)
+
+    def draw(self, now: float):
+        elapsed = max(now - self.start, 1e-6)
+        rate = self.done / elapsed
+        eta = (self.total - self.done) / rate if rate > 0 else 0
+        filled = int(self.BAR_WIDTH * self.done / max(self.total, 1))
+        line = (f'[{"#" * filled}{"-" * (self.BAR_WIDTH - filled)}] {self.done}/{self.total} '
+                f'{rate:.1f}张/s {self.bytes_in / 1024 / 1024 / elapsed:.1f}MB/s '
+                f'剩余{format_duration(eta)}')
+        if self.failed:
+            line += f' 失败{self.failed}'
+        if self.interactive:
+            self.stream.write('\r' + line + '\033[K')
+        else:
+            self.stream.write(line + '\n')
+        self.stream.flush()
+
+    def finish(self):
+        if self.interactive and self.done:
+            self.stream.write('\n')
+            self.stream.flush()
+
+
+# ===== 批处理 =====
+
+def run_batch(
+    source_dir: str,
+    output_dir: str,
+    preprocess: bool = True,
+    styles: Optional[List[str]] = None,
+    workers: Optional[int] = None,
+    manifest_path: Optional[str] = None,
+    force: bool = False
+) -> dict:
+    """
+    批量处理目录树
+
+    Args:
+        source_dir: 源目录
+        output_dir: 输出目录
+        preprocess: 是否预处理(素描基于预处理结果;关闭时直接由原图生成素描)
+        styles: 素描风格列表,为空则不生成素描
+        workers: 工作进程数,默认可用CPU核数
+        manifest_path: 清单路径,默认 <输出目录>/manifest.jsonl
+        force: 忽略清单,全部重新处理
+
+    Returns:
+        dict: 吞吐量汇总(同时写入 <输出目录>/summary.json)
+    """
+    from sketch_converter import SketchConverter
+
+    styles = list(styles or [])
+    unknown = [s for s in styles if s not in SketchConverter.STYLES]
+    if unknown:
+        raise ValueError(f"不支持的素描风格: {', '.join(unknown)} (可选: {', '.join(SketchConverter.STYLES)})")
+    if not preprocess and not styles:
+        raise ValueError("未指定任何处理: 关闭预处理时需用 --sketch 指定素描风格")
+    if os.path.realpath(source_dir) == os.path.realpath(output_dir):
+        raise ValueError("输出目录不能与源目录相同(预处理结果会覆盖源图)")
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(output_dir, MANIFEST_NAME)
+    operations = '+'.join((['preprocess'] if preprocess else []) + [f'sketch:{s}' for s in styles])
+
+    tasks = scan_sources(source_dir, output_dir, preprocess, styles)
+    sources = {os.path.realpath(t['source']) for t in tasks}
+    for task in tasks:
+        for path in [task['preprocessed'], *task['sketches'].values()]:
+            if path and os.path.realpath(path) in sources:
+                raise ValueError(f"输出会覆盖源图: {path},请换一个输出目录")
+    finished = {} if force else load_manifest(manifest_path)
+    pending = [t for t in tasks
+               if not is_finished(finished.get(t['path']), t['size'], t['mtime_ns'], operations)]
+    skipped = len(tasks) - len(pending)
+
+    cpus = available_cpus()
+    workers = max(1, min(workers or cpus, len(pending) or 1))
+    cv2_threads = max(1, cpus // workers)
+
+    print(f"📂 扫描完成: {len(tasks)}张, 已完成跳过{skipped}张, 待处理{len(pending)}张")
+    print(f"⚙️  处理: {operations}, {workers}个进程, 每进程OpenCV线程数={cv2_threads}")
+
+    progress = Progress(len(pending))
+    seconds = []
+    bytes_out = 0
+    failures = []
+    interrupted = False
+    forced = False
+
+    if pending:
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(cv2_threads,)
+        )
+        # 只保持有限个任务在途: 内存与目录大小无关,中断时需等待的任务也少
+        queue = iter(pending)
+        in_flight = {}
+        with open(manifest_path, 'a', encoding='utf-8') as manifest:
+            try:
+                while True:
+                    while not interrupted and len(in_flight) < workers * 2:
+                        task = next(queue, None)
+                        if task is None:
+                            break
+                        in_flight[executor.submit(_process_one, task)] = task
+                    if not in_flight:
+                        break
+                    try:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    except KeyboardInterrupt:
+                        if interrupted:
+                            forced = True
+                            print("⏹️  强制退出,放弃进行中的任务")
+                            break
+                        interrupted = True
+                        progress.finish()
+                        # 排队未开始的任务直接取消,只等待工作进程中正在处理的
+                        for future in [f for f in in_flight if f.cancel()]:
+                            del in_flight[future]
+                        print(f"⏹️  已中断,等待{len(in_flight)}个进行中的任务完成(再次Ctrl-C强制退出)...")
+                        continue
+                    for future in done:
+                        task = in_flight.pop(future)
+                        record = future.result()
+                        record.update(size=task['size'], mtime_ns=task['mtime_ns'], operations=operations)
+                        manifest.write(json.dumps(record, ensure_ascii=False) + '\n')
+                        manifest.flush()
+                        if record['status'] == 'ok':
+                            seconds.append(record['seconds'])
+                            bytes_out += record['bytes_out']
+                        else:
+                            failures.append({'path': record['path'], 'error': record['error']})
+                        progress.update(record)
+            finally:
+                processes = list((getattr(executor, '_processes', None) or {}).values())
+                executor.shutdown(wait=not interrupted, cancel_futures=True)
+                if forced:
+                    # 工作进程忽略Ctrl-C,不结束的话解释器退出时仍会等待它们处理完当前图片
+                    for process in processes:
+                        process.terminate()
+        progress.finish()
+
+    elapsed = time.time() - progress.start
+    bytes_in = progress.bytes_in
+    summary = {
+        'source_dir': os.path.abspath(source_dir),
+        'output_dir': os.path.abspath(output_dir),
+        'operations': operations,
+        'workers': workers,
+        'total': len(tasks),
+        'skipped': skipped,
+        'processed': progress.done,
+        'succeeded': progress.done - len(failures),
+        'failed': len(failures),
+        'interrupted': interrupted,
+        'elapsed_s': round(elapsed, 2),
+        'images_per_s': round(progress.done / elapsed, 2) if elapsed > 0 else 0.0,
+        'mb_in_per_s': round(bytes_in / 1024 / 1024 / elapsed, 2) if elapsed > 0 else 0.0,
+        'mb_in': round(bytes_in / 1024 / 1024, 2),
+        'mb_out': round(bytes_out / 1024 / 1024, 2),
+        'per_image_p50_s': round(percentile(seconds, 50, 0.0), 3),
+        'per_image_p95_s': round(percentile(seconds, 95, 0.0), 3),
+        'failures': failures,
+    }
+    # 全部跳过时保留上一次实际处理的汇总,不用全零的结果覆盖
+    if pending:
+        with open(os.path.join(output_dir, SUMMARY_NAME), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
+
+
+def main():
+    """命令行: 批量预处理 / 素描转换"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='批量预处理与素描转换(可中断续跑)')
+    parser.add_argument('source_dir', help='源图片目录(递归处理子目录)')
+    parser.add_argument('output_dir', help='输出目录(镜像源目录结构)')
+    parser.add_argument('--sketch', default='', help='素描风格,逗号分隔,如 pencil,artistic')
+    parser.add_argument('--no-preprocess', action='store_true', help='不预处理,直接由原图生成素描')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('BATCH_WORKERS', '0')),
+                        help='工作进程数,默认可用CPU核数')
+    parser.add_argument('--manifest', help=f'清单路径,默认 <输出目录>/{MANIFEST_NAME}')
+    parser.add_argument('--force', action='store_true', help='忽略清单,全部重新处理')
+    args = parser.parse_args()
+
+    styles = [s.strip() for s in args.sketch.split(',') if s.strip()]
+    try:
+        summary = run_batch(
+            args.source_dir, args.output_dir,
+            preprocess=not args.no_preprocess, styles=styles,
+            workers=args.workers or None, manifest_path=args.manifest, force=args.force
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    print(f"\n{'⏹️  已中断' if summary['interrupted'] else '✅ 批量处理完成'}: "
+          f"处理{summary['processed']}张(失败{summary['failed']}), 跳过{summary['skipped']}张, "
+          f"耗时{format_duration(summary['elapsed_s'])}")
+    print(f"   吞吐量: {summary['images_per_s']}张/s, {summary['mb_in_per_s']}MB/s(输入), "
+          f"单张p50={summary['per_image_p50_s']}s p95={summary['per_image_p95_s']}s")
+    for failure in summary['failures'][:10]:
+        print(f"   ❌ {failure['path']}: {failure['error']}")
+    if summary['interrupted'] or summary['failed']:
+        print("   重新运行同一命令即可续跑(失败的文件会重试)")
+    if summary['processed'] or summary['interrupted']:
+        print(f"   汇总: {os.path.join(summary['output_dir'], SUMMARY_NAME)}")
+    else:
+        print("   没有需要处理的文件,汇总文件保持上一次的结果")
+    sys.exit(130 if summary['interrupted'] else 1 if summary['failed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+"""
+上游服务模拟器 - 压测专用
+在本地启动FaceBody / ImageSeg / OSS / DashScope的替身服务,
+可配置延迟、错误率和限流,压测时无需调用真实的付费接口
+
+用法:
+    python benchmarks/fake_upstream.py --latency-ms 300 --error-rate 0.01
+    # 按输出的export语句设置环境变量后启动app.py即可
+"""
+
+import abc
+import argparse
+import json
+import random
+import struct
+import sys
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+SERVICES = ('facebody', 'imageseg', 'oss', 'dashscope')
+
+
+class FaultProfile:
+    """故障注入配置: 延迟、错误率、限流"""
+
+    def __init__(
+        self,
+        latency_ms: float = 200.0,
+        jitter_ms: float = 50.0,
+        error_rate: float = 0.0,
+        qps: float = 0.0,
+        max_inflight: int = 0
+    ):
+        """
+        Args:
+            latency_ms: 平均响应延迟(毫秒)
+            jitter_ms: 延迟抖动(毫秒,正态分布标准差)
+            error_rate: 随机返回服务端错误的概率(0-1)
+            qps: 每秒允许的请求数,超出返回限流错误(0=不限)
+            max_inflight: 最大并发请求数,超出返回限流错误(0=不限)
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.qps = qps
+        self.max_inflight = max_inflight
+
+    @classmethod
+    def from_dict(cls, data: dict, base: Optional['FaultProfile'] = None) -> 'FaultProfile':
+        """基于默认配置叠加覆盖项"""
+        merged = dict(vars(base)) if base else {}
+        merged.update(data)
+        return cls(**merged)
+
+    def sample_latency(self) -> float:
+        """采样一次延迟(秒)"""
+        latency = random.gauss(self.latency_ms, self.jitter_ms) if self.jitter_ms else self.latency_ms
+        return max(latency, 0.0) / 1000.0
+
+
+class TokenBucket:
+    """令牌桶限流器"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        """尝试获取一个令牌"""
+        if self.rate <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+def make_placeholder_png(width: int = 512, height: int = 512) -> bytes:
+    """生成一张RGBA渐变PNG(纯标准库实现),作为模拟的发型/生成结果图"""
+    raw = bytearray()
+    for y in range(height):
+        raw.append(0)  # 每行的filter类型
+        for x in range(width):
+            raw += bytes((x * 255 // width, y * 255 // height, 160, 255 if (x + y) % 7 else 0))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        body = tag + data
+        return struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(bytes(raw), 6)) + chunk(b'IEND', b''))
+
+
+class FakeService(abc.ABC):
+    """模拟服务基类: 统计、限流、延迟与错误注入"""
+
+    name = 'base'
+
+    def __init__(self, profile: FaultProfile):
+        self.profile = profile
+        self.bucket = TokenBucket(profile.qps)
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.stats = {'requests': 0, 'throttled': 0, 'errors': 0, 'ok': 0}
+        self.public_base = ''
+
+    def count(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
+
+    def admit(self) -> bool:
+        """并发与QPS限流检查"""
+        with self.lock:
+            if self.profile.max_inflight and self.inflight >= self.profile.max_inflight:
+                return False
+            self.inflight += 1
+        if not self.bucket.try_acquire():
+            with self.lock:
+                self.inflight -= 1
+            return False
+        return True
+
+    def release(self):
+        with self.lock:
+            self.inflight -= 1
+
+    @abc.abstractmethod
+    def throttled_response(self) -> Tuple[int, Dict[str, str], bytes]:
+        """限流时的响应(状态码, 响应头, 响应体)"""
+
+    @abc.abstractmethod
+    def error_response(self) -> Tuple[int, Dict[str, str], bytes]:
+        """注入错误时的响应"""
+
+    @abc.abstractmethod
+    def dispatch(self, method: str, path: str, query: dict, headers, body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        """处理已通过限流的请求"""
+
+
+def _json(status: int, data: dict) -> Tuple[int, Dict[str, str], bytes]:
+    return status, {'Content-Type': 'application/json'}, json.dumps(data).encode('utf-8')
+
+
+class FakeRpcService(FakeService):
+    """阿里云RPC风格接口(FaceBody/ImageSeg)的公共部分"""
+
+    def throttled_response(self):
+        return _json(429, {'Code': 'Throttling.User', 'Message': 'Request was denied due to user flow control.',
+                           'RequestId': uuid.uuid4().hex})
+
+    def error_response(self):
+        return _json(500, {'Code': 'InternalError', 'Message': 'injected failure',
+                           'RequestId': uuid.uuid4().hex})
+
+    def dispatch(self, method, path, query, headers, body):
+        params = {k: v[0] for k, v in query.items()}
+        if body and 'json' not in headers.get('Content-Type', ''):
+            params.update({k: v[0] for k, v in parse_qs(body.decode('utf-8')).items()})
+        # 旧版SDK用RPC查询参数Action,新版(ACS3签名)放在x-acs-action请求头
+        action = params.get('Action') or headers.get('x-acs-action', '')
+        handler = getattr(self, f'action_{action}', None)
+        if handler is None:
+            return _json(400, {'Code': 'InvalidAction.NotFound', 'Message': f'unknown action {action}',
+                               'RequestId': uuid.uuid4().hex})
+        return handler(params)
+
+
+class FakeFaceBody(FakeRpcService):
+    """人脸融合模拟: 模板增删 + 融合(直接返回用户图URL)"""
+
+    name = 'facebody'
+
+    def __init__(self, profile):
+        super().__init__(profile)
+        self.templates = {}
+
+    def action_AddFaceImageTemplate(self, params):
+        template_id = uuid.uuid4().hex
+        with self.lock:
+            self.templates[template_id] = params.get('ImageURL')
+        return _json(200, {'RequestId': uuid.uuid4().hex, 'Data': {'TemplateId': template_id}})
+
+    def action_DeleteFaceImageTemplate(self, params):
+        with self.lock:
+            known = self.templates.pop(params.get('TemplateId'), None) is not None
+        if not known:
+            return _json(400, {'Code': 'InvalidParameter.TemplateId', 'Message': 'template not found',
+                               'RequestId': uuid.uuid4().hex})
+        return _json(200, {'RequestId': uuid.uuid4().hex})
+
+    def action_MergeImageFace(self, params):
+        with self.lock:
+            known = params.get('TemplateId') in self.templates
+        if not known:
+            return _json(400, {'Code': 'InvalidParameter.TemplateId', 'Message': 'template not found',
+                               'RequestId': uuid.uuid4().hex})
+        return _json(200, {'RequestId': uuid.uuid4().hex, 'Data': {'ImageURL': params.get('ImageURL')}})
+
+
+class FakeImageSeg(FakeRpcService):
+    """头发分割模拟: 返回固定的透明发型PNG"""
+
+    name = 'imageseg'
+
+    def __init__(self, profile):
+        super().__init__(profile)
+        self.hair_png = make_placeholder_png()
+
+    def action_SegmentHair(self, params):
+        element = {'ImageURL': f'{self.public_base}/hair/{uuid.uuid4().hex}.png',
+                   'Width': 512, 'Height': 512, 'X': 0, 'Y': 0}
+        return _json(200, {'RequestId': uuid.uuid4().hex, 'Data': {'Elements': [element]}})
+
+    def dispatch(self, method, path, query, headers, body):
+        if method == 'GET' and path.startswith('/hair/'):
+            return 200, {'Content-Type': 'image/png'}, self.hair_png
+        return super().dispatch(method, path, query, headers, body)
+
+
+class FakeOss(FakeService):
+    """OSS模拟: 路径风格的PUT/GET/HEAD,对象保存在内存中(LRU淘汰)"""
+
+    name = 'oss'
+    MAX_OBJECTS = 4096
+
+    def __init__(self, profile):
+        super().__init__(profile)
+        self.objects = OrderedDict()
+
+    def _xml_error(self, status: int, code: str, message: str):
+        body = (f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code>'
+                f'<Message>{message}</Message><RequestId>{uuid.uuid4().hex}</RequestId></Error>')
+        return status, {'Content-Type': 'application/xml'}, body.encode('utf-8')
+
+    def throttled_response(self):
+        return self._xml_error(503, 'SlowDown', 'Please reduce your request rate.')
+
+    def error_response(self):
+        return self._xml_error(500, 'InternalError', 'injected failure')
+
+    def dispatch(self, method, path, query, headers, body):
+        key = unquote(path).lstrip('/')
+        if method == 'PUT':
+            with self.lock:
+                self.objects[key] = body
+                self.objects.move_to_end(key)
+                while len(self.objects) > self.MAX_OBJECTS:
+                    self.objects.popitem(last=False)
+            etag = '"%08X"' % (zlib.crc32(body) & 0xffffffff)
+            return 200, {'ETag': etag, 'x-oss-request-id': uuid.uuid4().hex}, b''
+        if method in ('GET', 'HEAD'):
+            with self.lock:
+                data = self.objects.get(key)
+            if data is None:
+                return self._xml_error(404, 'NoSuchKey', 'The specified key does not exist.')
+            content_type = 'image/png' if key.endswith('.png') else 'image/jpeg'
+            return 200, {'Content-Type': content_type}, data
+        return self._xml_error(405, 'MethodNotAllowed', method)
+
+
+class FakeDashScope(FakeService):
+    """DashScope模拟: 异步任务提交 + 轮询,任务耗时可配置"""
+
+    name = 'dashscope'
+
+    def __init__(self, profile, task_seconds: float = 15.0):
+        super().__init__(profile)
+        self.task_seconds = task_seconds
+        self.tasks = {}
+        self.result_png = make_placeholder_png()
+
+    def throttled_response(self):
+        return _json(429, {'code': 'Throttling.RateQuota', 'message': 'Requests rate limit exceeded',
+                           'request_id': uuid.uuid4().hex})
+
+    def error_response(self):
+        return _json(500, {'code': 'InternalError', 'message': 'injected failure',
+                           'request_id': uuid.uuid4().hex})
+
+    def dispatch(self, method, path, query, headers, body):
+        if method == 'POST' and '/services/' in path:
+            payload = json.loads(body or b'{}')
+            images = (payload.get('input') or {}).get('images') or []
+            task_id = uuid.uuid4().hex
+            result_url = images[0] if images and str(images[0]).startswith('http') else \
+                f'{self.public_base}/results/{task_id}.png'
+            with self.lock:
+                self.tasks[task_id] = {'done_at': time.time() + self.task_seconds, 'url': result_url}
+            return _json(200, {'request_id': uuid.uuid4().hex,
+                               'output': {'task_id': task_id, 'task_status': 'PENDING'}})
+        if method == 'GET' and '/tasks/' in path:
+            task_id = path.rsplit('/', 1)[-1]
+            with self.lock:
+                task = self.tasks.get(task_id)
+            if task is None:
+                return _json(404, {'code': 'NotFound', 'message': 'task not found',
+                                   'request_id': uuid.uuid4().hex})
+            output = {'task_id': task_id, 'task_status': 'RUNNING'}
+            if time.time() >= task['done_at']:
+                output.update(task_status='SUCCEEDED', results=[{'url': task['url']}])
+            return _json(200, {'request_id': uuid.uuid4().hex, 'output': output,
+                               'usage': {'image_count': 1}})
+        if method == 'GET' and path.startswith('/results/'):
+            return 200, {'Content-Type': 'image/png'}, self.result_png
+        return _json(404, {'code': 'NotFound', 'message': path, 'request_id': uuid.uuid4().hex})
+
+
+def _make_handler(service: FakeService):
+    """为指定服务生成HTTP请求处理类"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _handle(self):
+            parsed = urlparse(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+
+            if parsed.path == '/__stats':
+                status, headers, payload = _json(200, dict(service.stats, inflight=service.inflight))
+            else:
+                service.count('requests')
+                if not service.admit():
+                    service.count('throttled')
+                    status, headers, payload = service.throttled_response()
+                else:
+                    try:
+                        time.sleep(service.profile.sample_latency())
+                        if random.random() < service.profile.error_rate:
+                            service.count('errors')
+                            status, headers, payload = service.error_response()
+                        else:
+                            status, headers, payload = service.dispatch(
+                                self.command, parsed.path, parse_qs(parsed.query), self.headers, body
+                            )
+                            service.count('ok')
+                    finally:
+                        service.release()
+
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(payload)
+
+        do_GET = do_POST = do_PUT = do_HEAD = do_DELETE = _handle
+
+    return Handler
+
+
+class FakeUpstream:
+    """同时启动四个模拟服务,并给出让应用指向它们的环境变量"""
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        base_port: int = 9001,
+        profiles: Optional[Dict[str, FaultProfile]] = None,
+        task_seconds: float = 15.0,
+        bucket_name: str = 'hair-transfer-bucket'
+    ):
+        profiles = profiles or {}
+        self.host = host
+        self.bucket_name = bucket_name
+        self.services = {
+            'facebody': FakeFaceBody(profiles.get('facebody', FaultProfile())),
+            'imageseg': FakeImageSeg(profiles.get('imageseg', FaultProfile())),
+            'oss': FakeOss(profiles.get('oss', FaultProfile(latency_ms=30, jitter_ms=10))),
+            'dashscope': FakeDashScope(profiles.get('dashscope', FaultProfile()), task_seconds),
+        }
+        self.ports = {name: base_port + i for i, name in enumerate(SERVICES)}
+        self.servers = []
+        self.threads = []
+
+    def start(self) -> 'FakeUpstream':
+        for name in SERVICES:
+            service = self.services[name]
+            service.public_base = f'http://{self.host}:{self.ports[name]}'
+            server = ThreadingHTTPServer((self.host, self.ports[name]), _make_handler(service))
+            server.daemon_threads = True
+            thread = threading.Thread(target=server.serve_forever, name=f'fake-{name}', daemon=True)
+            thread.start()
+            self.servers.append(server)
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers.clear()
+
+    def env(self) -> Dict[str, str]:
+        """应用进程需要的环境变量"""
+        return {
+            'ALIBABA_CLOUD_ACCESS_KEY_ID': 'fake-access-key-id',
+            'ALIBABA_CLOUD_ACCESS_KEY_SECRET': 'fake-access-key-secret',
+            'DASHSCOPE_API_KEY': 'sk-fake-dashscope-key',
+            'ALIYUN_API_PROTOCOL': 'http',
+            'ALIYUN_FACEBODY_ENDPOINT': f'{self.host}:{self.ports["facebody"]}',
+            'ALIYUN_IMAGESEG_ENDPOINT': f'{self.host}:{self.ports["imageseg"]}',
+            'OSS_ENDPOINT': f'http://{self.host}:{self.ports["oss"]}',
+            'OSS_BUCKET': self.bucket_name,
+            'OSS_PUBLIC_BASE_URL': f'http://{self.host}:{self.ports["oss"]}/{self.bucket_name}',
+            'DASHSCOPE_BASE_URL': f'http://{self.host}:{self.ports["dashscope"]}/api/v1',
+        }
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: dict(service.stats) for name, service in self.services.items()}
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    """注册故障注入相关的命令行参数(load_test.py复用)"""
+    group = parser.add_argument_group('模拟上游配置')
+    group.add_argument('--latency-ms', type=float, default=200.0, help='平均延迟(毫秒)')
+    group.add_argument('--jitter-ms', type=float, default=50.0, help='延迟抖动(毫秒)')
+    group.add_argument('--error-rate', type=float, default=0.0, help='错误注入概率(0-1)')
+    group.add_argument('--qps', type=float, default=0.0, help='每服务QPS上限,0为不限')
+    group.add_argument('--max-inflight', type=int, default=0, help='每服务并发上限,0为不限')
+    group.add_argument('--task-seconds', type=float, default=15.0, help='DashScope异步任务耗时(秒)')
+    group.add_argument('--upstream-config', help='按服务覆盖配置的JSON文件, 如 {"facebody": {"latency_ms": 800}}')
+    group.add_argument('--upstream-host', default='127.0.0.1')
+    group.add_argument('--upstream-port', type=int, default=9001, help='起始端口,四个服务依次占用')
+
+
+def upstream_from_args(args) -> FakeUpstream:
+    """根据命令行参数构造FakeUpstream"""
+    base = FaultProfile(args.latency_ms, args.jitter_ms, args.error_rate, args.qps, args.max_inflight)
+    overrides = {}
+    if args.upstream_config:
+        with open(args.upstream_config, 'r', encoding='utf-8') as f:
+            overrides = json.load(f)
+    profiles = {name: FaultProfile.from_dict(overrides.get(name, {}), base) for name in SERVICES}
+    return FakeUpstream(args.upstream_host, args.upstream_port, profiles, args.task_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='启动本地模拟上游服务(FaceBody/ImageSeg/OSS/DashScope)')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    upstream = upstream_from_args(args).start()
+
+    print("="*60)
+    print("🧪 模拟上游服务已启动")
+    print("="*60)
+    for name in SERVICES:
+        print(f"   {name:<10} http://{upstream.host}:{upstream.ports[name]}")
+    print("\n请在启动app.py前设置以下环境变量:\n")
+    for key, value in upstream.env().items():
+        print(f"export {key}='{value}'")
+    print("\n按 Ctrl+C 停止")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        upstream.stop()
+        print("\n📊 请求统计:")
+        print(json.dumps(upstream.stats(), indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+端到端压测工具
+对 /api/extract-hair 和 /api/transfer 在不同并发下施压,
+输出吞吐量与 p50/p95/p99 延迟
+
+用法:
+    # 自动启动模拟上游和应用进程(完全离线,不产生费用)
+    python benchmarks/load_test.py --spawn --concurrency 1,4,16 --requests 40
+
+    # 对已启动的应用压测
+    python benchmarks/load_test.py --base-url http://127.0.0.1:5002 --flows transfer
+
+    # 另一家门店以8并发持续提交批量任务时,测量实时请求的延迟
+    python benchmarks/load_test.py --spawn --flows transfer --batch-load 8
+"""
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+
+from fake_upstream import add_profile_arguments, upstream_from_args
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from metrics import percentile  # noqa: E402
+
+_local = threading.local()
+
+
+def _session() -> requests.Session:
+    """每个压测线程复用一个连接"""
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def make_sample_images(directory: str) -> Dict[str, str]:
+    """生成合成测试图(未指定真实样图时使用)"""
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    paths = {}
+    for name, color in (('hairstyle', (60, 40, 30)), ('customer', (90, 120, 160))):
+        image = np.full((1600, 1200, 3), 230, dtype=np.uint8)
+        cv2.ellipse(image, (600, 700), (300, 400), 0, 0, 360, color, -1)
+        cv2.ellipse(image, (600, 760), (220, 300), 0, 0, 360, (170, 190, 220), -1)
+        noise = rng.integers(0, 12, image.shape, dtype=np.uint8)
+        path = os.path.join(directory, f'{name}.jpg')
+        cv2.imwrite(path, cv2.add(image, noise), [cv2.IMWRITE_JPEG_QUALITY, 92])
+        paths[name] = path
+    return paths
+
+
+class LoadRunner:
+    """按并发级别执行压测并汇总统计"""
+
+    def __init__(self, base_url: str, hairstyle_path: str, customer_path: str, form: dict, timeout: float,
+                 headers: Optional[dict] = None):
+        self.base_url = base_url.rstrip('/')
+        self.hairstyle_path = hairstyle_path
+        self.customer_path = customer_path
+        self.form = form
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.original_hair_url = None
+        self.batch_counts = {}
+        self.batch_lock = threading.Lock()
+
+    def _post(self, path: str, files: dict, data: Optional[dict] = None,
+              headers: Optional[dict] = None) -> requests.Response:
+        opened = {key: (os.path.basename(p), open(p, 'rb'), 'image/jpeg') for key, p in files.items()}
+        try:
+            return _session().post(f'{self.base_url}{path}', files=opened, data=data or {},
+                                   headers=headers or self.headers, timeout=self.timeout)
+        finally:
+            for _, handle, _ in opened.values():
+                handle.close()
+
+    def extract_once(self) -> requests.Response:
+        return self._post('/api/extract-hair', {'hairstyle_image': self.hairstyle_path})
+
+    def transfer_once(self, headers: Optional[dict] = None) -> requests.Response:
+        data = dict(self.form, original_hair_url=self.original_hair_url)
+        return self._post('/api/transfer', {'customer_image': self.customer_path}, data, headers)
+
+    def start_batch_load(self, concurrency: int, tenant: str = 'bulk-salon') -> threading.Event:
+        """
+        后台以batch优先级持续提交迁移(模拟一家门店的批量任务),返回用于停止的事件
+
+        被拒绝(429)时按Retry-After等待后继续
+        """
+        stop = threading.Event()
+        headers = {'X-Tenant-ID': tenant, 'X-Priority': 'batch'}
+        with self.batch_lock:
+            self.batch_counts = {}
+
+        def loop():
+            while not stop.is_set():
+                try:
+                    response = self.transfer_once(headers)
+                    status = response.status_code
+                except requests.RequestException as e:
+                    response, status = None, type(e).__name__
+                with self.batch_lock:
+                    self.batch_counts[str(status)] = self.batch_counts.get(str(status), 0) + 1
+                if status == 429:
+                    stop.wait(float(response.headers.get('Retry-After', '1')))
+
+        for _ in range(concurrency):
+            threading.Thread(target=loop, daemon=True).start()
+        return stop
+
+    def prepare_transfer(self):
+        """transfer流程依赖一次发型提取得到的原图URL(不计入统计)"""
+        response = self.extract_once()
+        body = response.json() if response.headers.get('Content-Type', '').startswith('application/json') else {}
+        if response.status_code != 200 or not body.get('success'):
+            raise RuntimeError(f"准备发型图失败: HTTP {response.status_code} {body}")
+        self.original_hair_url = body['original_url']
+
+    def run_level(self, flow: str, concurrency: int, total: int) -> dict:
+        """在指定并发下发送total个请求"""
+        call = self.extract_once if flow == 'extract' else self.transfer_once
+        latencies, errors = [], {}
+        lock = threading.Lock()
+
+        def one(_):
+            start = time.perf_counter()
+            try:
+                response = call()
+                status = response.status_code
+            except requests.RequestException as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - start
+            with lock:
+                if status == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors[str(status)] = errors.get(str(status), 0) + 1
+
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(total)))
+        wall = time.perf_counter() - wall_start
+
+        return {
+            'flow': flow,
+            'concurrency': concurrency,
+            'requests': total,
+            'ok': len(latencies),
+            'errors': errors,
+            'wall_seconds': round(wall, 3),
+            'throughput_rps': round(len(latencies) / wall, 3) if wall else 0.0,
+            'p50_ms': round(percentile(latencies, 50, 0.0) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 95, 0.0) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 99, 0.0) * 1000, 1),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 1) if latencies else 0.0,
+        }
+
+
+def spawn_app(env: dict, port: int) -> subprocess.Popen:
+    """
+    以子进程启动Flask应用(关闭debug/reloader,开启多线程)
+
+    应用在独立的进程组中运行,结束时连同图像进程池的工作进程一起结束(见stop_app)
+    """
+    code = f"import app; app.app.run(host='127.0.0.1', port={port}, debug=False, threaded=True)"
+    return subprocess.Popen(
+        [sys.executable, '-c', code],
+        cwd=APP_DIR,
+        env=dict(os.environ, **env),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+
+
+def stop_app(proc: subprocess.Popen, timeout: float = 10.0):
+    """向应用所在的进程组发送SIGTERM,超时后SIGKILL"""
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=timeout)
+    except ProcessLookupError:
+        return
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+
+
+def wait_for_health(base_url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f'{base_url}/api/health', timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"应用未在{timeout:.0f}秒内就绪: {base_url}")
+
+
+def print_table(results: List[dict]):
+    print(f"\n{'flow':<9}{'conc':>5}{'reqs':>6}{'ok':>6}{'err':>6}{'rps':>9}"
+          f"{'p50ms':>10}{'p95ms':>10}{'p99ms':>10}{'mean':>10}")
+    for r in results:
+        print(f"{r['flow']:<9}{r['concurrency']:>5}{r['requests']:>6}{r['ok']:>6}"
+              f"{sum(r['errors'].values()):>6}{r['throughput_rps']:>9.2f}"
+              f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['mean_ms']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='发型迁移接口端到端压测')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5002', help='被测应用地址')
+    parser.add_argument('--spawn', action='store_true', help='自动启动模拟上游与应用子进程')
+    parser.add_argument('--app-port', type=int, default=5099, help='--spawn时应用监听端口')
+    parser.add_argument('--flows', default='extract,transfer', help='压测流程: extract,transfer')
+    parser.add_argument('--concurrency', default='1,4,16', help='并发级别列表')
+    parser.add_argument('--requests', type=int, default=40, help='每个并发级别的请求数')
+    parser.add_argument('--hairstyle', help='发型参考图(默认生成合成图)')
+    parser.add_argument('--customer', help='客户照片(默认生成合成图)')
+    parser.add_argument('--enable-sketch', action='store_true', help='transfer时启用素描')
+    parser.add_argument('--sketch-style', default='ink')
+    parser.add_argument('--timeout', type=float, default=300.0, help='单请求超时(秒)')
+    parser.add_argument('--tenant', default='default', help='压测请求的租户(X-Tenant-ID)')
+    parser.add_argument('--priority', default='interactive', help='压测请求的优先级(X-Priority)')
+    parser.add_argument('--batch-load', type=int, default=0,
+                        help='压测期间另一租户以该并发持续提交batch任务(0为不施加)')
+    parser.add_argument('--output', help='结果JSON输出路径')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    flows = [f.strip() for f in args.flows.split(',') if f.strip()]
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+
+    temp_dir = tempfile.mkdtemp(prefix='hair-load-')
+    samples = make_sample_images(temp_dir) if not (args.hairstyle and args.customer) else {}
+    hairstyle_path = args.hairstyle or samples['hairstyle']
+    customer_path = args.customer or samples['customer']
+
+    upstream, app_proc = None, None
+    base_url = args.base_url
+    try:
+        if args.spawn:
+            upstream = upstream_from_args(args).start()
+            base_url = f'http://127.0.0.1:{args.app_port}'
+            app_env = upstream.env()
+            if samples:
+                # 合成图中没有真实人脸,关闭本地人脸预检
+                app_env['FACE_CHECK'] = '0'
+            app_proc = spawn_app(app_env, args.app_port)
+            print(f"🧪 模拟上游已启动, 应用子进程: {base_url}")
+        wait_for_health(base_url)
+
+        form = {
+            'model_version': 'v1',
+            'face_blend_ratio': '0.5',
+            'enable_sketch': 'true' if args.enable_sketch else 'false',
+            'sketch_style': args.sketch_style,
+        }
+        headers = {'X-Tenant-ID': args.tenant, 'X-Priority': args.priority}
+        runner = LoadRunner(base_url, hairstyle_path, customer_path, form, args.timeout, headers)
+        if 'transfer' in flows or args.batch_load:
+            runner.prepare_transfer()
+
+        batch_stop = None
+        if args.batch_load:
+            print(f"🏭 后台batch负载: 并发={args.batch_load}")
+            batch_stop = runner.start_batch_load(args.batch_load)
+            time.sleep(2)
+
+        results = []
+        try:
+            for flow in flows:
+                for level in levels:
+                    print(f"🚀 {flow} 并发={level} 请求数={args.requests} ...")
+                    results.append(runner.run_level(flow, level, args.requests))
+        finally:
+            if batch_stop:
+                batch_stop.set()
+        print_table(results)
+
+        report = {'base_url': base_url, 'results': results}
+        if batch_stop:
+            with runner.batch_lock:
+                batch_counts = dict(runner.batch_counts)
+            print(f"   batch请求状态: {batch_counts}")
+            report['batch_load'] = {'concurrency': args.batch_load, 'statuses': batch_counts}
+        if upstream:
+            report['upstream_stats'] = upstream.stats()
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            print(f"\n✅ 结果已保存: {args.output}")
+    finally:
+        if app_proc:
+            stop_app(app_proc)
+        if upstream:
+            upstream.stop()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
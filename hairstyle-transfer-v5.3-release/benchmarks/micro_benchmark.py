@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+本地图像计算基准测试
+测量 ImagePreprocessor 与 SketchConverter 各环节的耗时、峰值内存和写出字节数,
+可保存为JSON基线,并在后续运行中检测性能回退
+
+峰值内存分两列: RSS增量(含OpenCV/numpy在C层的分配,仅Linux)与Python堆(tracemalloc)
+
+用法:
+    python benchmarks/micro_benchmark.py --save-baseline baseline.json
+    python benchmarks/micro_benchmark.py --baseline baseline.json --threshold 0.15
+    python benchmarks/micro_benchmark.py --sizes 256,1024 --samples ./portfolio
+"""
+
+import argparse
+import contextlib
+import ctypes
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from image_preprocessor import ImagePreprocessor  # noqa: E402
+from sketch_converter import SketchConverter  # noqa: E402
+
+
+DEFAULT_SIZES = '256,512,1024,2000,4000,8000'
+SKETCH_STYLES = ('pencil', 'detailed', 'artistic', 'color')
+SAMPLE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def synthetic_image(long_edge: int, seed: int = 0) -> np.ndarray:
+    """
+    生成可复现的合成人像图(竖版3:4)
+
+    渐变背景 + 椭圆"头部/头发" + 传感器噪声,比纯随机噪声更接近真实照片的压缩特性
+    """
+    height = long_edge
+    width = max(1, long_edge * 3 // 4)
+    rng = np.random.default_rng(seed)
+
+    ys = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    xs = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[..., 0] = (180 + 60 * ys * xs).astype(np.uint8)
+    image[..., 1] = (200 - 50 * ys).astype(np.uint8)
+    image[..., 2] = (210 - 40 * xs).astype(np.uint8)
+
+    center = (width // 2, int(height * 0.45))
+    cv2.ellipse(image, center, (int(width * 0.28), int(height * 0.3)), 0, 0, 360, (40, 30, 25), -1)
+    cv2.ellipse(image, (center[0], center[1] + height // 20), (int(width * 0.2), int(height * 0.22)),
+                0, 0, 360, (150, 170, 205), -1)
+    for _ in range(40):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height // 2))
+        cv2.line(image, center, (x, y), (25, 20, 15), max(1, long_edge // 800))
+
+    noise = rng.normal(0, 6, image.shape).astype(np.int16)
+    return np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def scale_to_long_edge(image: np.ndarray, long_edge: int) -> np.ndarray:
+    """将样图缩放到指定长边"""
+    height, width = image.shape[:2]
+    scale = long_edge / max(height, width)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    return cv2.resize(image, size, interpolation=interpolation)
+
+
+def load_inputs(sizes: List[int], samples_dir: Optional[str]) -> Iterator[Tuple[str, np.ndarray]]:
+    """
+    逐个生成 (标签, 图像): 每个尺寸一张合成图,外加缩放到各尺寸的样图
+
+    按需生成,同一时刻只保留当前尺寸的输入,8000px的大图不会抬高小尺寸用例的内存基数
+    """
+    for size in sizes:
+        yield f'synthetic-{size}', synthetic_image(size, seed=size)
+    if samples_dir:
+        for name in sorted(os.listdir(samples_dir)):
+            if not name.lower().endswith(SAMPLE_EXTENSIONS):
+                continue
+            image = cv2.imread(os.path.join(samples_dir, name))
+            if image is None:
+                continue
+            stem = os.path.splitext(name)[0]
+            for size in sizes:
+                yield f'{stem}-{size}', scale_to_long_edge(image, size)
+
+
+def _proc_status_kb(field: str) -> Optional[int]:
+    """读取 /proc/self/status 中的内存字段(kB),非Linux返回None"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _trim_heap():
+    """把glibc缓存的空闲内存归还系统,否则前面用例释放的内存被复用时不会体现为RSS增长"""
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def peak_rss_delta(fn: Callable[[], int]) -> Optional[int]:
+    """
+    执行一次fn,返回峰值RSS相对执行前的增量(字节)
+
+    先写 /proc/self/clear_refs 重置峰值(VmHWM),再以执行后的VmHWM减去执行前的VmRSS;
+    不支持时返回None
+    """
+    gc.collect()
+    _trim_heap()
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return None
+    before = _proc_status_kb('VmRSS')
+    fn()
+    peak = _proc_status_kb('VmHWM')
+    if before is None or peak is None:
+        return None
+    return max(0, peak - before) * 1024
+
+
+def measure(fn: Callable[[], int], repeats: int, warmup: int) -> dict:
+    """
+    执行基准测量
+
+    Args:
+        fn: 被测函数,返回写出的字节数
+        repeats: 计时次数
+        warmup: 预热次数
+
+    Returns:
+        dict: 耗时(中位数/最小值)、峰值RSS增量、Python堆峰值(tracemalloc)、写出字节数
+    """
+    sink = io.StringIO()
+    with contextlib.redirect_stdout(sink):
+        for _ in range(warmup):
+            fn()
+
+        timings = []
+        bytes_written = 0
+        for _ in range(repeats):
+            start = time.perf_counter()
+            bytes_written = fn()
+            timings.append(time.perf_counter() - start)
+
+        # 峰值内存单独测,避免测量开销影响计时;tracemalloc看不到OpenCV在C层的分配,RSS另测一次
+        peak_rss = peak_rss_delta(fn)
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak_heap = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'min_ms': round(min(timings) * 1000, 3),
+        'peak_rss_delta_bytes': peak_rss,
+        'peak_py_heap_bytes': peak_heap,
+        'bytes_written': bytes_written,
+    }
+
+
+def build_cases(image: np.ndarray, work_dir: str) -> Dict[str, Callable[[], int]]:
+    """为一张输入图构建所有被测用例"""
+    preprocessor = ImagePreprocessor()
+    converter = SketchConverter()
+
+    input_path = os.path.join(work_dir, 'input.jpg')
+    cv2.imwrite(input_path, image, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    output_path = os.path.join(work_dir, 'output.jpg')
+
+    height, width = image.shape[:2]
+    target_w, target_h = preprocessor.calculate_target_size(width, height)
+    if (target_w, target_h) == (width, height):
+        target_w, target_h = max(1, width // 2), max(1, height // 2)
+
+    def preprocess() -> int:
+        preprocessor.preprocess_image(input_path, output_path)
+        return os.path.getsize(output_path)
+
+    def compress() -> int:
+        preprocessor.compress_image(image, output_path, preprocessor.MAX_FILE_SIZE)
+        return os.path.getsize(output_path)
+
+    def resize() -> int:
+        preprocessor.resize_image(image, target_w, target_h)
+        return 0
+
+    def sketch(style: str) -> Callable[[], int]:
+        def run() -> int:
+            cv2.imwrite(output_path, converter.convert(image, style=style), [cv2.IMWRITE_JPEG_QUALITY, 95])
+            return os.path.getsize(output_path)
+        return run
+
+    cases = {
+        'preprocess_image': preprocess,
+        'compress_image': compress,
+        f'resize_image[{target_w}x{target_h}]': resize,
+    }
+    for style in SKETCH_STYLES:
+        cases[f'sketch[{style}]'] = sketch(style)
+    return cases
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """对比基线,返回回退描述列表"""
+    regressions = []
+    for case_id, current in results.items():
+        base = baseline.get(case_id)
+        if not base:
+            continue
+        for metric in ('median_ms', 'peak_rss_delta_bytes', 'peak_py_heap_bytes'):
+            old, new = base.get(metric), current.get(metric)
+            if old and new and new > old * (1 + threshold):
+                regressions.append(f"{case_id} {metric}: {old} -> {new} (+{(new / old - 1) * 100:.1f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ImagePreprocessor / SketchConverter 基准测试')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='合成图长边尺寸列表')
+    parser.add_argument('--samples', help='样图目录(每张图会缩放到各尺寸)')
+    parser.add_argument('--repeats', type=int, default=3, help='每个用例计时次数')
+    parser.add_argument('--warmup', type=int, default=1, help='每个用例预热次数')
+    parser.add_argument('--filter', help='只运行名称包含该子串的用例')
+    parser.add_argument('--threads', type=int, help='固定OpenCV线程数(便于复现)')
+    parser.add_argument('--save-baseline', help='将结果保存为基线JSON')
+    parser.add_argument('--baseline', help='与基线JSON对比')
+    parser.add_argument('--threshold', type=float, default=0.15, help='回退阈值(0.15=慢15%%)')
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    results = {}
+
+    print(f"{'case':<52}{'median ms':>12}{'min ms':>12}{'RSS+ MB':>10}{'py heap MB':>12}{'written KB':>12}")
+    with tempfile.TemporaryDirectory(prefix='hair-bench-') as work_dir:
+        for label, image in load_inputs(sizes, args.samples):
+            for name, fn in build_cases(image, work_dir).items():
+                case_id = f'{name}@{label}'
+                if args.filter and args.filter not in case_id:
+                    continue
+                result = measure(fn, args.repeats, args.warmup)
+                result['shape'] = list(image.shape)
+                results[case_id] = result
+                rss = result['peak_rss_delta_bytes']
+                print(f"{case_id:<52}{result['median_ms']:>12.1f}{result['min_ms']:>12.1f}"
+                      f"{rss / 1024 / 1024 if rss is not None else float('nan'):>10.1f}"
+                      f"{result['peak_py_heap_bytes'] / 1024 / 1024:>12.1f}{result['bytes_written'] / 1024:>12.1f}")
+
+    report = {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'cv2_threads': cv2.getNumThreads(),
+            'repeats': args.repeats,
+        },
+        'results': results,
+    }
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n✅ 基线已保存: {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('results', {})
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ 发现 {len(regressions)} 项性能回退 (阈值 {args.threshold * 100:.0f}%):")
+            for line in regressions:
+                print(f"   {line}")
+            return 1
+        print(f"\n✅ 未发现超过 {args.threshold * 100:.0f}% 的性能回退")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+浏览器直传
+服务端签发短时有效的PUT地址,浏览器把客户照片/发型图直接上传到OSS,
+接口只接收对象键(key),图片字节不再先经过Web服务再转传OSS:
+- oss: OSS签名URL,对象可直接作为上游接口的输入URL
+- local: 未配置OSS时的本地替身,由本应用的 /storage/<key> 接收(HMAC签名校验)
+"""
+
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from downloader import get_downloader
+
+
+# 允许的扩展名 -> Content-Type
+CONTENT_TYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'bmp': 'image/bmp',
+}
+
+# 只接受本服务签发的对象键
+KEY_PATTERN = re.compile(r'^uploads/\d{8}/[0-9a-f]{32}\.(jpg|jpeg|png|bmp)$')
+
+
+class DirectUploadError(ValueError):
+    """直传参数不合法或对象不存在/不符合要求"""
+
+
+class StoredUpload:
+    """
+    已直传到存储的文件,提供与上传文件相同的接口(filename / stream / save),
+    下游的人脸预检、规格生成无需区分来源
+    """
+
+    def __init__(self, key: str, local_path: str, object_url: Optional[str]):
+        self.key = key
+        self.filename = os.path.basename(key)
+        self.local_path = local_path
+        # 上游接口可直接使用的公网URL(本地替身为None)
+        self.object_url = object_url
+        self.saved_path = None
+        self.stream = open(local_path, 'rb')
+
+    def save(self, path: str):
+        """移动到目标路径(已下载到本地,无需再复制)"""
+        self.stream.close()
+        os.replace(self.local_path, path)
+        self.saved_path = path
+
+    def close(self):
+        """请求结束时调用: 未被save的临时文件删除"""
+        self.stream.close()
+        if self.saved_path is None and os.path.exists(self.local_path):
+            os.remove(self.local_path)
+
+
+class OssBackend:
+    """OSS签名URL"""
+
+    name = 'oss'
+
+    def __init__(self):
+        import oss2
+
+        access_key_id = os.getenv('ALIBABA_CLOUD_ACCESS_KEY_ID')
+        access_key_secret = os.getenv('ALIBABA_CLOUD_ACCESS_KEY_SECRET')
+        if not access_key_id or not access_key_secret:
+            raise ValueError("未设置阿里云AccessKey环境变量")
+        endpoint = os.getenv('OSS_ENDPOINT', 'oss-cn-shanghai.aliyuncs.com')
+        bucket_name = os.getenv('OSS_BUCKET', 'hair-transfer-bucket')
+        self.bucket = oss2.Bucket(oss2.Auth(access_key_id, access_key_secret), endpoint, bucket_name)
+        self.public_base = os.getenv('OSS_PUBLIC_BASE_URL', f'https://{bucket_name}.{endpoint}').rstrip('/')
+
+    def sign_put(self, key: str, content_type: str, expires: int) -> str:
+        # Content-Type参与签名,浏览器PUT时必须带相同的请求头
+        return self.bucket.sign_url('PUT', key, expires, headers={'Content-Type': content_type})
+
+    def fetch(self, key: str, save_path: str, max_bytes: int):
+        import oss2
+
+        try:
+            size = self.bucket.head_object(key).content_length
+        except oss2.exceptions.NotFound:
+            raise DirectUploadError('上传的文件不存在,请重新上传')
+        if size > max_bytes:
+            raise DirectUploadError(f'上传文件过大(上限{max_bytes // 1024 // 1024}MB)')
+        get_downloader().download_to_file(self.bucket.sign_url('GET', key, 300), save_path)
+
+    def public_url(self, key: str) -> Optional[str]:
+        return f'{self.public_base}/{key}'
+
+
+class LocalBackend:
+    """本地替身: 由 /storage/<key> 接收PUT,文件保存在本地目录"""
+
+    name = 'local'
+    URL_PREFIX = '/storage'
+
+    def __init__(self, root: Optional[str] = None, secret: Optional[str] = None):
+        self.root = root or os.getenv('DIRECT_UPLOAD_DIR', 'instance/storage')
+        secret = secret or os.getenv('DIRECT_UPLOAD_SECRET')
+        if not secret:
+            # 多个工作进程需共享同一密钥,否则A进程签发的地址在B进程校验失败
+            secret = secrets.token_hex(16)
+            print("⚠️  未设置DIRECT_UPLOAD_SECRET,使用进程内随机密钥(仅适合单进程)")
+        self.secret = secret.encode('utf-8')
+
+    def _signature(self, key: str, content_type: str, expires_at: int) -> str:
+        message = f'PUT\n{key}\n{content_type}\n{expires_at}'.encode('utf-8')
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    def sign_put(self, key: str, content_type: str, expires: int) -> str:
+        expires_at = int(time.time()) + expires
+        return f'{self.URL_PREFIX}/{key}?expires={expires_at}&signature={self._signature(key, content_type, expires_at)}'
+
+    def verify(self, key: str, content_type: str, expires_at: str, signature: str) -> bool:
+        """校验签名与有效期"""
+        if not KEY_PATTERN.match(key) or not expires_at.isdigit() or int(expires_at) < time.time():
+            return False
+        return hmac.compare_digest(self._signature(key, content_type, int(expires_at)), signature or '')
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split('/'))
+
+    def store(self, key: str, stream, max_bytes: int) -> int:
+        """
+        分块写入上传内容
+
+        Returns:
+            int: 文件字节数
+
+        Raises:
+            DirectUploadError: 超过大小上限
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        part_path = f'{path}.{threading.get_ident()}.part'
+        size = 0
+        try:
+            with open(part_path, 'wb') as f:
+                for chunk in iter(lambda: stream.read(64 * 1024), b''):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise DirectUploadError(f'上传文件过大(上限{max_bytes // 1024 // 1024}MB)')
+                    f.write(chunk)
+            os.replace(part_path, path)
+            self.prune()
+            return size
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+    def fetch(self, key: str, save_path: str, max_bytes: int):
+        path = self.path(key)
+        if not os.path.exists(path):
+            raise DirectUploadError('上传的文件不存在,请重新上传')
+        # 与OSS一致,对象保留(同一张照片可多次迁移),按日期目录定期清理
+        shutil.copyfile(path, save_path)
+
+    def prune(self, keep_days: int = 1):
+        """删除超过keep_days天的日期目录(相当于OSS的生命周期规则)"""
+        uploads_dir = os.path.join(self.root, 'uploads')
+        cutoff = (datetime.now() - timedelta(days=keep_days)).strftime('%Y%m%d')
+        for name in os.listdir(uploads_dir) if os.path.isdir(uploads_dir) else []:
+            if name.isdigit() and name < cutoff:
+                shutil.rmtree(os.path.join(uploads_dir, name), ignore_errors=True)
+
+    def public_url(self, key: str) -> Optional[str]:
+        return None
+
+
+class DirectUploads:
+    """签发直传地址、取回已上传的对象"""
+
+    DEFAULT_EXPIRES = 300
+    DEFAULT_MAX_MB = 20
+
+    def __init__(self, backend=None, expires: Optional[int] = None, max_bytes: Optional[int] = None):
+        """
+        初始化
+
+        Args:
+            backend: 存储后端,默认按环境变量DIRECT_UPLOAD_BACKEND(oss/local)选择,
+                     未设置时配置了AccessKey用oss,否则用local
+            expires: 签名有效期(秒),默认环境变量DIRECT_UPLOAD_EXPIRES或300
+            max_bytes: 单个文件上限,默认环境变量DIRECT_UPLOAD_MAX_MB或20MB
+        """
+        if backend is None:
+            name = os.getenv('DIRECT_UPLOAD_BACKEND') or (
+                'oss' if os.getenv('ALIBABA_CLOUD_ACCESS_KEY_ID') else 'local')
+            backend = OssBackend() if name == 'oss' else LocalBackend()
+        self.backend = backend
+        self.expires = expires or int(os.getenv('DIRECT_UPLOAD_EXPIRES', self.DEFAULT_EXPIRES))
+        self.max_bytes = max_bytes or int(os.getenv('DIRECT_UPLOAD_MAX_MB', self.DEFAULT_MAX_MB)) * 1024 * 1024
+
+    def create(self, filename: str = '', content_type: str = '', size: Optional[int] = None) -> dict:
+        """
+        签发一个直传地址
+
+        Args:
+            filename: 原始文件名(取扩展名)
+            content_type: 文件类型,与扩展名二选一
+            size: 文件大小(可选,超过上限时直接拒绝)
+
+        Returns:
+            dict: {'key', 'upload_url', 'method', 'headers', 'expires_in', 'max_bytes', 'backend'}
+
+        Raises:
+            DirectUploadError: 文件类型不支持或过大
+        """
+        ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+        if ext not in CONTENT_TYPES:
+            ext = next((e for e, t in CONTENT_TYPES.items() if t == content_type), '')
+        if not ext:
+            raise DirectUploadError('不支持的文件格式')
+        if size is not None and size > self.max_bytes:
+            raise DirectUploadError(f'上传文件过大(上限{self.max_bytes // 1024 // 1024}MB)')
+
+        content_type = CONTENT_TYPES[ext]
+        key = f"uploads/{datetime.now().strftime('%Y%m%d')}/{uuid.uuid4().hex}.{ext}"
+        return {
+            'key': key,
+            'upload_url': self.backend.sign_put(key, content_type, self.expires),
+            'method': 'PUT',
+            'headers': {'Content-Type': content_type},
+            'expires_in': self.expires,
+            'max_bytes': self.max_bytes,
+            'backend': self.backend.name,
+        }
+
+    def open(self, key: str, work_dir: str) -> StoredUpload:
+        """
+        取回已直传的对象到本地工作目录
+
+        Args:
+            key: create()签发的对象键
+            work_dir: 临时保存目录(与上传目录同一文件系统,save时直接移动)
+
+        Raises:
+            DirectUploadError: 对象键不合法、不存在或过大
+        """
+        if not KEY_PATTERN.match(key or ''):
+            raise DirectUploadError('无效的上传文件标识')
+        local_path = os.path.join(work_dir, f'direct_{uuid.uuid4().hex[:8]}_{os.path.basename(key)}')
+        self.backend.fetch(key, local_path, self.max_bytes)
+        return StoredUpload(key, local_path, self.backend.public_url(key))
+
+
+_direct_uploads = None
+_direct_uploads_lock = threading.Lock()
+
+
+def get_direct_uploads() -> DirectUploads:
+    """
+    获取全局直传组件(懒加载)
+
+    环境变量:
+        DIRECT_UPLOAD_BACKEND: oss / local,默认配置了AccessKey时为oss
+        DIRECT_UPLOAD_EXPIRES: 签名有效期(秒),默认300
+        DIRECT_UPLOAD_MAX_MB: 单个文件上限,默认20
+        DIRECT_UPLOAD_SECRET: local后端的签名密钥(多进程部署必须设置)
+        DIRECT_UPLOAD_DIR: local后端的存储目录,默认instance/storage
+    """
+    global _direct_uploads
+    with _direct_uploads_lock:
+        if _direct_uploads is None:
+            _direct_uploads = DirectUploads()
+        return _direct_uploads
+
+
+def main():
+    """测试函数: 签发直传地址并用requests模拟浏览器上传"""
+    import sys
+
+    if len(sys.argv) < 2:
+        print("用法: python direct_upload.py <图片路径> [应用地址,local后端需要]")
+        return
+    import requests
+
+    uploads = get_direct_uploads()
+    ticket = uploads.create(sys.argv[1], size=os.path.getsize(sys.argv[1]))
+    url = ticket['upload_url']
+    if url.startswith('/'):
+        url = (sys.argv[2] if len(sys.argv) > 2 else 'http://127.0.0.1:5002').rstrip('/') + url
+    with open(sys.argv[1], 'rb') as f:
+        response = requests.put(url, data=f, headers=ticket['headers'], timeout=60)
+    print(f"{'✅' if response.ok else '❌'} PUT {response.status_code}: {ticket['key']} ({ticket['backend']})")
+
+
+if __name__ == '__main__':
+    main()
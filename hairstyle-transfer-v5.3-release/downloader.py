@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+结果下载组件
+融合结果、头发图、素描结果等的下载共用一个连接池会话:
+瞬时错误(断线、超时、429/5xx)按指数退避重试,已收到的部分用HTTP Range续传,
+内容按块流式写入文件,不把整个响应缓存在内存里
+"""
+
+import io
+import os
+import random
+import re
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# 可重试的HTTP状态码
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """第attempt次重试(从1开始)前的等待秒数: 指数退避 + 随机抖动"""
+    return min(cap, base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+
+def expected_total(status: int, headers, offset: int) -> Optional[int]:
+    """
+    响应完成后应有的总字节数(无法确定时返回None)
+
+    Args:
+        status: HTTP状态码
+        headers: 响应头
+        offset: 本次请求的Range起点
+    """
+    if headers.get('Content-Encoding'):
+        # 传输压缩后Content-Length与解压后的长度不一致
+        return None
+    if status == 206:
+        match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', headers.get('Content-Range', ''))
+        if match and match.group(2) != '*':
+            return int(match.group(2))
+        length = headers.get('Content-Length')
+        return offset + int(length) if length else None
+    length = headers.get('Content-Length')
+    return int(length) if length else None
+
+
+def resumed_at(status: int, headers, offset: int) -> bool:
+    """Range续传请求的响应是否从offset开始(否则服务端不支持Range,需从头写入)"""
+    start = re.match(r'bytes (\d+)-', headers.get('Content-Range', ''))
+    return status == 206 and bool(start) and int(start.group(1)) == offset
+
+
+class DownloadError(Exception):
+    """下载失败(不可重试的错误,或重试次数用尽)"""
+
+
+class _Retryable(Exception):
+    """可重试的错误(状态码或内容不完整)"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Downloader:
+    """带重试、断点续传和连接复用的下载器(线程间共享)"""
+
+    CHUNK_SIZE = 64 * 1024
+    # (连接超时, 读取超时),读取超时是两次收到数据之间的间隔
+    DEFAULT_TIMEOUT = (5, 30)
+
+    def __init__(
+        self,
+        max_retries: Optional[int] = None,
+        backoff: float = 0.5,
+        max_backoff: float = 8.0,
+        timeout: tuple = DEFAULT_TIMEOUT,
+        pool_size: Optional[int] = None
+    ):
+        """
+        初始化
+
+        Args:
+            max_retries: 最大重试次数,默认环境变量DOWNLOAD_MAX_RETRIES或4
+            backoff: 首次重试等待秒数(之后每次翻倍)
+            max_backoff: 单次等待上限(秒)
+            timeout: (连接超时, 读取超时)
+            pool_size: 每个主机的连接池大小,默认环境变量DOWNLOAD_POOL_SIZE或32
+        """
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('DOWNLOAD_MAX_RETRIES', '4'))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        pool_size = pool_size or int(os.getenv('DOWNLOAD_POOL_SIZE', '32'))
+
+        # 重试在下面自己处理(需要Range续传),适配器只负责连接池
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _fetch(self, url: str, out) -> int:
+        """
+        下载到可写、可seek的对象(文件或BytesIO),中断后从已写入的位置续传
+
+        Returns:
+            int: 总字节数
+        """
+        attempt = 0
+        while True:
+            offset = out.tell()
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            try:
+                with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                    if response.status_code in RETRY_STATUS:
+                        retry_after = response.headers.get('Retry-After', '')
+                        raise _Retryable(
+                            f'HTTP {response.status_code}',
+                            float(retry_after) if retry_after.isdigit() else None
+                        )
+                    if response.status_code >= 400:
+                        raise DownloadError(f'HTTP {response.status_code}: {url[:80]}')
+
+                    if offset and not resumed_at(response.status_code, response.headers, offset):
+                        # 服务端不支持Range(或返回了其他范围),从头开始
+                        out.seek(0)
+                        out.truncate()
+                        offset = 0
+
+                    expected = expected_total(response.status_code, response.headers, offset)
+                    for chunk in response.iter_content(self.CHUNK_SIZE):
+                        out.write(chunk)
+                    if expected is not None and out.tell() < expected:
+                        raise _Retryable(f'内容不完整({out.tell()}/{expected}字节)')
+                    return out.tell()
+
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError, _Retryable) as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise DownloadError(f'下载失败(已重试{self.max_retries}次): {e}') from e
+                delay = getattr(e, 'retry_after', None) or backoff_delay(attempt, self.backoff, self.max_backoff)
+                print(f"⚠️  下载中断: {e}, {delay:.1f}秒后第{attempt}次重试"
+                      + (f"(从{out.tell()}字节续传)" if out.tell() else ''))
+                time.sleep(delay)
+
+    def download_bytes(self, url: str) -> bytes:
+        """
+        下载到内存(需要解码的图像)
+
+        Raises:
+            DownloadError: 不可重试的错误或重试次数用尽
+        """
+        buffer = io.BytesIO()
+        self._fetch(url, buffer)
+        return buffer.getvalue()
+
+    def download_to_file(self, url: str, save_path: str) -> int:
+        """
+        流式下载到文件: 先写入 <save_path>.part,完整后原子替换
+
+        Returns:
+            int: 文件字节数
+
+        Raises:
+            DownloadError: 不可重试的错误或重试次数用尽
+        """
+        part_path = f'{save_path}.{threading.get_ident()}.part'
+        try:
+            with open(part_path, 'wb') as f:
+                size = self._fetch(url, f)
+            os.replace(part_path, save_path)
+            return size
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+
+_downloader = None
+_downloader_lock = threading.Lock()
+
+
+def get_downloader() -> Downloader:
+    """
+    获取全局下载器(懒加载,所有下载共用连接池)
+
+    环境变量:
+        DOWNLOAD_MAX_RETRIES: 最大重试次数,默认4
+        DOWNLOAD_POOL_SIZE: 每个主机的连接数,默认32
+    """
+    global _downloader
+    with _downloader_lock:
+        if _downloader is None:
+            _downloader = Downloader()
+        return _downloader
+
+
+def main():
+    """测试函数"""
+    import sys
+
+    if len(sys.argv) < 3:
+        print("用法: python downloader.py <URL> <保存路径>")
+        return
+    start = time.time()
+    size = get_downloader().download_to_file(sys.argv[1], sys.argv[2])
+    print(f"✅ 已下载: {sys.argv[2]} ({size / 1024:.1f}KB, {time.time() - start:.2f}秒)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+"""
+人脸融合模板注册表
+记录我们在云端创建的每个融合模板及其使用情况,
+相同发型图复用已有模板,配额不足时按最近最少使用淘汰(删除云端模板),
+热门发型可常驻(pin)并预热
+
+创建前在同一个写事务里登记占位行并认领要淘汰的模板,多线程/多进程并发创建时
+不会超出配额,同一模板也不会被两次淘汰
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Tuple
+
+try:
+    from single_flight import get_single_flight
+    SINGLE_FLIGHT_AVAILABLE = True
+except ImportError as e:
+    SINGLE_FLIGHT_AVAILABLE = False
+    print(f"⚠️  请求合并不可用: {e}")
+
+
+class FaceTemplateRegistry:
+    """人脸融合模板注册表(SQLite持久化,多进程共享)"""
+
+    # 账号模板配额(可通过环境变量FACE_TEMPLATE_QUOTA调整)
+    DEFAULT_CAPACITY = 40
+    DEFAULT_DB_PATH = 'instance/face_templates.db'
+    # 删除模板时表示模板已不存在的FaceBody错误码
+    TEMPLATE_NOT_FOUND_CODES = ('InvalidParameter.TemplateId',)
+    # 占位(pending)或淘汰中(evicting)超过该时长视为所属进程已退出
+    STALE_SECONDS = 300
+    # 同一发型正由其他调用创建或淘汰、或配额被创建中的模板占满时,最多等待的秒数
+    RESERVE_TIMEOUT = 60
+
+    _lock = threading.Lock()
+
+    def __init__(
+        self,
+        service=None,
+        db_path: Optional[str] = None,
+        capacity: Optional[int] = None
+    ):
+        """
+        初始化注册表
+
+        Args:
+            service: 提供 add_face_template / delete_face_template 的服务对象
+                     (AliyunHairTransferFixed),只查询统计时可为None
+            db_path: SQLite数据库路径,默认环境变量FACE_TEMPLATE_DB或instance/face_templates.db
+            capacity: 模板配额,默认环境变量FACE_TEMPLATE_QUOTA或DEFAULT_CAPACITY
+        """
+        self.service = service
+        self.db_path = db_path or os.getenv('FACE_TEMPLATE_DB', self.DEFAULT_DB_PATH)
+        self.capacity = capacity or int(os.getenv('FACE_TEMPLATE_QUOTA', self.DEFAULT_CAPACITY))
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._init_db()
+
+    @contextmanager
+    def _db(self):
+        """打开数据库连接,退出时提交事务并关闭"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """写事务: BEGIN IMMEDIATE 先取得写锁,事务内的 查询-判断-写入 在进程间原子"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._db() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS face_templates (
+                    image_key   TEXT PRIMARY KEY,
+                    template_id TEXT NOT NULL,
+                    image_url   TEXT,
+                    created_at  REAL NOT NULL,
+                    last_used   REAL NOT NULL,
+                    use_count   INTEGER NOT NULL DEFAULT 0,
+                    pinned      INTEGER NOT NULL DEFAULT 0,
+                    state       TEXT NOT NULL DEFAULT 'ready'
+                )
+            ''')
+            # state: ready 可用 / pending 创建中(占位,template_id为空) / evicting 淘汰中
+            columns = {r['name'] for r in conn.execute('PRAGMA table_info(face_templates)')}
+            if 'state' not in columns:
+                conn.execute("ALTER TABLE face_templates ADD COLUMN state TEXT NOT NULL DEFAULT 'ready'")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS face_template_counters (
+                    name  TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+
+    def _bump(self, conn: sqlite3.Connection, name: str, delta: int = 1):
+        conn.execute(
+            'INSERT INTO face_template_counters (name, value) VALUES (?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+            (name, delta)
+        )
+
+    def lookup(self, image_key: str) -> Optional[str]:
+        """查询已登记的模板ID(不计入使用次数)"""
+        with self._db() as conn:
+            row = conn.execute(
+                "SELECT template_id FROM face_templates WHERE image_key = ? AND state = 'ready'", (image_key,)
+            ).fetchone()
+        return row['template_id'] if row else None
+
+    def acquire(self, image_key: str, image_url: str) -> str:
+        """
+        获取发型图对应的模板ID,不存在则创建
+
+        Args:
+            image_key: 发型图内容哈希
+            image_url: 发型图公网URL(创建模板时使用)
+
+        Returns:
+            template_id: 模板ID
+        """
+        now = time.time()
+        with self._lock, self._db() as conn:
+            row = conn.execute(
+                "SELECT template_id FROM face_templates WHERE image_key = ? AND state = 'ready'", (image_key,)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    'UPDATE face_templates SET last_used = ?, use_count = use_count + 1 WHERE image_key = ?',
+                    (now, image_key)
+                )
+                self._bump(conn, 'hits')
+                print(f"♻️  复用已有模板: {row['template_id']}")
+                return row['template_id']
+            self._bump(conn, 'misses')
+
+        # 同一发型的并发创建(跨线程/进程)合并为一次上游调用
+        if SINGLE_FLIGHT_AVAILABLE:
+            return get_single_flight().do('face_template', image_key, lambda: self._create(image_key, image_url))
+        return self._create(image_key, image_url)
+
+    def _create(self, image_key: str, image_url: str) -> str:
+        """创建模板并登记: 先原子地占位并认领要淘汰的模板,淘汰完成后再调用上游创建"""
+        deadline = time.time() + self.RESERVE_TIMEOUT
+        while True:
+            template_id, claimed = self._reserve(image_key, image_url)
+            if template_id:
+                return template_id
+            if claimed is not None:
+                break
+            if time.time() > deadline:
+                raise Exception(f"等待模板创建超时: {image_key}")
+            time.sleep(0.2)
+
+        try:
+            failed = [row['template_id'] for row in claimed if not self._finish_eviction(row)]
+            if failed:
+                raise Exception(f"模板配额已满({self.capacity}),淘汰模板失败: {', '.join(failed)}")
+            template_id = self.service.add_face_template(image_url)
+        except BaseException:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM face_templates WHERE image_key = ? AND state = 'pending'", (image_key,))
+            raise
+
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE face_templates SET template_id = ?, state = 'ready', last_used = ? "
+                "WHERE image_key = ? AND state = 'pending'",
+                (template_id, now, image_key)
+            )
+            if cursor.rowcount == 0:
+                # 占位已按超时清理: 重新登记,期间其他进程已登记的话保留先登记的
+                cursor = conn.execute(
+                    'INSERT OR IGNORE INTO face_templates '
+                    '(image_key, template_id, image_url, created_at, last_used, use_count) '
+                    'VALUES (?, ?, ?, ?, ?, 1)',
+                    (image_key, template_id, image_url, now, now)
+                )
+            if cursor.rowcount:
+                self._bump(conn, 'created')
+                return template_id
+
+        self._delete_upstream(template_id)
+        return self.acquire(image_key, image_url)
+
+    def _reserve(self, image_key: str, image_url: str):
+        """
+        在一个写事务中: 检查登记、计算配额、认领需淘汰的模板、插入占位行
+
+        Returns:
+            (template_id, None): 已有可用模板
+            (None, claimed):     已占位,claimed为需先淘汰的行
+            (None, None):        该发型正由其他调用创建或淘汰,或配额被创建中的模板占满,稍后重试
+
+        Raises:
+            Exception: 配额已满且剩余模板均为常驻模板
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._expire_stale(conn, now)
+            row = conn.execute(
+                'SELECT template_id, state FROM face_templates WHERE image_key = ?', (image_key,)
+            ).fetchone()
+            if row:
+                return (row['template_id'], None) if row['state'] == 'ready' else (None, None)
+
+            # 淘汰中的模板已有归属(其空出的配额属于认领者),不计入占用
+            occupied = conn.execute(
+                "SELECT COUNT(*) FROM face_templates WHERE state != 'evicting'"
+            ).fetchone()[0]
+            overflow = occupied + 1 - self.capacity
+            if overflow > 0:
+                available = conn.execute(
+                    "SELECT COUNT(*) FROM face_templates WHERE pinned = 0 AND state = 'ready'"
+                ).fetchone()[0]
+                if available < overflow:
+                    pending = conn.execute(
+                        "SELECT COUNT(*) FROM face_templates WHERE state = 'pending'"
+                    ).fetchone()[0]
+                    if pending:
+                        # 配额被其他正在创建的模板占着,创建完成后即可淘汰
+                        return None, None
+                    raise Exception(f"模板配额已满({self.capacity}),且剩余模板均为常驻模板")
+            claimed = self._claim(conn, overflow, now) if overflow > 0 else []
+            conn.execute(
+                'INSERT INTO face_templates '
+                '(image_key, template_id, image_url, created_at, last_used, use_count, state) '
+                "VALUES (?, '', ?, ?, ?, 1, 'pending')",
+                (image_key, image_url, now, now)
+            )
+        return None, claimed
+
+    def _expire_stale(self, conn: sqlite3.Connection, now: float):
+        """清理所属进程已退出的占位,恢复中断的淘汰(再次删除时模板不存在也视为成功)"""
+        cutoff = now - self.STALE_SECONDS
+        conn.execute("DELETE FROM face_templates WHERE state = 'pending' AND created_at < ?", (cutoff,))
+        conn.execute(
+            "UPDATE face_templates SET state = 'ready' WHERE state = 'evicting' AND last_used < ?", (cutoff,)
+        )
+
+    @staticmethod
+    def _claim(conn: sqlite3.Connection, count: int, now: float) -> List[sqlite3.Row]:
+        """在事务内认领最近最少使用的非常驻模板(标记为淘汰中,其他调用不会再选中)"""
+        rows = conn.execute(
+            "SELECT image_key, template_id FROM face_templates WHERE pinned = 0 AND state = 'ready' "
+            'ORDER BY last_used ASC LIMIT ?', (count,)
+        ).fetchall()
+        conn.executemany(
+            "UPDATE face_templates SET state = 'evicting', last_used = ? WHERE image_key = ?",
+            [(now, r['image_key']) for r in rows]
+        )
+        return rows
+
+    def _finish_eviction(self, row) -> bool:
+        """删除已认领的云端模板并移除登记;失败时恢复为可用"""
+        deleted = self._delete_upstream(row['template_id'])
+        with self._transaction() as conn:
+            if deleted:
+                conn.execute(
+                    "DELETE FROM face_templates WHERE image_key = ? AND state = 'evicting'", (row['image_key'],)
+                )
+                self._bump(conn, 'evictions')
+            else:
+                conn.execute(
+                    "UPDATE face_templates SET state = 'ready' WHERE image_key = ? AND state = 'evicting'",
+                    (row['image_key'],)
+                )
+        if deleted:
+            print(f"🗑️  已淘汰模板: {row['template_id']}")
+        return deleted
+
+    def invalidate(self, image_key: str):
+        """云端模板已失效时移除登记(不调用删除接口)"""
+        with self._lock, self._db() as conn:
+            conn.execute("DELETE FROM face_templates WHERE image_key = ? AND state = 'ready'", (image_key,))
+
+    def pin(self, image_key: str, pinned: bool = True):
+        """设置/取消常驻,常驻模板不会被淘汰"""
+        with self._lock, self._db() as conn:
+            conn.execute('UPDATE face_templates SET pinned = ? WHERE image_key = ?', (int(pinned), image_key))
+
+    def release(self, image_key: str) -> bool:
+        """
+        取消常驻并删除模板(发型下架或更换图片时立即归还配额)
+
+        未提供service时只取消常驻,云端模板之后按LRU淘汰
+
+        Returns:
+            bool: 是否已删除
+        """
+        self.pin(image_key, False)
+        if self.service is None:
+            return False
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT image_key, template_id FROM face_templates WHERE image_key = ? AND state = 'ready'",
+                (image_key,)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE face_templates SET state = 'evicting', last_used = ? WHERE image_key = ?",
+                    (now, image_key)
+                )
+        return bool(row) and self._finish_eviction(row)
+
+    def prewarm(self, entries: Iterable[Tuple[str, str]], pin: bool = True) -> dict:
+        """
+        预热模板: 为热门发型提前创建模板并常驻
+
+        Args:
+            entries: (image_key, image_url) 列表
+            pin: 是否设为常驻
+
+        Returns:
+            dict: image_key -> template_id
+        """
+        result = {}
+        for image_key, image_url in entries:
+            result[image_key] = self.acquire(image_key, image_url)
+            if pin:
+                self.pin(image_key)
+        return result
+
+    def pin_hottest(self, count: int, keys: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        按使用次数常驻最热门的模板,其余取消常驻
+
+        Args:
+            count: 常驻数量
+            keys: 候选范围(如发型目录中的发型),默认全部
+
+        Returns:
+            被常驻的image_key列表
+        """
+        with self._lock, self._db() as conn:
+            rows = conn.execute(
+                "SELECT image_key FROM face_templates WHERE state = 'ready' "
+                'ORDER BY use_count DESC, last_used DESC'
+            ).fetchall()
+            candidates = [r['image_key'] for r in rows]
+            if keys is not None:
+                allowed = set(keys)
+                candidates = [k for k in candidates if k in allowed]
+            hottest = candidates[:count]
+            conn.execute('UPDATE face_templates SET pinned = 0')
+            conn.executemany('UPDATE face_templates SET pinned = 1 WHERE image_key = ?', [(k,) for k in hottest])
+        return hottest
+
+    def evict(self, count: int) -> List[str]:
+        """
+        淘汰最近最少使用的非常驻模板,并删除云端模板
+
+        Args:
+            count: 淘汰数量
+
+        Returns:
+            被淘汰的template_id列表
+        """
+        with self._transaction() as conn:
+            rows = self._claim(conn, count, time.time())
+        return [row['template_id'] for row in rows if self._finish_eviction(row)]
+
+    def _delete_upstream(self, template_id: str) -> bool:
+        """删除云端模板,模板已不存在(FaceBody返回对应错误码)也视为成功"""
+        try:
+            self.service.delete_face_template(template_id)
+            return True
+        except Exception as e:
+            if getattr(e, 'code', None) in self.TEMPLATE_NOT_FOUND_CODES:
+                return True
+            print(f"⚠️  删除模板失败: {template_id}, {e}")
+            return False
+
+    def stats(self) -> dict:
+        """模板占用统计"""
+        with self._db() as conn:
+            occupied, pinned, total_uses = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(pinned), 0), COALESCE(SUM(use_count), 0) FROM face_templates'
+            ).fetchone()
+            counters = {r['name']: r['value'] for r in conn.execute('SELECT name, value FROM face_template_counters')}
+            oldest = conn.execute('SELECT MIN(last_used) FROM face_templates WHERE pinned = 0').fetchone()[0]
+
+        hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+        return {
+            'capacity': self.capacity,
+            'occupied': occupied,
+            'pinned': pinned,
+            'occupancy': round(occupied / self.capacity, 3) if self.capacity else None,
+            'total_uses': total_uses,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+            'created': counters.get('created', 0),
+            'evictions': counters.get('evictions', 0),
+            'coldest_idle_seconds': round(time.time() - oldest, 1) if oldest else None,
+        }
+
+
+def main():
+    """命令行: 查看统计 / 手动淘汰 / 按热度常驻"""
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='人脸融合模板注册表')
+    sub = parser.add_subparsers(dest='command')
+    sub.add_parser('stats', help='查看模板占用统计')
+    evict_parser = sub.add_parser('evict', help='淘汰最冷的N个模板')
+    evict_parser.add_argument('count', type=int)
+    pin_parser = sub.add_parser('pin-hottest', help='常驻最热门的N个模板')
+    pin_parser.add_argument('count', type=int)
+    args = parser.parse_args()
+
+    if args.command == 'evict':
+        from aliyun_hair_transfer_fixed import AliyunHairTransferFixed
+        registry = FaceTemplateRegistry(AliyunHairTransferFixed())
+        print(f"已淘汰: {registry.evict(args.count)}")
+    elif args.command == 'pin-hottest':
+        print(f"已常驻: {FaceTemplateRegistry().pin_hottest(args.count)}")
+    else:
+        print(json.dumps(FaceTemplateRegistry().stats(), indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
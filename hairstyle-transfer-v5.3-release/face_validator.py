@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+本地人脸预检
+在上传OSS和调用人脸融合之前,用MediaPipe在已解码的图像上快速检测人脸:
+统计人脸数量、人脸框大小和姿态(偏航/翻滚角),不合格的照片在毫秒级内拒绝或提示,
+检测到的人脸框随结果返回并保存为旁路文件,供后续步骤复用
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+try:
+    import mediapipe as mp
+    MEDIAPIPE_AVAILABLE = True
+except ImportError as e:
+    MEDIAPIPE_AVAILABLE = False
+    mp = None
+    print(f"⚠️  MediaPipe不可用,跳过人脸预检: {e}")
+
+
+class FaceValidationError(ValueError):
+    """人脸预检未通过"""
+
+    def __init__(self, message: str, report: dict):
+        super().__init__(message)
+        self.report = report
+
+
+class FaceValidator:
+    """基于MediaPipe人脸检测的本地预检"""
+
+    # 检测前将长边缩放到此尺寸,检测耗时与原图大小无关
+    DETECT_LONG_EDGE = 640
+
+    # 人脸框短边像素(预处理后图像): 低于REJECT拒绝,低于WARN提示
+    MIN_FACE_PX_REJECT = 64
+    MIN_FACE_PX_WARN = 128
+    # 偏航角(左右转头)阈值,单位度
+    MAX_YAW_REJECT = 45
+    MAX_YAW_WARN = 25
+    # 翻滚角(歪头)提示阈值
+    MAX_ROLL_WARN = 30
+    # 多张人脸时,第二大人脸面积 / 最大人脸面积 超过此比例视为无法确定主体
+    SECONDARY_FACE_RATIO = 0.3
+
+    SIDECAR_SUFFIX = '.faces.json'
+
+    def __init__(self, min_confidence: float = 0.5, min_face_px: Optional[int] = None):
+        """
+        初始化
+
+        Args:
+            min_confidence: 检测置信度阈值
+            min_face_px: 人脸框短边最小像素,默认环境变量FACE_MIN_PX或MIN_FACE_PX_REJECT
+        """
+        self.min_confidence = min_confidence
+        self.min_face_px = min_face_px or int(os.getenv('FACE_MIN_PX', self.MIN_FACE_PX_REJECT))
+        # MediaPipe图不是线程安全的,每个线程各自持有一个检测器
+        self._local = threading.local()
+
+    @property
+    def available(self) -> bool:
+        return MEDIAPIPE_AVAILABLE
+
+    def _detector(self):
+        detector = getattr(self._local, 'detector', None)
+        if detector is None:
+            # model_selection=1: 全距离模型,适合半身照/沙龙照片
+            detector = mp.solutions.face_detection.FaceDetection(
+                model_selection=1,
+                min_detection_confidence=self.min_confidence
+            )
+            self._local.detector = detector
+        return detector
+
+    @staticmethod
+    def estimate_pose(keypoints: List[tuple], box_width: float) -> dict:
+        """
+        由6个关键点粗略估计姿态
+
+        Args:
+            keypoints: MediaPipe关键点像素坐标 [右眼, 左眼, 鼻尖, 嘴, 右耳, 左耳]
+            box_width: 人脸框宽度(像素)
+
+        Returns:
+            dict: {'yaw': 偏航角, 'roll': 翻滚角},单位度
+        """
+        (rx, ry), (lx, ly), (nx, ny) = keypoints[0], keypoints[1], keypoints[2]
+        roll = math.degrees(math.atan2(ly - ry, lx - rx))
+        eye_distance = max(math.hypot(lx - rx, ly - ry), box_width * 0.1, 1.0)
+        # 正脸时鼻尖位于两眼中点,侧转时沿眼线方向偏移,偏移半个眼距约为侧脸
+        # (沿眼线投影,歪头不会被误判为侧脸)
+        offset = ((nx - (rx + lx) / 2) * (lx - rx) + (ny - (ry + ly) / 2) * (ly - ry)) / eye_distance ** 2
+        yaw = math.degrees(math.asin(max(-1.0, min(1.0, offset * 2))))
+        return {'yaw': round(yaw, 1), 'roll': round(roll, 1)}
+
+    def detect(self, image: np.ndarray) -> List[dict]:
+        """
+        检测人脸
+
+        Args:
+            image: BGR图像
+
+        Returns:
+            人脸列表(按面积从大到小),每项含 box [x, y, w, h]、eyes [[右眼x, y], [左眼x, y]](原图像素)、
+            score、yaw、roll
+        """
+        height, width = image.shape[:2]
+        scale = min(1.0, self.DETECT_LONG_EDGE / max(height, width))
+        small = image
+        if scale < 1.0:
+            small = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+        rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+
+        result = self._detector().process(rgb)
+        faces = []
+        for detection in result.detections or []:
+            rel = detection.location_data.relative_bounding_box
+            x0 = max(0.0, rel.xmin) * width
+            y0 = max(0.0, rel.ymin) * height
+            x1 = min(1.0, rel.xmin + rel.width) * width
+            y1 = min(1.0, rel.ymin + rel.height) * height
+            keypoints = [(kp.x * width, kp.y * height) for kp in detection.location_data.relative_keypoints]
+            face = {
+                'box': [round(x0), round(y0), round(x1 - x0), round(y1 - y0)],
+                # 右眼、左眼中心,用于对齐发型叠加预览
+                'eyes': [[round(x, 1), round(y, 1)] for x, y in keypoints[:2]],
+                'score': round(float(detection.score[0]), 3),
+            }
+            face.update(self.estimate_pose(keypoints, x1 - x0))
+            faces.append(face)
+        faces.sort(key=lambda f: f['box'][2] * f['box'][3], reverse=True)
+        return faces
+
+    def validate(self, image: np.ndarray, scale: float = 1.0) -> dict:
+        """
+        检测并判定照片是否适合人脸融合
+
+        Args:
+            image: BGR图像
+            scale: 人脸框尺寸换算到预处理后图像的比例(预处理会缩放时传入)
+
+        Returns:
+            dict: {'level': pass/warn/reject, 'face_count', 'faces', 'messages', 'elapsed_ms'}
+        """
+        start = time.time()
+        faces = self.detect(image)
+        messages, level = [], 'pass'
+
+        def flag(new_level: str, message: str):
+            nonlocal level
+            messages.append(message)
+            if new_level == 'reject' or level == 'pass':
+                level = new_level
+
+        if not faces:
+            flag('reject', '未检测到人脸,请上传清晰的正脸照片')
+        else:
+            main = faces[0]
+            if len(faces) > 1:
+                main_area = main['box'][2] * main['box'][3]
+                second_area = faces[1]['box'][2] * faces[1]['box'][3]
+                if second_area >= main_area * self.SECONDARY_FACE_RATIO:
+                    flag('reject', f'检测到{len(faces)}张人脸,请上传只有一个人的照片')
+                else:
+                    flag('warn', f'检测到{len(faces)}张人脸,将使用最大的人脸')
+
+            face_px = min(main['box'][2], main['box'][3]) * scale
+            if face_px < self.min_face_px:
+                flag('reject', f'人脸过小({face_px:.0f}px),请靠近拍摄或裁剪照片')
+            elif face_px < self.MIN_FACE_PX_WARN:
+                flag('warn', f'人脸较小({face_px:.0f}px),融合效果可能不理想')
+
+            if abs(main['yaw']) > self.MAX_YAW_REJECT:
+                flag('reject', f"侧脸角度过大({main['yaw']:.0f}°),请上传正脸照片")
+            elif abs(main['yaw']) > self.MAX_YAW_WARN:
+                flag('warn', f"脸部偏转较大({main['yaw']:.0f}°),建议使用正脸照片")
+            if abs(main['roll']) > self.MAX_ROLL_WARN:
+                flag('warn', f"头部倾斜较大({main['roll']:.0f}°)")
+
+        # 人脸框换算到预处理后图像的坐标,后续步骤可直接使用
+        if scale != 1.0:
+            for face in faces:
+                face['box'] = [round(v * scale) for v in face['box']]
+                face['eyes'] = [[round(x * scale, 1), round(y * scale, 1)] for x, y in face['eyes']]
+
+        return {
+            'level': level,
+            'face_count': len(faces),
+            'faces': faces,
+            'messages': messages,
+            'elapsed_ms': round((time.time() - start) * 1000, 1),
+        }
+
+    # ===== 旁路文件 =====
+
+    def save_report(self, image_path: str, report: dict):
+        """将预检结果保存在图片旁边(<图片路径>.faces.json)"""
+        with open(image_path + self.SIDECAR_SUFFIX, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False)
+
+    def load_report(self, image_path: str) -> Optional[dict]:
+        """读取已保存的预检结果,没有时返回None"""
+        try:
+            with open(image_path + self.SIDECAR_SUFFIX, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+_validator = None
+_validator_lock = threading.Lock()
+
+
+def get_face_validator() -> Optional[FaceValidator]:
+    """
+    获取全局人脸预检器(懒加载)
+
+    环境变量:
+        FACE_CHECK: 设为0则关闭人脸预检
+        FACE_MIN_PX: 人脸框短边最小像素
+
+    Returns:
+        预检器实例,关闭或MediaPipe不可用时返回None
+    """
+    global _validator
+    if os.getenv('FACE_CHECK', '1') == '0' or not MEDIAPIPE_AVAILABLE:
+        return None
+    with _validator_lock:
+        if _validator is None:
+            _validator = FaceValidator()
+        return _validator
+
+
+def main():
+    """测试函数"""
+    import sys
+
+    if len(sys.argv) < 2:
+        print("用法: python face_validator.py <图像路径> [...]")
+        return
+
+    validator = FaceValidator()
+    for path in sys.argv[1:]:
+        image = cv2.imread(path)
+        if image is None:
+            print(f"❌ 无法读取图像: {path}")
+            continue
+        report = validator.validate(image)
+        icon = {'pass': '✅', 'warn': '⚠️ ', 'reject': '❌'}[report['level']]
+        print(f"{icon} {path}: {report['face_count']}张人脸, {report['elapsed_ms']}ms")
+        for face in report['faces']:
+            print(f"   框: {face['box']}  置信度: {face['score']}  偏航: {face['yaw']}°  翻滚: {face['roll']}°")
+        for message in report['messages']:
+            print(f"   {message}")
+
+
+if __name__ == '__main__':
+    main()
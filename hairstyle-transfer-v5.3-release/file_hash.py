@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+"""
+文件内容哈希
+发型图缓存键、目录去重、素描确定性种子等共用: 分块流式计算,不把整个文件读入内存
+"""
+
+import hashlib
+
+
+def compute_file_hash(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """分块计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
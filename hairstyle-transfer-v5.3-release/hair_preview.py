@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+发型叠加预览
+发型提取后,在本地把透明头发图按人脸关键点(两眼位置)缩放、旋转、平移到客户照片上,
+只在头发覆盖的区域做向量化Alpha混合,几十毫秒内给出效果示意;
+造型师先用预览比较发型,满意后再调用需要付费、耗时十秒以上的人脸融合
+"""
+
+import io
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+class HairPreviewError(ValueError):
+    """无法生成预览(头发图或布局缺失、未检测到人脸)"""
+
+
+class HairPreview:
+    """发型叠加预览(线程间共享)"""
+
+    # 预览图长边上限,解码、检测、混合的耗时与原图大小无关
+    PREVIEW_LONG_EDGE = 1024
+    JPEG_QUALITY = 85
+    LAYOUT_SUFFIX = '.layout.json'
+    # 旧版预检结果没有眼睛坐标时,由人脸框估算: 眼距约为框宽的0.4,眼睛位于框高的0.35处
+    EYE_DISTANCE_RATIO = 0.4
+    EYE_HEIGHT_RATIO = 0.35
+    # 缓存最近使用的头发图(同一发型反复调整时不重复解码PNG)
+    CACHE_SIZE = 16
+
+    def __init__(self, validator=None):
+        """
+        初始化
+
+        Args:
+            validator: 人脸检测器(FaceValidator),默认使用全局实例
+        """
+        self._validator = validator
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _face_validator(self):
+        if self._validator is None:
+            from face_validator import get_face_validator
+            self._validator = get_face_validator()
+            if self._validator is None:
+                raise HairPreviewError('人脸检测不可用,无法生成预览')
+        return self._validator
+
+    # ===== 布局旁路文件 =====
+
+    def save_layout(self, hair_path: str, box: list, face: dict, scale: float = 1.0):
+        """
+        保存头发图的布局(<头发图路径>.layout.json)
+
+        Args:
+            hair_path: 提取的头发图路径
+            box: 头发图在分割输入图中的位置 [x, y, w, h]
+            face: 发型参考图的主人脸(预检结果中的一项,参考图坐标)
+            scale: 参考图坐标换算到分割输入图坐标的比例
+        """
+        layout = {
+            'box': [int(v) for v in box],
+            'face': {
+                'box': [round(v * scale, 1) for v in face['box']],
+                'eyes': [[round(x * scale, 1), round(y * scale, 1)] for x, y in face.get('eyes') or []] or None,
+            },
+        }
+        with open(hair_path + self.LAYOUT_SUFFIX, 'w', encoding='utf-8') as f:
+            json.dump(layout, f)
+
+    def load_layout(self, hair_path: str) -> Optional[dict]:
+        """读取头发图的布局,没有时返回None"""
+        try:
+            with open(hair_path + self.LAYOUT_SUFFIX, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # ===== 几何 =====
+
+    @classmethod
+    def anchor(cls, face: dict) -> Tuple[np.ndarray, float, float]:
+        """
+        人脸的对齐锚点
+
+        Returns:
+            (两眼中点, 眼距, 眼线角度(弧度))
+        """
+        eyes = face.get('eyes')
+        if eyes:
+            (rx, ry), (lx, ly) = eyes
+            distance = max(math.hypot(lx - rx, ly - ry), 1.0)
+            return np.array([(rx + lx) / 2, (ry + ly) / 2]), distance, math.atan2(ly - ry, lx - rx)
+        x, y, w, h = face['box']
+        return (np.array([x + w / 2, y + h * cls.EYE_HEIGHT_RATIO]),
+                max(w * cls.EYE_DISTANCE_RATIO, 1.0), math.radians(face.get('roll', 0.0)))
+
+    @classmethod
+    def similarity(cls, source: dict, target: dict, scale: float = 1.0,
+                   offset: Tuple[float, float] = (0.0, 0.0)) -> np.ndarray:
+        """
+        由两张人脸的锚点计算相似变换(缩放+旋转+平移),把源图坐标映射到目标图坐标
+
+        Args:
+            source: 源人脸(发型参考图)
+            target: 目标人脸(客户照片)
+            scale: 额外缩放(造型师微调)
+            offset: 额外平移(x, y),单位为目标人脸的眼距
+
+        Returns:
+            2x3仿射矩阵
+        """
+        source_center, source_distance, source_angle = cls.anchor(source)
+        target_center, target_distance, target_angle = cls.anchor(target)
+        k = target_distance / source_distance * scale
+        theta = target_angle - source_angle
+        rotation = k * np.array([[math.cos(theta), -math.sin(theta)],
+                                 [math.sin(theta), math.cos(theta)]])
+        center = target_center + np.array(offset, dtype=np.float64) * target_distance
+        return np.hstack([rotation, (center - rotation @ source_center).reshape(2, 1)])
+
+    @staticmethod
+    def composite(base: np.ndarray, overlay: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        """
+        把BGRA图按仿射矩阵叠加到BGR图上(原地修改)
+
+        只变换、混合叠加图落在底图内的外接矩形区域,混合为整数向量运算:
+        out = (fg * a + bg * (255 - a)) / 255
+
+        Args:
+            base: BGR底图
+            overlay: BGRA叠加图
+            matrix: 叠加图坐标 -> 底图坐标的2x3仿射矩阵
+
+        Returns:
+            base
+        """
+        height, width = overlay.shape[:2]
+        corners = np.array([[0, 0, 1], [width, 0, 1], [0, height, 1], [width, height, 1]], dtype=np.float64)
+        projected = corners @ matrix.T
+        x0 = max(0, math.floor(projected[:, 0].min()))
+        y0 = max(0, math.floor(projected[:, 1].min()))
+        x1 = min(base.shape[1], math.ceil(projected[:, 0].max()))
+        y1 = min(base.shape[0], math.ceil(projected[:, 1].max()))
+        if x1 <= x0 or y1 <= y0:
+            return base
+
+        shifted = matrix.copy()
+        shifted[:, 2] -= (x0, y0)
+        warped = cv2.warpAffine(overlay, shifted, (x1 - x0, y1 - y0), flags=cv2.INTER_LINEAR,
+                                borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        alpha = warped[..., 3:4].astype(np.uint16)
+        roi = base[y0:y1, x0:x1]
+        roi[:] = ((warped[..., :3] * alpha + roi * (255 - alpha) + 127) // 255).astype(np.uint8)
+        return base
+
+    # ===== 图像 =====
+
+    def _load_hair(self, hair_path: str) -> np.ndarray:
+        """读取头发图(BGRA),按路径和修改时间缓存"""
+        key = (hair_path, os.path.getmtime(hair_path))
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        hair = cv2.imread(hair_path, cv2.IMREAD_UNCHANGED)
+        if hair is None:
+            raise HairPreviewError('无法读取提取的发型图')
+        if hair.ndim == 2:
+            hair = cv2.cvtColor(hair, cv2.COLOR_GRAY2BGR)
+        if hair.shape[2] == 3:
+            # 没有透明通道: 黑色背景视为透明
+            alpha = np.where(hair.max(axis=2) > 0, 255, 0).astype(np.uint8)
+            hair = np.dstack([hair, alpha])
+
+        with self._cache_lock:
+            self._cache[key] = hair
+            while len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return hair
+
+    def decode(self, data: bytes) -> np.ndarray:
+        """解码客户照片并缩小到预览尺寸(JPEG在解码阶段直接按1/2、1/4、1/8缩小)"""
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                long_edge = max(img.size)
+        except Exception:
+            raise HairPreviewError('无法读取客户照片,文件可能已损坏')
+
+        flag = cv2.IMREAD_COLOR
+        for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if long_edge / factor >= self.PREVIEW_LONG_EDGE:
+                flag = reduced
+                break
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+        if image is None:
+            raise HairPreviewError('无法读取客户照片,文件可能已损坏')
+
+        height, width = image.shape[:2]
+        if max(height, width) > self.PREVIEW_LONG_EDGE:
+            scale = self.PREVIEW_LONG_EDGE / max(height, width)
+            image = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+        return image
+
+    def render(self, customer_data: bytes, hair_path: str, scale: float = 1.0,
+               offset: Tuple[float, float] = (0.0, 0.0)) -> Tuple[bytes, dict]:
+        """
+        生成发型叠加预览
+
+        Args:
+            customer_data: 客户照片文件内容
+            hair_path: 提取的头发图路径(需有布局旁路文件)
+            scale: 额外缩放
+            offset: 额外平移(x, y),单位为眼距
+
+        Returns:
+            (JPEG字节, {'width', 'height', 'face', 'elapsed_ms'})
+
+        Raises:
+            HairPreviewError: 布局缺失、照片无法读取或未检测到人脸
+        """
+        start = time.time()
+        layout = self.load_layout(hair_path)
+        if layout is None:
+            raise HairPreviewError('该发型缺少位置信息,请重新提取发型')
+
+        image = self.decode(customer_data)
+        faces = self._face_validator().detect(image)
+        if not faces:
+            raise HairPreviewError('客户照片中未检测到人脸')
+
+        # 头发图像素 -> 分割输入图坐标(平移到头发框位置) -> 客户照片坐标
+        matrix = self.similarity(layout['face'], faces[0], scale, offset)
+        box_x, box_y = layout['box'][:2]
+        matrix[:, 2] += matrix[:, :2] @ np.array([box_x, box_y], dtype=np.float64)
+        self.composite(image, self._load_hair(hair_path), matrix)
+
+        _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.JPEG_QUALITY])
+        return buffer.tobytes(), {
+            'width': image.shape[1],
+            'height': image.shape[0],
+            'face': faces[0],
+            'elapsed_ms': round((time.time() - start) * 1000, 1),
+        }
+
+
+_hair_preview = None
+_hair_preview_lock = threading.Lock()
+
+
+def get_hair_preview() -> HairPreview:
+    """获取全局发型叠加预览(懒加载,头发图缓存在进程内共享)"""
+    global _hair_preview
+    with _hair_preview_lock:
+        if _hair_preview is None:
+            _hair_preview = HairPreview()
+        return _hair_preview
+
+
+def main():
+    """测试函数"""
+    import sys
+
+    if len(sys.argv) < 4:
+        print("用法: python hair_preview.py <客户照片> <头发图(含.layout.json)> <输出路径>")
+        return
+    with open(sys.argv[1], 'rb') as f:
+        data = f.read()
+    preview = get_hair_preview()
+    for _ in range(3):
+        jpeg, info = preview.render(data, sys.argv[2])
+        print(f"✅ 预览: {info['width']}x{info['height']}, {info['elapsed_ms']}ms")
+    with open(sys.argv[3], 'wb') as f:
+        f.write(jpeg)
+    print(f"   已保存: {sys.argv[3]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -6,12 +6,21 @@
 """
 
 import os
-import requests
 from alibabacloud_imageseg20191230.client import Client as ImagesegClient
 from alibabacloud_tea_openapi import models as open_api_models
 from alibabacloud_imageseg20191230 import models as imageseg_models
 from alibabacloud_tea_util import models as util_models
 
+from downloader import get_downloader
+
+try:
+    from async_http import fetch_bytes, fetch_to_file
+    ASYNC_HTTP_AVAILABLE = True
+except ImportError as e:
+    ASYNC_HTTP_AVAILABLE = False
+    fetch_bytes = fetch_to_file = None
+    print(f"⚠️  异步HTTP不可用: {e}")
+
 
 class HairSegmentation:
     """头发分割类"""
@@ -25,11 +34,12 @@ class HairSegmentation:
         if not access_key_id or not access_key_secret:
             raise ValueError("未设置阿里云AccessKey环境变量")
         
-        # 创建配置
+        # 创建配置(接入点可通过环境变量覆盖,便于指向本地模拟服务)
         config = open_api_models.Config(
             access_key_id=access_key_id,
             access_key_secret=access_key_secret,
-            endpoint='imageseg.cn-shanghai.aliyuncs.com'
+            endpoint=os.environ.get('ALIYUN_IMAGESEG_ENDPOINT', 'imageseg.cn-shanghai.aliyuncs.com'),
+            protocol=os.environ.get('ALIYUN_API_PROTOCOL')
         )
         
         # 创建客户端
@@ -74,43 +84,70 @@ class HairSegmentation:
             print("\n📤 调用SegmentHair API...")
             response = self.client.segment_hair_with_options(request, runtime)
             
-            # 解析结果
-            if response.body.data and response.body.data.elements:
-                element = response.body.data.elements[0]
-                
-                result = {
-                    'success': True,
-                    'hair_url': element.image_url,
-                    'width': element.width,
-                    'height': element.height,
-                    'x': element.x,
-                    'y': element.y,
-                    'message': '头发分割成功'
-                }
-                
-                print("\n✅ 头发分割成功!")
-                print(f"   头发图URL: {result['hair_url'][:80]}...")
-                print(f"   尺寸: {result['width']}x{result['height']}")
-                print(f"   位置: ({result['x']}, {result['y']})")
-                print("\n" + "="*60)
-                
-                return result
-            else:
-                return {
-                    'success': False,
-                    'message': 'API返回数据为空'
-                }
+            return self._parse_response(response)
         
         except Exception as e:
-            error_msg = f"头发分割失败: {str(e)}"
-            print(f"\n❌ {error_msg}")
-            print("="*60)
+            return self._failure(e)
+    
+    async def segment_hair_async(self, image_url):
+        """
+        分割头发(协程版,异步服务模式使用),返回值与segment_hair相同
+        
+        Args:
+            image_url: 图像URL地址（必须是公网可访问的URL）
+        """
+        try:
+            print(f"\n🚀 开始头发分割(异步): {image_url[:80]}...")
+            request = imageseg_models.SegmentHairRequest(
+                image_url=image_url
+            )
+            runtime = util_models.RuntimeOptions()
+            response = await self.client.segment_hair_with_options_async(request, runtime)
+            return self._parse_response(response)
+        
+        except Exception as e:
+            return self._failure(e)
+    
+    @staticmethod
+    def _parse_response(response):
+        """解析SegmentHair响应"""
+        if response.body.data and response.body.data.elements:
+            element = response.body.data.elements[0]
+            
+            result = {
+                'success': True,
+                'hair_url': element.image_url,
+                'width': element.width,
+                'height': element.height,
+                'x': element.x,
+                'y': element.y,
+                'message': '头发分割成功'
+            }
+            
+            print("\n✅ 头发分割成功!")
+            print(f"   头发图URL: {result['hair_url'][:80]}...")
+            print(f"   尺寸: {result['width']}x{result['height']}")
+            print(f"   位置: ({result['x']}, {result['y']})")
+            print("\n" + "="*60)
             
+            return result
+        else:
             return {
                 'success': False,
-                'message': error_msg
+                'message': 'API返回数据为空'
             }
     
+    @staticmethod
+    def _failure(error):
+        error_msg = f"头发分割失败: {str(error)}"
+        print(f"\n❌ {error_msg}")
+        print("="*60)
+        
+        return {
+            'success': False,
+            'message': error_msg
+        }
+    
     def download_hair_image(self, hair_url, save_path):
         """
         下载头发图像
@@ -127,13 +164,8 @@ class HairSegmentation:
             print(f"   URL: {hair_url[:80]}...")
             print(f"   保存到: {save_path}")
             
-            # 下载图像
-            response = requests.get(hair_url, timeout=30)
-            response.raise_for_status()
-            
-            # 保存到文件
-            with open(save_path, 'wb') as f:
-                f.write(response.content)
+            # 流式下载到文件(瞬时错误自动重试并续传)
+            get_downloader().download_to_file(hair_url, save_path)
             
             # 检查文件大小
             file_size = os.path.getsize(save_path) / 1024  # KB
@@ -146,6 +178,27 @@ class HairSegmentation:
         except Exception as e:
             print(f"❌ 下载头发图像失败: {str(e)}")
             return False
+    
+    async def download_hair_image_async(self, hair_url, save_path):
+        """
+        下载头发图像(协程版),等待下载时不占用线程
+        
+        Args:
+            hair_url: 头发图URL
+            save_path: 保存路径
+        
+        Returns:
+            bool: 是否成功
+        """
+        try:
+            print(f"\n💾 下载头发图像(异步): {hair_url[:80]}...")
+            size = await fetch_to_file(hair_url, save_path)
+            print(f"✅ 头发图像已保存: {save_path} ({size / 1024:.1f}KB)")
+            return True
+        
+        except Exception as e:
+            print(f"❌ 下载头发图像失败: {str(e)}")
+            return False
 
 
 def test_hair_segmentation():
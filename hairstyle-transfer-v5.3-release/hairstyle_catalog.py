@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+发型目录
+离线预处理常用的沙龙发型: 预处理后的图片、OSS地址、人脸融合模板、
+分割出的头发PNG和缩略图,写入索引后可在发型迁移时按目录ID直接使用,
+请求中只需上传客户照片并调用人脸融合
+
+用法:
+    python hairstyle_catalog.py ingest ./salon_hairstyles
+    python hairstyle_catalog.py list
+"""
+
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import cv2
+
+from file_hash import compute_file_hash
+
+
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+class HairstyleCatalog:
+    """发型目录(资源存放在static下供前端访问,索引存放在instance下)"""
+
+    DEFAULT_ASSET_DIR = 'static/catalog'
+    DEFAULT_INDEX_PATH = 'instance/hairstyle_catalog.json'
+    # 缩略图: 长边尺寸 -> 预处理规格(列表小图 / 选中预览)
+    THUMBNAIL_PROFILES = {'160': 'thumbnail_small', '480': 'thumbnail'}
+
+    _lock = threading.Lock()
+
+    def __init__(self, asset_dir: Optional[str] = None, index_path: Optional[str] = None):
+        """
+        初始化发型目录
+
+        Args:
+            asset_dir: 资源目录,默认环境变量HAIRSTYLE_CATALOG_DIR或static/catalog
+            index_path: 索引文件,默认环境变量HAIRSTYLE_CATALOG_INDEX或instance/hairstyle_catalog.json
+        """
+        self.asset_dir = asset_dir or os.getenv('HAIRSTYLE_CATALOG_DIR', self.DEFAULT_ASSET_DIR)
+        self.index_path = index_path or os.getenv('HAIRSTYLE_CATALOG_INDEX', self.DEFAULT_INDEX_PATH)
+        self._entries = {}
+        self._mtime = None
+
+    # ===== 索引读写 =====
+
+    def _load(self) -> Dict[str, dict]:
+        """读取索引,文件未变化时使用内存缓存"""
+        try:
+            mtime = os.path.getmtime(self.index_path)
+        except OSError:
+            return {}
+        if mtime != self._mtime:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f).get('hairstyles', {})
+            self._mtime = mtime
+        return self._entries
+
+    def _save(self, entries: Dict[str, dict]):
+        """原子写入索引(先写临时文件再替换)"""
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+        tmp_path = f'{self.index_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'updated_at': time.time(), 'hairstyles': entries}, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def get(self, catalog_id: str) -> Optional[dict]:
+        """按目录ID查询发型"""
+        return self._load().get(catalog_id)
+
+    def list_entries(self) -> List[dict]:
+        """全部发型(按名称排序)"""
+        return sorted(self._load().values(), key=lambda e: e['name'])
+
+    def remove(self, catalog_id: str, service=None) -> bool:
+        """
+        从目录中删除发型及其本地资源,并释放其常驻模板
+
+        Args:
+            catalog_id: 目录ID
+            service: AliyunHairTransferFixed实例,用于删除云端模板;为None时只取消常驻
+        """
+        with self._lock:
+            entries = dict(self._load())
+            entry = entries.pop(catalog_id, None)
+            if entry is None:
+                return False
+            self._save(entries)
+        self._release_template(entry, entries, service)
+        shutil.rmtree(os.path.join(self.asset_dir, catalog_id), ignore_errors=True)
+        return True
+
+    @staticmethod
+    def _release_template(entry: dict, entries: Dict[str, dict], service=None):
+        """
+        释放条目导入时常驻的模板(其他条目仍使用同一图片时保留)
+
+        常驻模板不会被淘汰,不释放的话下架或更换过的发型会一直占用配额
+        """
+        content_hash = entry.get('content_hash')
+        if not content_hash or any(e.get('content_hash') == content_hash for e in entries.values()):
+            return
+        registry = getattr(service, 'template_registry', None)
+        if registry is None and service is not None:
+            # 未启用注册表时模板由service直接创建
+            if entry.get('template_id'):
+                try:
+                    service.delete_face_template(entry['template_id'])
+                except Exception as e:
+                    print(f"⚠️  删除模板失败: {entry['template_id']}, {e}")
+            return
+        if registry is None:
+            from face_template_registry import FaceTemplateRegistry
+            registry = FaceTemplateRegistry()
+        registry.release(content_hash)
+
+    # ===== 离线导入 =====
+
+    @staticmethod
+    def make_id(filename: str) -> str:
+        """由文件名生成目录ID"""
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        return re.sub(r'[^0-9a-zA-Z]+', '-', stem).strip('-').lower() or 'hairstyle'
+
+    def public_path(self, path: Optional[str]) -> Optional[str]:
+        """本地资源路径转为前端可访问的URL"""
+        if not path:
+            return None
+        return '/' + os.path.relpath(path).replace(os.sep, '/')
+
+    def ingest_file(
+        self,
+        source_path: str,
+        uploader: Callable[[str], str],
+        service=None,
+        segment: bool = True,
+        force: bool = False
+    ) -> dict:
+        """
+        导入单个发型: 一次解码生成各规格 -> 上传OSS -> 预建模板(常驻) -> 头发分割
+
+        Args:
+            source_path: 发型原图路径
+            uploader: 上传函数,接收本地路径返回公网URL(如 app.upload_to_oss)
+            service: AliyunHairTransferFixed实例,用于预建模板;为None时跳过
+            segment: 是否预先分割头发
+            force: 源文件未变化时也重新导入
+
+        Returns:
+            dict: 目录条目
+        """
+        source_hash = compute_file_hash(source_path)
+        catalog_id = self.make_id(source_path)
+        existing = self._load().get(catalog_id)
+        if existing and existing.get('source_hash') != source_hash and existing.get('source') != source_path:
+            # 不同来源的同名文件,追加哈希避免覆盖
+            catalog_id = f'{catalog_id}-{source_hash[:6]}'
+            existing = self._load().get(catalog_id)
+        if existing and existing.get('source_hash') == source_hash and not force:
+            print(f"⏭️  未变化,跳过: {catalog_id}")
+            return existing
+
+        print(f"\n📚 导入发型: {catalog_id} ({source_path})")
+        entry_dir = os.path.join(self.asset_dir, catalog_id)
+        os.makedirs(entry_dir, exist_ok=True)
+
+        # 1. 一次解码生成人脸融合/头发分割/缩略图各规格(每级由上一级缩小)
+        image = cv2.imread(source_path)
+        if image is None:
+            raise ValueError(f"无法读取图像: {source_path}")
+        from image_preprocessor import ImagePreprocessor
+        profiles = ['facebody', 'imageseg', *self.THUMBNAIL_PROFILES.values()]
+        variants = ImagePreprocessor().generate_profiles(image, os.path.join(entry_dir, 'hairstyle'), profiles)
+        image_path = variants['facebody']['path']
+        content_hash = compute_file_hash(image_path)
+
+        # 2. 上传OSS
+        oss_url = uploader(image_path)
+
+        # 3. 预建模板并常驻,避免被配额淘汰
+        template_id = None
+        if service is not None:
+            registry = getattr(service, 'template_registry', None)
+            if registry is not None:
+                template_id = registry.prewarm([(content_hash, oss_url)], pin=True)[content_hash]
+            else:
+                template_id = service.add_face_template(oss_url)
+
+        # 4. 头发分割(用于发型预览)
+        hair_path = None
+        if segment:
+            try:
+                from hair_segmentation import HairSegmentation
+                hair_seg = HairSegmentation()
+                segment_url = uploader(variants['imageseg']['path'])
+                result = hair_seg.segment_hair(image_url=segment_url)
+                if result['success']:
+                    candidate = os.path.join(entry_dir, 'hair.png')
+                    if hair_seg.download_hair_image(result['hair_url'], candidate):
+                        hair_path = candidate
+                else:
+                    print(f"⚠️  头发分割失败: {result['message']}")
+            except Exception as e:
+                print(f"⚠️  头发分割不可用: {e}")
+
+        thumbnails = {size: variants[profile]['path'] for size, profile in self.THUMBNAIL_PROFILES.items()}
+
+        entry = {
+            'id': catalog_id,
+            'name': os.path.splitext(os.path.basename(source_path))[0],
+            'source': source_path,
+            'source_hash': source_hash,
+            'content_hash': content_hash,
+            'image_path': image_path,
+            'oss_url': oss_url,
+            'template_id': template_id,
+            'hair_path': hair_path,
+            'thumbnails': thumbnails,
+            'created_at': time.time(),
+        }
+        with self._lock:
+            entries = dict(self._load())
+            previous = entries.get(catalog_id)
+            entries[catalog_id] = entry
+            self._save(entries)
+        if previous and previous.get('content_hash') != content_hash:
+            # 源图更换后旧图片的常驻模板不再使用
+            self._release_template(previous, entries, service)
+
+        print(f"✅ 已导入: {catalog_id} (模板: {template_id})")
+        return entry
+
+    def ingest_directory(
+        self,
+        source_dir: str,
+        uploader: Callable[[str], str],
+        service=None,
+        segment: bool = True,
+        force: bool = False
+    ) -> dict:
+        """
+        导入目录下的全部发型图
+
+        Returns:
+            dict: {'imported': [...], 'failed': {文件名: 错误}}
+        """
+        imported, failed = [], {}
+        for name in sorted(os.listdir(source_dir)):
+            if not name.lower().endswith(SOURCE_EXTENSIONS):
+                continue
+            try:
+                entry = self.ingest_file(os.path.join(source_dir, name), uploader, service, segment, force)
+                imported.append(entry['id'])
+            except Exception as e:
+                print(f"❌ 导入失败: {name}, {e}")
+                failed[name] = str(e)
+        return {'imported': imported, 'failed': failed}
+
+    def to_public(self, entry: dict) -> dict:
+        """目录条目的对外信息(不暴露本地路径和模板ID)"""
+        return {
+            'id': entry['id'],
+            'name': entry['name'],
+            'image_url': self.public_path(entry['image_path']),
+            'hair_url': self.public_path(entry.get('hair_path')),
+            'thumbnails': {size: self.public_path(path) for size, path in entry['thumbnails'].items()},
+        }
+
+
+def main():
+    """命令行: 导入发型目录 / 查看 / 删除"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='发型目录')
+    sub = parser.add_subparsers(dest='command')
+    ingest_parser = sub.add_parser('ingest', help='导入目录下的发型图')
+    ingest_parser.add_argument('source_dir')
+    ingest_parser.add_argument('--no-segment', action='store_true', help='不预先分割头发')
+    ingest_parser.add_argument('--no-template', action='store_true', help='不预建人脸融合模板')
+    ingest_parser.add_argument('--force', action='store_true', help='源文件未变化也重新导入')
+    sub.add_parser('list', help='查看已导入的发型')
+    remove_parser = sub.add_parser('remove', help='删除发型')
+    remove_parser.add_argument('catalog_id')
+    args = parser.parse_args()
+
+    catalog = HairstyleCatalog()
+
+    if args.command == 'ingest':
+        from app import upload_to_oss
+        service = None
+        if not args.no_template:
+            from aliyun_hair_transfer_fixed import AliyunHairTransferFixed
+            service = AliyunHairTransferFixed()
+        summary = catalog.ingest_directory(
+            args.source_dir, upload_to_oss, service,
+            segment=not args.no_segment, force=args.force
+        )
+        print(f"\n✅ 导入完成: 成功{len(summary['imported'])}个, 失败{len(summary['failed'])}个")
+    elif args.command == 'remove':
+        from aliyun_hair_transfer_fixed import AliyunHairTransferFixed
+        print("✅ 已删除" if catalog.remove(args.catalog_id, AliyunHairTransferFixed()) else "⚠️  不存在")
+    else:
+        for entry in catalog.list_entries():
+            print(f"{entry['id']:<32} 模板: {entry.get('template_id') or '-':<40} 头发: {'✓' if entry.get('hair_path') else '-'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+图像计算进程池
+将预处理(缩放/JPEG编码)和素描滤镜移出Flask请求线程,在独立进程中执行,
+图像通过共享内存传递,避免pickle整幅像素数据
+"""
+
+import atexit
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context, shared_memory
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+# ===== 共享内存传递 =====
+
+def _to_shared(image: np.ndarray) -> Tuple[shared_memory.SharedMemory, tuple]:
+    """
+    将图像拷贝到新建的共享内存块
+
+    Returns:
+        (shm, desc): 共享内存对象和可跨进程传递的描述 (name, shape, dtype)
+    """
+    image = np.ascontiguousarray(image)
+    shm = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+    view = np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)
+    view[...] = image
+    return shm, (shm.name, image.shape, image.dtype.str)
+
+
+def _attach(desc: tuple) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """按描述挂载共享内存,返回零拷贝的数组视图"""
+    name, shape, dtype = desc
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def _take_shared(desc: tuple) -> np.ndarray:
+    """读取工作进程返回的共享内存结果,拷贝为普通数组后释放共享内存"""
+    shm, view = _attach(desc)
+    try:
+        return view.copy()
+    finally:
+        del view
+        shm.close()
+        shm.unlink()
+
+
+# ===== 工作进程 =====
+
+_worker = {}
+
+
+def _watch_parent(parent_pid: int, interval: float = 1.0):
+    """父进程退出(包括被SIGTERM/SIGKILL结束)后工作进程随之退出,不留下孤儿进程"""
+    while True:
+        time.sleep(interval)
+        if os.getppid() != parent_pid:
+            os._exit(0)
+
+
+def _init_worker(cv2_threads: int, parent_pid: Optional[int] = None):
+    """工作进程初始化: 限制OpenCV线程数,避免 进程数 x 线程数 超订CPU;监视父进程"""
+    cv2.setNumThreads(cv2_threads)
+    if parent_pid is not None:
+        threading.Thread(target=_watch_parent, args=(parent_pid,), name='parent-watch', daemon=True).start()
+    from image_preprocessor import ImagePreprocessor
+    from sketch_converter import SketchConverter
+    _worker['preprocessor'] = ImagePreprocessor()
+    _worker['sketch'] = SketchConverter()
+
+
+def _publish(result: np.ndarray) -> tuple:
+    """将结果写入工作进程新建的共享内存,所有权交给父进程(由父进程unlink)"""
+    shm, desc = _to_shared(result)
+    shm.close()
+    return desc
+
+
+def _task_preprocess_file(input_path: str, output_path: Optional[str]):
+    return _worker['preprocessor'].preprocess_image(input_path, output_path)
+
+
+def _task_preprocess(desc: tuple, orig_size: int, output_path: str) -> dict:
+    shm, image = _attach(desc)
+    try:
+        return _worker['preprocessor'].preprocess_array(image, orig_size, output_path)
+    finally:
+        del image
+        shm.close()
+
+
+def _task_profiles(desc: tuple, output_base: str, profiles: Optional[list], source_path: Optional[str]) -> dict:
+    shm, image = _attach(desc)
+    try:
+        return _worker['preprocessor'].generate_profiles(image, output_base, profiles, source_path)
+    finally:
+        del image
+        shm.close()
+
+
+def _task_resize(desc: tuple, width: int, height: int) -> tuple:
+    shm, image = _attach(desc)
+    try:
+        return _publish(_worker['preprocessor'].resize_image(image, width, height))
+    finally:
+        del image
+        shm.close()
+
+
+def _task_sketch(desc: tuple, style: str, kwargs: dict) -> tuple:
+    shm, image = _attach(desc)
+    try:
+        return _publish(_worker['sketch'].convert(image, style, **kwargs))
+    finally:
+        del image
+        shm.close()
+
+
+# ===== 进程池 =====
+
+class ImageProcessPool:
+    """图像计算进程池"""
+
+    def __init__(self, workers: Optional[int] = None, cv2_threads: Optional[int] = None):
+        """
+        初始化进程池
+
+        Args:
+            workers: 工作进程数,默认CPU核数
+            cv2_threads: 每个工作进程的OpenCV线程数,默认 CPU核数 / 工作进程数
+        """
+        cpu_count = os.cpu_count() or 1
+        self.workers = workers or cpu_count
+        self.cv2_threads = cv2_threads or max(1, cpu_count // self.workers)
+        self._lock = threading.Lock()
+        self._executor = None
+
+        print(f"✅ 图像计算进程池: {self.workers}个进程, 每进程OpenCV线程数={self.cv2_threads}")
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: 避免在多线程的Flask进程中fork导致OpenCV线程池死锁
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.cv2_threads, os.getpid())
+                )
+            return self._executor
+
+    def _call(self, fn, *args):
+        """提交任务并等待结果;工作进程崩溃时重建进程池并重试一次"""
+        executor = self._get_executor()
+        try:
+            return executor.submit(fn, *args).result()
+        except BrokenProcessPool:
+            with self._lock:
+                # 只丢弃自己提交的那个进程池;其他线程可能已重建,新池中的任务不能受影响
+                if self._executor is executor:
+                    print("⚠️  图像进程池已损坏,正在重建...")
+                    self._executor = None
+            executor.shutdown(wait=False)
+            return self._get_executor().submit(fn, *args).result()
+
+    def preprocess_file(self, input_path: str, output_path: Optional[str] = None) -> Tuple[str, dict]:
+        """在工作进程中完成 读取 + 预处理 (参数同 ImagePreprocessor.preprocess_image)"""
+        return self._call(_task_preprocess_file, input_path, output_path)
+
+    def preprocess(self, image: np.ndarray, orig_size: int, output_path: str) -> dict:
+        """预处理已解码的图像(参数同 ImagePreprocessor.preprocess_array)"""
+        shm, desc = _to_shared(image)
+        try:
+            return self._call(_task_preprocess, desc, orig_size, output_path)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def profiles(
+        self,
+        image: np.ndarray,
+        output_base: str,
+        profiles: Optional[list] = None,
+        source_path: Optional[str] = None
+    ) -> dict:
+        """由已解码的图像生成多个上游规格(参数同 ImagePreprocessor.generate_profiles)"""
+        shm, desc = _to_shared(image)
+        try:
+            return self._call(_task_profiles, desc, output_base, list(profiles) if profiles else None, source_path)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def resize(self, image: np.ndarray, width: int, height: int) -> np.ndarray:
+        """缩放图像(参数同 ImagePreprocessor.resize_image)"""
+        shm, desc = _to_shared(image)
+        try:
+            return _take_shared(self._call(_task_resize, desc, width, height))
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def sketch(self, image: np.ndarray, style: str = 'pencil', **kwargs) -> np.ndarray:
+        """素描转换(参数同 SketchConverter.convert)"""
+        shm, desc = _to_shared(image)
+        try:
+            return _take_shared(self._call(_task_sketch, desc, style, kwargs))
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def shutdown(self, wait: bool = True):
+        """关闭工作进程(wait=False时不等待进行中的任务,并取消排队的任务)"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait, cancel_futures=not wait)
+                self._executor = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _install_shutdown_hooks(pool: ImageProcessPool):
+    """
+    进程退出时关闭工作进程: 正常退出走atexit;
+    在主线程创建且SIGTERM仍为默认处理时,收到SIGTERM先关闭进程池再按默认方式退出
+    (uvicorn/gunicorn等自行处理信号的服务器正常退出时走atexit,被强制结束时由工作进程监视父进程退出)
+    """
+    atexit.register(pool.shutdown)
+    if threading.current_thread() is not threading.main_thread():
+        return
+    if signal.getsignal(signal.SIGTERM) is not signal.SIG_DFL:
+        return
+
+    def on_sigterm(signum, frame):
+        pool.shutdown(wait=False)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+
+def get_image_pool() -> Optional[ImageProcessPool]:
+    """
+    获取全局进程池(懒加载)
+
+    环境变量:
+        IMAGE_POOL_WORKERS: 工作进程数,默认CPU核数,设为0则禁用(在请求线程内计算)
+        IMAGE_POOL_CV2_THREADS: 每个工作进程的OpenCV线程数
+
+    Returns:
+        进程池实例,禁用时返回None
+    """
+    global _pool
+    workers = int(os.getenv('IMAGE_POOL_WORKERS', os.cpu_count() or 1))
+    if workers <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            cv2_threads = os.getenv('IMAGE_POOL_CV2_THREADS')
+            _pool = ImageProcessPool(workers, int(cv2_threads) if cv2_threads else None)
+            _install_shutdown_hooks(_pool)
+        return _pool
+
+
+def main():
+    """测试函数"""
+    print("图像计算进程池测试")
+    print("="*60)
+
+    pool = get_image_pool() or ImageProcessPool(workers=2)
+    image = np.random.default_rng(0).integers(0, 255, (1200, 900, 3), dtype=np.uint8)
+
+    sketch = pool.sketch(image, style='pencil')
+    resized = pool.resize(image, 450, 600)
+    print(f"\n✅ 素描结果: {sketch.shape}, 缩放结果: {resized.shape}")
+    pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
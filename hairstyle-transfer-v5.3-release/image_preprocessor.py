@@ -8,7 +8,7 @@ import os
 import cv2
 import numpy as np
 from PIL import Image
-from typing import Tuple, Optional
+from typing import Dict, Iterable, Tuple, Optional
 
 
 class ImagePreprocessor:
@@ -19,6 +19,20 @@ class ImagePreprocessor:
     MIN_RESOLUTION = 32  # 最小分辨率
     MAX_RESOLUTION = 2000  # 最大分辨率
     
+    # 各上游的目标规格: 长边上限 / 短边下限 / 文件大小上限 / 初始JPEG质量
+    # 每个接口只拿到满足其要求的最小图像
+    PROFILES = {
+        # 人脸融合: 模板与融合结果的清晰度取决于输入,保留到接口上限
+        'facebody': {'max_edge': MAX_RESOLUTION, 'min_edge': MIN_RESOLUTION, 'max_bytes': MAX_FILE_SIZE, 'quality': 95},
+        # 头发分割: 结果只用于发型预览
+        'imageseg': {'max_edge': 1280, 'min_edge': MIN_RESOLUTION, 'max_bytes': 1024 * 1024, 'quality': 90},
+        # 通义万相2.5图生图: 384~1024px
+        'wan25': {'max_edge': 1024, 'min_edge': 384, 'max_bytes': 300 * 1024, 'quality': 92},
+        # 列表缩略图 / 选中预览
+        'thumbnail': {'max_edge': 480, 'min_edge': 1, 'max_bytes': None, 'quality': 85},
+        'thumbnail_small': {'max_edge': 160, 'min_edge': 1, 'max_bytes': None, 'quality': 85},
+    }
+    
     def __init__(self):
         """初始化预处理器"""
         pass
@@ -190,9 +204,33 @@ class ImagePreprocessor:
         if image is None:
             raise ValueError(f"无法读取图像: {input_path}")
         
+        # 生成输出路径
+        if output_path is None:
+            base, ext = os.path.splitext(input_path)
+            output_path = f"{base}_processed.jpg"
+        
+        info = self.preprocess_array(image, self.get_file_size(input_path), output_path)
+        return output_path, info
+    
+    def preprocess_array(
+        self,
+        image: np.ndarray,
+        orig_size: int,
+        output_path: str
+    ) -> dict:
+        """
+        预处理已解码的图像(调整分辨率 + 压缩编码)
+        
+        Args:
+            image: 已解码的OpenCV图像
+            orig_size: 原始文件大小(字节)
+            output_path: 输出图像路径
+        
+        Returns:
+            info: 处理信息
+        """
         # 获取原始信息
         orig_width, orig_height = self.get_image_resolution(image)
-        orig_size = self.get_file_size(input_path)
         
         print(f"   原始分辨率: {orig_width}x{orig_height}")
         print(f"   原始大小: {orig_size/1024:.1f}KB")
@@ -228,11 +266,6 @@ class ImagePreprocessor:
             info['target_height'] = orig_height
             print(f"   分辨率符合要求,无需调整")
         
-        # 生成输出路径
-        if output_path is None:
-            base, ext = os.path.splitext(input_path)
-            output_path = f"{base}_processed.jpg"
-        
         # 检查是否需要压缩
         if orig_size > self.MAX_FILE_SIZE or need_resize:
             print(f"   需要压缩...")
@@ -252,7 +285,168 @@ class ImagePreprocessor:
         print(f"   输出: {output_path}")
         print(f"✅ 预处理完成")
         
-        return output_path, info
+        return info
+    
+    def fit_size(self, width: int, height: int, profile: str) -> Tuple[int, int]:
+        """
+        计算图像在某个规格下的目标尺寸(保持宽高比)
+        
+        Args:
+            width: 原始宽度
+            height: 原始高度
+            profile: 规格名(见PROFILES)
+        
+        Returns:
+            (target_width, target_height): 目标尺寸
+        """
+        spec = self.PROFILES[profile]
+        scale = 1.0
+        if max(width, height) > spec['max_edge']:
+            scale = spec['max_edge'] / max(width, height)
+        if min(width, height) * scale < spec['min_edge']:
+            scale = spec['min_edge'] / min(width, height)
+        if scale == 1.0:
+            return width, height
+        return max(1, int(width * scale)), max(1, int(height * scale))
+    
+    @staticmethod
+    def upright_jpeg_size(source_path: str) -> Optional[Tuple[int, int]]:
+        """
+        只读文件头: 无需旋转的JPEG返回 (width, height),否则返回None
+
+        EXIF Orientation(0x0112)非1时解码会旋转,上游按文件原样处理,
+        与本地在解码(旋转)后的像素上算出的人脸位置不一致,这样的原文件不能直接复用
+        """
+        try:
+            with Image.open(source_path) as img:
+                if img.format != 'JPEG' or img.getexif().get(0x0112, 1) != 1:
+                    return None
+                return img.size
+        except Exception:
+            return None
+
+    def source_compliance(self, source_path: str, profiles: Iterable[str]) -> Optional[Dict[str, dict]]:
+        """
+        只读文件头判断原文件是否已满足全部规格(如浏览器端已按规格缩放压缩过的上传)
+
+        要求: JPEG、无EXIF旋转、尺寸与每个规格的目标尺寸一致、大小不超过每个规格的上限
+
+        Args:
+            source_path: 原始文件路径
+            profiles: 规格名列表
+
+        Returns:
+            dict: 满足时返回与generate_profiles相同结构的结果(全部指向原文件),否则None
+        """
+        header = self.upright_jpeg_size(source_path)
+        if header is None:
+            return None
+        width, height = header
+
+        size = self.get_file_size(source_path)
+        results = {}
+        for name in profiles:
+            spec = self.PROFILES[name]
+            if self.fit_size(width, height, name) != (width, height):
+                return None
+            if spec['max_bytes'] is not None and size > spec['max_bytes']:
+                return None
+            results[name] = {
+                'path': source_path, 'width': width, 'height': height,
+                'size': size, 'quality': None, 'resized': False, 'encoded': False,
+            }
+        return results
+
+    def encode_to_limit(self, image: np.ndarray, max_bytes: Optional[int], quality: int) -> Tuple[bytes, int]:
+        """
+        在内存中编码JPEG,逐级降低质量直到不超过大小上限
+        
+        Returns:
+            (data, quality): 编码结果和最终质量
+        """
+        while True:
+            _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if max_bytes is None or buffer.nbytes <= max_bytes or quality <= 15:
+                return buffer.tobytes(), quality
+            quality -= 5
+    
+    def generate_profiles(
+        self,
+        image: np.ndarray,
+        output_base: str,
+        profiles: Optional[Iterable[str]] = None,
+        source_path: Optional[str] = None
+    ) -> Dict[str, dict]:
+        """
+        由一次解码的图像生成多个规格
+        
+        按目标尺寸从大到小级联: 每一级由上一级缩小而来,只有需要放大时才回到原图
+        
+        Args:
+            image: 已解码的OpenCV图像
+            output_base: 输出路径前缀,写出 {output_base}_{规格名}.jpg
+            profiles: 规格名列表,默认全部
+            source_path: 原始文件路径;尺寸和大小都已符合某规格时直接使用原文件,不重新编码
+        
+        Returns:
+            dict: {规格名: {'path', 'width', 'height', 'size', 'quality', 'resized', 'encoded'}}
+        """
+        orig_width, orig_height = self.get_image_resolution(image)
+        source_size = self.get_file_size(source_path) if source_path else None
+        source_is_jpeg = bool(source_path) and self.upright_jpeg_size(source_path) is not None
+        
+        names = list(profiles or self.PROFILES)
+        targets = {name: self.fit_size(orig_width, orig_height, name) for name in names}
+        
+        results = {}
+        current = image
+        for name in sorted(names, key=lambda n: targets[n][0] * targets[n][1], reverse=True):
+            spec = self.PROFILES[name]
+            target_width, target_height = targets[name]
+            resized = (target_width, target_height) != (orig_width, orig_height)
+            
+            # 原文件已满足要求: 不缩放不重新编码
+            if (not resized and source_is_jpeg and
+                    (spec['max_bytes'] is None or source_size <= spec['max_bytes'])):
+                results[name] = {
+                    'path': source_path, 'width': orig_width, 'height': orig_height,
+                    'size': source_size, 'quality': None, 'resized': False, 'encoded': False,
+                }
+                continue
+            
+            current_height, current_width = current.shape[:2]
+            if (target_width, target_height) != (current_width, current_height):
+                if target_width <= current_width and target_height <= current_height:
+                    # 级联缩小: 由上一级生成
+                    level = cv2.resize(current, (target_width, target_height), interpolation=cv2.INTER_AREA)
+                else:
+                    # 放大只能从原图开始
+                    level = self.resize_image(image, target_width, target_height)
+            else:
+                level = current
+            if target_width <= current.shape[1]:
+                current = level
+            
+            data, quality = self.encode_to_limit(level, spec['max_bytes'], spec['quality'])
+            # 最低质量仍超出上限: 继续缩小尺寸(短边不小于min_edge)
+            while spec['max_bytes'] and len(data) > spec['max_bytes'] and min(level.shape[:2]) > spec['min_edge']:
+                step = max(0.9, spec['min_edge'] / min(level.shape[:2]))
+                level = cv2.resize(
+                    level, (max(1, round(level.shape[1] * step)), max(1, round(level.shape[0] * step))),
+                    interpolation=cv2.INTER_AREA
+                )
+                data, quality = self.encode_to_limit(level, spec['max_bytes'], 85)
+            
+            path = f"{output_base}_{name}.jpg"
+            with open(path, 'wb') as f:
+                f.write(data)
+            results[name] = {
+                'path': path, 'width': level.shape[1], 'height': level.shape[0],
+                'size': len(data), 'quality': quality, 'resized': resized, 'encoded': True,
+            }
+            print(f"   规格 {name}: {level.shape[1]}x{level.shape[0]}, {len(data)/1024:.1f}KB")
+        
+        return results
     
     def validate_image(self, file_path: str) -> Tuple[bool, str]:
         """
@@ -309,6 +503,7 @@ def main():
     print("```python")
     print("preprocessor = ImagePreprocessor()")
     print("output_path, info = preprocessor.preprocess_image('input.jpg')")
+    print("variants = preprocessor.generate_profiles(image, 'out/photo', ['facebody', 'imageseg', 'wan25'])")
     print("```")
 
 
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+持久化任务存储
+发型迁移的每个阶段完成后把产出(OSS URL、模板ID、融合结果URL、百炼任务ID等)写入SQLite,
+进程重启后由恢复工作线程从最后完成的阶段继续,已提交的百炼任务继续轮询而不是重新提交(重复付费)。
+多个工作进程通过租约认领任务: 持有者定期续租,进程退出后租约过期,其他进程即可接手。
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+class LeaseLostError(Exception):
+    """任务租约已被其他进程接手,当前进程应停止处理"""
+
+
+class JobCheckpoint:
+    """一个已认领任务的检查点句柄,流水线通过它读取/保存各阶段产出"""
+
+    def __init__(self, store: 'JobStore', row: sqlite3.Row):
+        self.store = store
+        self.job_id = row['job_id']
+        self.kind = row['kind']
+        self.params = json.loads(row['params'])
+        self.stage = row['stage']
+        self.outputs = json.loads(row['outputs'] or '{}')
+        self.attempts = row['attempts']
+
+    @property
+    def resumed(self) -> bool:
+        """是否为恢复执行(之前已有进程处理过)"""
+        return self.attempts > 1
+
+    def get(self, name: str, default=None):
+        """读取已完成阶段的产出"""
+        return self.outputs.get(name, default)
+
+    def save(self, stage: str, **outputs):
+        """
+        记录阶段完成及其产出
+
+        Raises:
+            LeaseLostError: 租约已被其他进程接手
+        """
+        merged = dict(self.outputs, **outputs)
+        self.store._save_checkpoint(self.job_id, stage, merged)
+        self.outputs = merged
+        self.stage = stage
+        print(f"📌 任务检查点: {self.job_id} -> {stage}")
+
+    def complete(self, result: Optional[dict] = None):
+        self.store._finish(self.job_id, 'succeeded', result=result)
+
+    def fail(self, error: str, retry: bool = False):
+        """
+        标记失败
+
+        Args:
+            error: 错误信息
+            retry: 是否放回队列等待其他工作线程重试(未超过最大尝试次数时)
+        """
+        retry = retry and self.attempts < self.store.max_attempts
+        self.store._finish(self.job_id, 'pending' if retry else 'failed', error=error)
+
+
+class JobStore:
+    """SQLite任务存储(WAL模式,多进程共享)"""
+
+    DEFAULT_DB_PATH = 'instance/jobs.db'
+    DEFAULT_LEASE_SECONDS = 120
+    DEFAULT_MAX_ATTEMPTS = 3
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        lease_seconds: Optional[float] = None,
+        max_attempts: Optional[int] = None
+    ):
+        """
+        初始化
+
+        Args:
+            db_path: 数据库路径,默认环境变量JOB_STORE_DB或instance/jobs.db
+            lease_seconds: 租约时长(秒),默认环境变量JOB_LEASE_SECONDS或120;
+                           持有期间每1/3租约续租一次,进程退出后最多这么久被其他进程接手
+            max_attempts: 最大尝试次数(含恢复执行),默认3
+        """
+        self.db_path = db_path or os.getenv('JOB_STORE_DB', self.DEFAULT_DB_PATH)
+        self.lease_seconds = float(lease_seconds or os.getenv('JOB_LEASE_SECONDS', self.DEFAULT_LEASE_SECONDS))
+        self.max_attempts = max_attempts or self.DEFAULT_MAX_ATTEMPTS
+        # 租约持有者: 主机名+进程号(同一进程内的线程共享续租)
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+
+        self._held = set()
+        self._held_lock = threading.Lock()
+        self._heartbeat = None
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._init_db()
+
+    @contextmanager
+    def _db(self, immediate: bool = False):
+        """
+        打开数据库连接,退出时提交事务并关闭
+
+        Args:
+            immediate: 立即获取写锁(认领任务时避免多个进程读到同一行)
+        """
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                if immediate:
+                    conn.execute('BEGIN IMMEDIATE')
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._db() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id        TEXT PRIMARY KEY,
+                    kind          TEXT NOT NULL,
+                    status        TEXT NOT NULL,
+                    params        TEXT NOT NULL,
+                    stage         TEXT,
+                    outputs       TEXT,
+                    result        TEXT,
+                    error         TEXT,
+                    attempts      INTEGER NOT NULL DEFAULT 0,
+                    lease_owner   TEXT,
+                    lease_expires REAL,
+                    created_at    REAL NOT NULL,
+                    updated_at    REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires)')
+
+    # ===== 租约 =====
+
+    def _hold(self, job_id: str):
+        with self._held_lock:
+            self._held.add(job_id)
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._renew_loop, name='job-lease', daemon=True)
+                self._heartbeat.start()
+
+    def _release(self, job_id: str):
+        with self._held_lock:
+            self._held.discard(job_id)
+
+    def _renew_loop(self):
+        """续租本进程持有的全部任务;进程退出后续租停止,租约自然过期"""
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self._held_lock:
+                held = list(self._held)
+            if not held:
+                continue
+            try:
+                now = time.time()
+                with self._db() as conn:
+                    conn.executemany(
+                        "UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND lease_owner = ? AND status = 'running'",
+                        [(now + self.lease_seconds, job_id, self.owner) for job_id in held]
+                    )
+            except sqlite3.Error as e:
+                print(f"⚠️  任务续租失败: {e}")
+
+    # ===== 任务生命周期 =====
+
+    def create(self, kind: str, params: dict, stage: Optional[str] = None, outputs: Optional[dict] = None) -> JobCheckpoint:
+        """
+        创建任务并由当前进程直接持有(请求线程立即执行)
+
+        Args:
+            kind: 任务类型,如 'transfer'
+            params: 任务参数(可JSON序列化),恢复执行时原样传给处理函数
+            stage: 初始阶段(如参数中已包含上传结果时为 'uploaded')
+            outputs: 初始产出
+
+        Returns:
+            JobCheckpoint
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._db() as conn:
+            conn.execute(
+                'INSERT INTO jobs (job_id, kind, status, params, stage, outputs, attempts, '
+                'lease_owner, lease_expires, created_at, updated_at) '
+                "VALUES (?, ?, 'running', ?, ?, ?, 1, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(params, ensure_ascii=False), stage,
+                 json.dumps(outputs or {}, ensure_ascii=False), self.owner, now + self.lease_seconds, now, now)
+            )
+            row = conn.execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        self._hold(job_id)
+        return JobCheckpoint(self, row)
+
+    def claim(self, kinds: Optional[Iterable[str]] = None) -> Optional[JobCheckpoint]:
+        """
+        认领一个可执行的任务: 等待中的任务,或租约已过期(持有进程已退出)的运行中任务
+
+        Args:
+            kinds: 只认领这些类型,默认全部
+
+        Returns:
+            JobCheckpoint,没有可执行任务时返回None
+        """
+        kinds = list(kinds) if kinds else None
+        kind_filter = f" AND kind IN ({','.join('?' * len(kinds))})" if kinds else ''
+        while True:
+            now = time.time()
+            with self._db(immediate=True) as conn:
+                row = conn.execute(
+                    "SELECT job_id, attempts FROM jobs WHERE "
+                    "(status = 'pending' OR (status = 'running' AND lease_expires < ?))"
+                    f"{kind_filter} ORDER BY created_at LIMIT 1",
+                    [now] + (kinds or [])
+                ).fetchone()
+                if row is None:
+                    return None
+                if row['attempts'] >= self.max_attempts:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = COALESCE(error, '超过最大尝试次数'), "
+                        'lease_owner = NULL, updated_at = ? WHERE job_id = ?',
+                        (now, row['job_id'])
+                    )
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires = ?, "
+                    'attempts = attempts + 1, updated_at = ? WHERE job_id = ?',
+                    (self.owner, now + self.lease_seconds, now, row['job_id'])
+                )
+                row = conn.execute('SELECT * FROM jobs WHERE job_id = ?', (row['job_id'],)).fetchone()
+            self._hold(row['job_id'])
+            return JobCheckpoint(self, row)
+
+    def _save_checkpoint(self, job_id: str, stage: str, outputs: dict):
+        now = time.time()
+        with self._db() as conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET stage = ?, outputs = ?, lease_expires = ?, updated_at = ? '
+                "WHERE job_id = ? AND lease_owner = ? AND status = 'running'",
+                (stage, json.dumps(outputs, ensure_ascii=False), now + self.lease_seconds, now, job_id, self.owner)
+            )
+        if cursor.rowcount == 0:
+            self._release(job_id)
+            raise LeaseLostError(f"任务租约已失效: {job_id}")
+
+    def _finish(self, job_id: str, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+        now = time.time()
+        try:
+            with self._db() as conn:
+                conn.execute(
+                    'UPDATE jobs SET status = ?, result = ?, error = ?, lease_owner = NULL, '
+                    'lease_expires = NULL, updated_at = ? WHERE job_id = ? AND lease_owner = ?',
+                    (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                     error, now, job_id, self.owner)
+                )
+        finally:
+            self._release(job_id)
+
+    # ===== 查询 =====
+
+    @staticmethod
+    def _to_public(row: sqlite3.Row) -> dict:
+        return {
+            'job_id': row['job_id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'stage': row['stage'],
+            'attempts': row['attempts'],
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+        }
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """查询任务状态与结果(不含参数)"""
+        with self._db() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return self._to_public(row) if row else None
+
+    def list_jobs(self, status: Optional[str] = None, limit: int = 50) -> List[dict]:
+        with self._db() as conn:
+            if status:
+                rows = conn.execute(
+                    'SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?', (status, limit)
+                ).fetchall()
+            else:
+                rows = conn.execute('SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?', (limit,)).fetchall()
+        return [self._to_public(row) for row in rows]
+
+    def stats(self) -> dict:
+        """各状态任务数;running中租约已过期的计为stale(等待恢复)"""
+        now = time.time()
+        with self._db() as conn:
+            counts = {r['status']: r['n'] for r in conn.execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status')}
+            stale = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'running' AND lease_expires < ?", (now,)
+            ).fetchone()[0]
+        counts['stale'] = stale
+        return counts
+
+    def prune(self, max_age_days: float = 7) -> int:
+        """删除已结束且超过保留期的任务"""
+        cutoff = time.time() - max_age_days * 86400
+        with self._db() as conn:
+            cursor = conn.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND updated_at < ?", (cutoff,)
+            )
+        return cursor.rowcount
+
+
+class ResumeWorker:
+    """恢复工作线程: 认领等待中/租约过期的任务,从最后完成的阶段继续执行"""
+
+    def __init__(
+        self,
+        store: JobStore,
+        handlers: Dict[str, Callable[[dict, JobCheckpoint], dict]],
+        poll_interval: float = 5.0
+    ):
+        """
+        Args:
+            store: 任务存储
+            handlers: {任务类型: 处理函数(params, checkpoint) -> 结果dict}
+            poll_interval: 没有任务时的检查间隔(秒)
+        """
+        self.store = store
+        self.handlers = handlers
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self) -> bool:
+        """处理一个任务,没有可执行任务时返回False"""
+        checkpoint = self.store.claim(self.handlers)
+        if checkpoint is None:
+            return False
+
+        print(f"🔁 恢复任务: {checkpoint.job_id} ({checkpoint.kind}), "
+              f"从阶段 {checkpoint.stage or '开始'} 继续, 第{checkpoint.attempts}次尝试")
+        try:
+            result = self.handlers[checkpoint.kind](checkpoint.params, checkpoint)
+        except LeaseLostError as e:
+            print(f"⚠️  {e}")
+        except Exception as e:
+            print(f"❌ 任务执行失败: {checkpoint.job_id}, {e}")
+            checkpoint.fail(str(e), retry=True)
+        else:
+            checkpoint.complete(result)
+            print(f"✅ 任务已完成: {checkpoint.job_id}")
+        return True
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except sqlite3.Error as e:
+                print(f"⚠️  任务认领失败: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def start(self) -> 'ResumeWorker':
+        """在后台线程中运行"""
+        self._thread = threading.Thread(target=self.run_forever, name='job-resume', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+_job_store = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    """
+    获取全局任务存储(懒加载)
+
+    环境变量:
+        JOB_STORE_DB: 数据库路径,多个工作进程需指向同一文件
+        JOB_LEASE_SECONDS: 租约时长(秒)
+    """
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = JobStore()
+        return _job_store
+
+
+def main():
+    """命令行: 查看统计 / 列出任务 / 运行恢复工作进程"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='持久化任务存储')
+    sub = parser.add_subparsers(dest='command')
+    sub.add_parser('stats', help='各状态任务数')
+    list_parser = sub.add_parser('list', help='列出最近的任务')
+    list_parser.add_argument('--status')
+    list_parser.add_argument('--limit', type=int, default=20)
+    sub.add_parser('worker', help='运行恢复工作进程(可多开)')
+    prune_parser = sub.add_parser('prune', help='删除已结束的旧任务')
+    prune_parser.add_argument('--days', type=float, default=7)
+    args = parser.parse_args()
+
+    store = get_job_store()
+    if args.command == 'list':
+        for job in store.list_jobs(args.status, args.limit):
+            print(f"{job['job_id']}  {job['kind']:<10} {job['status']:<10} {job['stage'] or '-':<18} "
+                  f"尝试{job['attempts']}次  {job['error'] or ''}")
+    elif args.command == 'worker':
+        from app import JOB_HANDLERS
+        print(f"🔁 恢复工作进程已启动: {store.owner}, 任务类型: {', '.join(JOB_HANDLERS)}")
+        ResumeWorker(store, JOB_HANDLERS).run_forever()
+    elif args.command == 'prune':
+        print(f"已删除: {store.prune(args.days)}")
+    else:
+        print(json.dumps(store.stats(), indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+实时素描模式(店内镜面屏)
+摄像头/视频帧由采集线程读取,处理线程只取最新一帧转换为素描,处理不过来时直接丢弃旧帧;
+所有中间结果使用预分配缓冲区(按分辨率档位缓存),处理耗时超出帧预算时自动降低处理分辨率,
+有余量时再逐级恢复。统计实际帧率、每帧延迟(采集到输出)和丢帧数。
+
+用法:
+    python live_sketch.py 0 --style pencil            # 摄像头0,窗口显示
+    python live_sketch.py demo.mp4 --headless --seconds 10
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+from metrics import percentile
+
+
+# 处理分辨率档位(相对于输入的缩放比例),档位固定,各档的缓冲区只分配一次
+SCALE_LEVELS = (1.0, 0.85, 0.7, 0.6, 0.5, 0.42, 0.35, 0.3, 0.25)
+
+STYLES = ('pencil', 'detailed', 'artistic', 'color')
+
+# 与SketchConverter.artistic_sketch相同的锐化核
+SHARPEN_KERNEL = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]], dtype=np.float32)
+
+
+class FrameSketcher:
+    """
+    单一分辨率的素描渲染器: 与SketchConverter各风格算法相同,
+    但所有中间结果写入预分配的缓冲区(dst参数),逐帧处理不产生新的大数组
+    """
+
+    def __init__(self, width: int, height: int):
+        self.size = (width, height)
+        shape = (height, width)
+        self.small = np.empty(shape + (3,), np.uint8)
+        self.gray = np.empty(shape, np.uint8)
+        self.inverted = np.empty(shape, np.uint8)
+        self.blurred = np.empty(shape, np.uint8)
+        self.sketch = np.empty(shape, np.uint8)
+        self.edges = np.empty(shape, np.uint8)
+        self.sharpened = np.empty(shape, np.uint8)
+        self.hsv = np.empty(shape + (3,), np.uint8)
+        self.colored = np.empty(shape + (3,), np.uint8)
+        self.sketch_bgr = np.empty(shape + (3,), np.uint8)
+        self.color_out = np.empty(shape + (3,), np.uint8)
+
+    def _pencil(self, blur_sigma: int) -> np.ndarray:
+        if blur_sigma % 2 == 0:
+            blur_sigma += 1
+        cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        cv2.bitwise_not(self.gray, dst=self.inverted)
+        cv2.GaussianBlur(self.inverted, (blur_sigma, blur_sigma), 0, dst=self.blurred)
+        # 颜色减淡: gray / (255 - blurred) * 256;分母为0时结果应饱和为255,用1代替0
+        cv2.bitwise_not(self.blurred, dst=self.blurred)
+        cv2.max(self.blurred, 1, dst=self.blurred)
+        cv2.divide(self.gray, self.blurred, dst=self.sketch, scale=256.0)
+        return self.sketch
+
+    def render(self, frame: np.ndarray, style: str = 'pencil', mirror: bool = False, **kwargs) -> np.ndarray:
+        """
+        渲染一帧(返回的数组属于本渲染器,下一次render时会被覆盖)
+
+        Args:
+            frame: BGR输入帧(任意尺寸,缩放到本渲染器的分辨率)
+            style: 素描风格(同SketchConverter.convert)
+            mirror: 是否左右翻转(镜面效果)
+            **kwargs: 风格参数(同SketchConverter.convert)
+        """
+        if (frame.shape[1], frame.shape[0]) == self.size:
+            np.copyto(self.small, frame)
+        else:
+            cv2.resize(frame, self.size, dst=self.small, interpolation=cv2.INTER_AREA)
+        if mirror:
+            cv2.flip(self.small, 1, dst=self.small)
+
+        if style == 'pencil':
+            return self._pencil(kwargs.get('blur_sigma', 21))
+        if style == 'detailed':
+            sketch = self._pencil(kwargs.get('blur_sigma', 15))
+            cv2.Canny(self.gray, kwargs.get('edge_threshold1', 50), kwargs.get('edge_threshold2', 150),
+                      edges=self.edges)
+            cv2.bitwise_not(self.edges, dst=self.edges)
+            return cv2.bitwise_and(sketch, self.edges, dst=sketch)
+        if style == 'artistic':
+            sketch = self._pencil(kwargs.get('blur_sigma', 21))
+            if kwargs.get('sharpen', True):
+                cv2.filter2D(sketch, -1, SHARPEN_KERNEL, dst=self.sharpened)
+                sketch = self.sharpened
+            return cv2.convertScaleAbs(sketch, dst=self.sketch, alpha=1.2, beta=10)
+        if style == 'color':
+            sketch = self._pencil(kwargs.get('blur_sigma', 21))
+            cv2.cvtColor(sketch, cv2.COLOR_GRAY2BGR, dst=self.sketch_bgr)
+            # 降低原图饱和度后与素描混合
+            cv2.cvtColor(self.small, cv2.COLOR_BGR2HSV, dst=self.hsv)
+            saturation = self.hsv[:, :, 1]
+            np.multiply(saturation, kwargs.get('color_intensity', 0.3), out=saturation, casting='unsafe')
+            cv2.cvtColor(self.hsv, cv2.COLOR_HSV2BGR, dst=self.colored)
+            return cv2.addWeighted(self.sketch_bgr, 0.7, self.colored, 0.3, 0, dst=self.color_out)
+        raise ValueError(f"未知的素描风格: {style}")
+
+
+class LiveSketch:
+    """
+    实时素描: 采集线程 + 处理线程
+
+    采集与处理之间用三缓冲交换最新帧: 采集线程写后台缓冲,写完与"最新"交换;
+    处理线程取走"最新"时与自己持有的缓冲交换。处理线程来不及取走的帧被下一帧覆盖(计为丢帧),
+    延迟不会随负载累积。
+    """
+
+    DEFAULT_FPS = 24
+    DEFAULT_MAX_WIDTH = 1280
+    # 统计窗口(秒)
+    STATS_WINDOW = 2.0
+    # 处理耗时(指数平均)超过帧预算的比例: 高于DOWNSCALE降一档,低于UPSCALE升一档
+    DOWNSCALE_RATIO = 0.9
+    UPSCALE_RATIO = 0.55
+    # 两次调整之间至少间隔的帧数,避免来回抖动
+    ADJUST_COOLDOWN = 10
+
+    def __init__(
+        self,
+        source=0,
+        style: str = 'pencil',
+        target_fps: Optional[float] = None,
+        max_width: Optional[int] = None,
+        min_scale: Optional[float] = None,
+        mirror: bool = True,
+        realtime: Optional[bool] = None,
+        **style_kwargs
+    ):
+        """
+        初始化
+
+        Args:
+            source: 摄像头编号、视频路径/URL,或提供read()->(ok, frame)的对象
+            style: 素描风格(pencil/detailed/artistic/color)
+            target_fps: 目标帧率,默认环境变量LIVE_SKETCH_FPS或24
+            max_width: 处理分辨率的宽度上限(超过时先缩小),默认环境变量LIVE_SKETCH_MAX_WIDTH或1280
+            min_scale: 自适应降分辨率的下限,默认环境变量LIVE_SKETCH_MIN_SCALE或0.25
+            mirror: 是否左右翻转(镜面屏)
+            realtime: 视频文件按其帧率读取(模拟摄像头),默认source为文件路径时启用
+            **style_kwargs: 风格参数(同SketchConverter.convert)
+        """
+        if style not in STYLES:
+            raise ValueError(f"未知的素描风格: {style}")
+        self.source = source
+        self.style = style
+        self.style_kwargs = style_kwargs
+        self.mirror = mirror
+        self.target_fps = target_fps or float(os.getenv('LIVE_SKETCH_FPS', self.DEFAULT_FPS))
+        self.max_width = max_width or int(os.getenv('LIVE_SKETCH_MAX_WIDTH', self.DEFAULT_MAX_WIDTH))
+        min_scale = min_scale or float(os.getenv('LIVE_SKETCH_MIN_SCALE', '0.25'))
+        self.levels = [s for s in SCALE_LEVELS if s >= min_scale] or [SCALE_LEVELS[0]]
+        self.realtime = isinstance(source, str) and os.path.isfile(source) if realtime is None else realtime
+
+        self._capture = None
+        self._threads = []
+        self._running = threading.Event()
+        self._cond = threading.Condition()
+
+        # 三缓冲: 采集写入 back,完成后与 ready 交换;处理线程取走时 ready 与 front 交换
+        self._back = self._ready = self._front = None
+        self._ready_time = 0.0
+        self._capture_interval = None
+        self._fresh = False
+        self._source_done = False
+
+        # 各档位的渲染器(预分配缓冲区),首次用到时创建
+        self._sketchers = {}
+        self._level = 0
+        self._frames_since_adjust = 0
+        self._process_ewma = None
+
+        # 输出: 两个缓冲交替,read()拿到的帧在下一帧完成前不会被覆盖
+        self._outputs = [None, None]
+        self._output_index = 0
+        self._output_id = 0
+        self._output_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._captured = 0
+        self._processed = 0
+        self._dropped = 0
+        self._done_times = deque()
+        self._latencies = deque()
+        self._process_times = deque()
+
+    # ===== 生命周期 =====
+
+    def start(self) -> 'LiveSketch':
+        """打开视频源并启动采集、处理线程"""
+        if hasattr(self.source, 'read'):
+            self._capture = self.source
+        else:
+            self._capture = cv2.VideoCapture(self.source)
+            if not self._capture.isOpened():
+                raise ValueError(f"无法打开视频源: {self.source}")
+            # 摄像头驱动内部的缓冲会增加延迟,只保留1帧
+            self._capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        self._running.set()
+        self._threads = [
+            threading.Thread(target=self._capture_loop, name='live-sketch-capture', daemon=True),
+            threading.Thread(target=self._process_loop, name='live-sketch-process', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        print(f"🎥 实时素描已启动: 源={self.source}, 风格={self.style}, 目标{self.target_fps:g}fps")
+        return self
+
+    def stop(self):
+        """停止线程并释放视频源"""
+        self._running.clear()
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+        if self._capture is not None and hasattr(self._capture, 'release'):
+            self._capture.release()
+        self._capture = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def running(self) -> bool:
+        """线程是否仍在运行(视频文件读完后自动结束)"""
+        return any(thread.is_alive() for thread in self._threads)
+
+    def set_style(self, style: str, **style_kwargs):
+        """运行中切换风格(下一帧生效)"""
+        if style not in STYLES:
+            raise ValueError(f"未知的素描风格: {style}")
+        self.style, self.style_kwargs = style, style_kwargs
+
+    # ===== 采集 =====
+
+    def _capture_loop(self):
+        interval = 0.0
+        if self.realtime and hasattr(self._capture, 'get'):
+            fps = self._capture.get(cv2.CAP_PROP_FPS) or 0
+            interval = 1.0 / fps if fps > 0 else 1.0 / self.target_fps
+        next_time = time.perf_counter()
+
+        while self._running.is_set():
+            # 复用后台缓冲: VideoCapture.read(image)直接解码到已有数组
+            if self._back is not None and isinstance(self._capture, cv2.VideoCapture):
+                ok, frame = self._capture.read(self._back)
+            else:
+                ok, frame = self._capture.read()
+            if not ok or frame is None:
+                break
+            captured_at = time.perf_counter()
+            if self._ready_time:
+                # 源的实际帧间隔(指数平均): 源帧率低于目标帧率时按源帧率计算帧预算
+                gap = captured_at - self._ready_time
+                self._capture_interval = gap if self._capture_interval is None else (
+                    0.1 * gap + 0.9 * self._capture_interval)
+            with self._cond:
+                self._back, self._ready = self._ready, frame
+                self._ready_time = captured_at
+                if self._fresh:
+                    # 上一帧还没被处理线程取走,被这一帧覆盖
+                    self._dropped += 1
+                self._fresh = True
+                self._captured += 1
+                self._cond.notify()
+
+            if interval:
+                next_time += interval
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_time = time.perf_counter()
+
+        with self._cond:
+            self._source_done = True
+            self._cond.notify_all()
+
+    # ===== 处理 =====
+
+    def _sketcher(self, frame: np.ndarray) -> FrameSketcher:
+        """当前档位的渲染器(分辨率由输入尺寸、宽度上限和档位决定)"""
+        height, width = frame.shape[:2]
+        scale = min(1.0, self.max_width / width) * self.levels[self._level]
+        size = (max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2))
+        sketcher = self._sketchers.get(size)
+        if sketcher is None:
+            sketcher = self._sketchers[size] = FrameSketcher(*size)
+        return sketcher
+
+    def _adapt(self, process_seconds: float):
+        """按处理耗时的指数平均调整分辨率档位"""
+        alpha = 0.2
+        self._process_ewma = process_seconds if self._process_ewma is None else (
+            alpha * process_seconds + (1 - alpha) * self._process_ewma)
+        self._frames_since_adjust += 1
+        if self._frames_since_adjust < self.ADJUST_COOLDOWN:
+            return
+        budget = max(1.0 / self.target_fps, self._capture_interval or 0.0)
+        if self._process_ewma > budget * self.DOWNSCALE_RATIO and self._level < len(self.levels) - 1:
+            self._level += 1
+        elif self._process_ewma < budget * self.UPSCALE_RATIO and self._level > 0:
+            self._level -= 1
+        else:
+            return
+        self._frames_since_adjust = 0
+        # 换档后耗时会变化,从新档位重新计算
+        self._process_ewma = None
+
+    def _process_loop(self):
+        budget = 1.0 / self.target_fps
+        next_due = time.perf_counter()
+        while self._running.is_set():
+            with self._cond:
+                while not self._fresh and not self._source_done and self._running.is_set():
+                    self._cond.wait(0.5)
+                if not self._fresh:
+                    break
+                self._front, self._ready = self._ready, self._front
+                captured_at = self._ready_time
+                self._fresh = False
+            frame = self._front
+
+            start = time.perf_counter()
+            result = self._sketcher(frame).render(frame, self.style, self.mirror, **self.style_kwargs)
+            # 输出双缓冲: 复制到非当前可读的那一个
+            index = 1 - self._output_index
+            output = self._outputs[index]
+            if output is None or output.shape != result.shape:
+                output = self._outputs[index] = np.empty_like(result)
+            np.copyto(output, result)
+            done = time.perf_counter()
+            with self._output_lock:
+                self._output_index = index
+                self._output_id += 1
+
+            self._record(done, done - captured_at, done - start)
+            self._adapt(done - start)
+
+            # 不超过目标帧率: 源帧率更高时多出的帧被丢弃
+            next_due = max(next_due + budget, done)
+            delay = next_due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        self._running.clear()
+
+    # ===== 输出与统计 =====
+
+    def read(self) -> Tuple[int, Optional[np.ndarray]]:
+        """
+        最新的素描帧
+
+        Returns:
+            (帧序号, 图像): 尚无输出时为(0, None);图像在下一帧完成前有效,需长期保留时请复制
+        """
+        with self._output_lock:
+            return self._output_id, self._outputs[self._output_index]
+
+    def _record(self, done: float, latency: float, process_seconds: float):
+        with self._stats_lock:
+            self._processed += 1
+            self._done_times.append(done)
+            self._latencies.append(latency)
+            self._process_times.append(process_seconds)
+            while self._done_times and done - self._done_times[0] > self.STATS_WINDOW:
+                self._done_times.popleft()
+                self._latencies.popleft()
+                self._process_times.popleft()
+
+    def stats(self) -> dict:
+        """
+        运行统计(最近STATS_WINDOW秒)
+
+        Returns:
+            dict: {'fps', 'target_fps', 'latency_ms': {p50, p95}, 'process_ms': {p50, p95},
+                   'captured', 'processed', 'dropped', 'scale', 'resolution', 'style'}
+        """
+        with self._stats_lock:
+            times = list(self._done_times)
+            latencies = [v * 1000 for v in self._latencies]
+            process_times = [v * 1000 for v in self._process_times]
+            captured, processed, dropped = self._captured, self._processed, self._dropped
+        fps = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else 0.0
+        _, output = self.read()
+
+        def summary(values):
+            return {'p50': round(percentile(values, 50) or 0, 1), 'p95': round(percentile(values, 95) or 0, 1)}
+
+        return {
+            'fps': round(fps, 1),
+            'target_fps': self.target_fps,
+            'latency_ms': summary(latencies),
+            'process_ms': summary(process_times),
+            'captured': captured,
+            'processed': processed,
+            'dropped': dropped,
+            'scale': self.levels[self._level],
+            'resolution': f'{output.shape[1]}x{output.shape[0]}' if output is not None else None,
+            'style': self.style,
+        }
+
+
+def main():
+    """测试函数: 窗口显示实时素描(q退出,1-4切换风格),或无窗口运行并打印统计"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='实时素描模式')
+    parser.add_argument('source', nargs='?', default='0', help='摄像头编号或视频路径')
+    parser.add_argument('--style', default='pencil', choices=STYLES)
+    parser.add_argument('--fps', type=float, default=None, help='目标帧率')
+    parser.add_argument('--max-width', type=int, default=None, help='处理分辨率宽度上限')
+    parser.add_argument('--headless', action='store_true', help='不显示窗口,只打印统计')
+    parser.add_argument('--seconds', type=float, default=10, help='无窗口模式的运行时长')
+    args = parser.parse_args()
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    live = LiveSketch(source, args.style, target_fps=args.fps, max_width=args.max_width).start()
+    try:
+        if args.headless:
+            end = time.time() + args.seconds
+            while time.time() < end and live.running:
+                time.sleep(1)
+                print(f"📊 {live.stats()}")
+        else:
+            last_id = 0
+            while live.running:
+                frame_id, frame = live.read()
+                if frame_id != last_id:
+                    last_id = frame_id
+                    stats = live.stats()
+                    cv2.imshow('live sketch', frame)
+                    cv2.setWindowTitle('live sketch', f"{stats['style']} {stats['fps']}fps "
+                                       f"{stats['latency_ms']['p50']}ms {stats['resolution']}")
+                key = cv2.waitKey(5) & 0xFF
+                if key == ord('q'):
+                    break
+                if ord('1') <= key <= ord('4'):
+                    live.set_style(STYLES[key - ord('1')])
+            cv2.destroyAllWindows()
+    finally:
+        live.stop()
+    print(f"✅ 结束: {live.stats()}")
+
+
+if __name__ == '__main__':
+    main()
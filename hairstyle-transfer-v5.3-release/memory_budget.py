@@ -0,0 +1,522 @@
+#!/usr/bin/env python3
+"""
+内存预算准入控制
+每个请求在解码前按上传图尺寸(只读文件头)和各处理阶段的每像素占用估算内存,
+工作进程内所有进行中请求的估算之和不超过预算: 超出时排队等待,
+队列已满或等待超时则直接拒绝(503 + Retry-After),避免并发大图把进程推向OOM。
+可按比例抽样用tracemalloc测量实际峰值,与估算一起按路由统计。
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+from PIL import Image
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    # Windows没有resource模块,统计中不含进程峰值RSS
+    RESOURCE_AVAILABLE = False
+
+
+MB = 1024 * 1024
+
+# 各处理阶段的每像素内存占用(字节)
+STAGE_FOOTPRINTS = {
+    # 上传图解码(BGR uint8)
+    'decode': 3,
+    # 人脸预检的RGB副本 + 各上游规格的缩放副本(均不超过原图大小)
+    'preprocess': 6,
+    # 结果下载缓冲(压缩后约1字节/像素) + 解码 + 保存时的编码缓冲
+    'result': 7,
+    # 本地素描降级: 灰度/反相/模糊的float32中间结果
+    'sketch': 16,
+    # 多规格结果图: 重新解码 + 各尺寸缩放副本
+    'renditions': 6,
+    # DZI瓦片(后台): 重新解码(BGRA) + 去alpha副本 + 逐级缩小的副本(合计约1/3)
+    'tiles': 9,
+}
+
+# 路由 -> (上传图经历的阶段, 结果图经历的阶段, 结果图对应的上游规格)
+ROUTE_STAGES = {
+    'extract': (('decode', 'preprocess'), ('result',), 'imageseg'),
+    'transfer': (('decode', 'preprocess'), ('result', 'sketch', 'renditions'), 'facebody'),
+}
+
+# 与像素无关的固定开销: 表单解析、SDK响应、Python对象等
+REQUEST_BASE_BYTES = 16 * MB
+
+
+def image_dimensions(stream) -> Optional[Tuple[int, int]]:
+    """
+    只读文件头获取图像尺寸(不解码像素),读取后把流位置复原
+
+    Returns:
+        (width, height),无法识别时返回None
+    """
+    try:
+        position = stream.tell()
+        try:
+            with Image.open(stream) as image:
+                return image.size
+        finally:
+            stream.seek(position)
+    except Exception:
+        return None
+
+
+def _fit_edge(width: int, height: int, max_edge: int) -> Tuple[int, int]:
+    """长边不超过max_edge时的尺寸"""
+    scale = min(1.0, max_edge / max(width, height, 1))
+    return int(width * scale), int(height * scale)
+
+
+def estimate_request(route: str, dimensions: Iterable[Tuple[int, int]], body_bytes: int = 0) -> Dict[str, int]:
+    """
+    估算一次请求的峰值内存
+
+    Args:
+        route: 路由名(见ROUTE_STAGES)
+        dimensions: 各上传图的 (width, height)
+        body_bytes: 请求体大小(上传内容在请求期间一直保留)
+
+    Returns:
+        dict: {阶段名: 字节数, 'total': 合计}
+    """
+    upload_stages, result_stages, result_profile = ROUTE_STAGES[route]
+    try:
+        from image_preprocessor import ImagePreprocessor
+        result_edge = ImagePreprocessor.PROFILES[result_profile]['max_edge']
+    except ImportError:
+        result_edge = 2000
+
+    estimate = {'base': REQUEST_BASE_BYTES + body_bytes}
+    for width, height in dimensions:
+        for stage in upload_stages:
+            estimate[stage] = estimate.get(stage, 0) + width * height * STAGE_FOOTPRINTS[stage]
+        # 结果图尺寸跟随送往上游的规格
+        result_width, result_height = _fit_edge(width, height, result_edge)
+        for stage in result_stages:
+            estimate[stage] = estimate.get(stage, 0) + result_width * result_height * STAGE_FOOTPRINTS[stage]
+    estimate['total'] = sum(estimate.values())
+    return estimate
+
+
+def default_budget_bytes() -> int:
+    """
+    默认预算: 容器内存上限(cgroup)或物理内存的一半,再按工作进程数(WEB_CONCURRENCY)均分
+    """
+    limit = None
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+            if value.isdigit() and int(value) < 1 << 60:
+                limit = int(value)
+                break
+        except OSError:
+            continue
+    if limit is None:
+        try:
+            limit = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        except (ValueError, OSError, AttributeError):
+            limit = 2048 * MB
+    workers = max(1, int(os.getenv('WEB_CONCURRENCY', '1')))
+    return limit // 2 // workers
+
+
+class MemoryBudgetExceeded(Exception):
+    """内存预算不足且无法排队(队列已满或等待超时)"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Reservation:
+    """一次已准入请求占用的预算"""
+
+    def __init__(self, route: str, estimate: int, reserved: int, waited: float, sampled: bool):
+        self.route = route
+        self.estimate = estimate
+        self.reserved = reserved
+        self.waited = waited
+        self.sampled = sampled
+        self.started = time.time()
+        self.trace_base = 0
+        # 抽样期间有其他请求进入: tracemalloc是进程级的,峰值不再只属于本请求
+        self.trace_shared = False
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Waiter:
+    """排队中的请求;协程等待者记录事件循环,每次预算变化时唤醒重新检查"""
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.future = None
+
+    def wake(self):
+        if self.future is not None and not self.future.done():
+            try:
+                self.loop.call_soon_threadsafe(_wake, self.future)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+
+class _RouteStats:
+    """单个路由的累计统计"""
+
+    def __init__(self):
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.wait_seconds = 0.0
+        self.duration_seconds = 0.0
+        self.finished = 0
+        self.estimate_sum = 0
+        self.estimate_max = 0
+        self.sampled = 0
+        self.sample_discarded = 0
+        self.peak_sum = 0
+        self.peak_max = 0
+        self.ratio_sum = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'shed': self.shed,
+            'avg_wait_ms': round(self.wait_seconds / self.admitted * 1000, 1) if self.admitted else None,
+            'avg_duration_s': round(self.duration_seconds / self.finished, 2) if self.finished else None,
+            'avg_estimate_mb': round(self.estimate_sum / self.admitted / MB, 1) if self.admitted else None,
+            'max_estimate_mb': round(self.estimate_max / MB, 1),
+            'sampled': self.sampled,
+            'sample_discarded': self.sample_discarded,
+            'avg_peak_mb': round(self.peak_sum / self.sampled / MB, 1) if self.sampled else None,
+            'max_peak_mb': round(self.peak_max / MB, 1),
+            # 实测峰值/估算,持续大于1说明STAGE_FOOTPRINTS偏小
+            'peak_to_estimate': round(self.ratio_sum / self.sampled, 2) if self.sampled else None,
+        }
+
+
+class MemoryBudget:
+    """工作进程内的内存预算(线程安全,按到达顺序准入)"""
+
+    DEFAULT_QUEUE_TIMEOUT = 10.0
+    DEFAULT_MAX_QUEUE = 16
+    DEFAULT_RETRY_AFTER = 5
+
+    def __init__(
+        self,
+        budget_bytes: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+        max_queue: Optional[int] = None,
+        sample_rate: Optional[float] = None
+    ):
+        """
+        初始化
+
+        Args:
+            budget_bytes: 预算字节数,默认环境变量MEMORY_BUDGET_MB或default_budget_bytes()
+            queue_timeout: 最长排队秒数,默认环境变量MEMORY_QUEUE_TIMEOUT或10
+            max_queue: 最多排队请求数,默认环境变量MEMORY_MAX_QUEUE或16
+            sample_rate: tracemalloc抽样比例(0~1),默认环境变量MEMORY_TRACE_SAMPLE或0(不抽样)
+        """
+        if budget_bytes is None:
+            budget_mb = os.getenv('MEMORY_BUDGET_MB')
+            budget_bytes = int(budget_mb) * MB if budget_mb else default_budget_bytes()
+        self.budget = budget_bytes
+        self.queue_timeout = queue_timeout if queue_timeout is not None else float(
+            os.getenv('MEMORY_QUEUE_TIMEOUT', self.DEFAULT_QUEUE_TIMEOUT))
+        self.max_queue = max_queue if max_queue is not None else int(
+            os.getenv('MEMORY_MAX_QUEUE', self.DEFAULT_MAX_QUEUE))
+        self.sample_rate = sample_rate if sample_rate is not None else float(
+            os.getenv('MEMORY_TRACE_SAMPLE', '0'))
+
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._reserved = 0
+        self._in_flight = 0
+        self._routes = {}
+        self._sample_counter = 0.0
+        self._tracing = None
+
+    def _route(self, route: str) -> _RouteStats:
+        stats = self._routes.get(route)
+        if stats is None:
+            stats = self._routes[route] = _RouteStats()
+        return stats
+
+    def _retry_after(self, stats: _RouteStats) -> int:
+        """建议的重试等待秒数: 该路由的平均处理时长"""
+        if not stats.finished:
+            return self.DEFAULT_RETRY_AFTER
+        return max(1, math.ceil(stats.duration_seconds / stats.finished))
+
+    def _should_sample(self) -> bool:
+        """
+        按比例抽样
+
+        tracemalloc统计的是整个进程的分配,只在没有其他进行中请求时开始抽样;
+        抽样期间有其他请求进入时该样本作废(见release),峰值只反映单个请求
+        """
+        if self.sample_rate <= 0 or self._tracing is not None or self._in_flight > 0:
+            return False
+        self._sample_counter += self.sample_rate
+        if self._sample_counter < 1:
+            return False
+        self._sample_counter -= 1
+        return True
+
+    def _fits(self, reserved: int) -> bool:
+        return self._reserved + reserved <= self.budget or self._in_flight == 0
+
+    def _ready(self, waiter: _Waiter, reserved: int) -> bool:
+        # 按到达顺序准入,避免大图请求被源源不断的小图请求饿死
+        return self._waiting[0] is waiter and self._fits(reserved)
+
+    def _notify(self):
+        """预算或队列变化: 唤醒线程等待者和协程等待者(需持有锁)"""
+        self._cond.notify_all()
+        for waiter in self._waiting:
+            if waiter.loop is not None:
+                waiter.wake()
+
+    def _enqueue(self, stats: _RouteStats, loop=None) -> _Waiter:
+        """
+        排队(需持有锁)
+
+        Raises:
+            MemoryBudgetExceeded: 队列已满
+        """
+        if len(self._waiting) >= self.max_queue:
+            stats.shed += 1
+            raise MemoryBudgetExceeded('服务繁忙(内存预算已满),请稍后重试', self._retry_after(stats))
+        waiter = _Waiter(loop)
+        self._waiting.append(waiter)
+        stats.queued += 1
+        return waiter
+
+    def _dequeue(self, waiter: _Waiter):
+        self._waiting.remove(waiter)
+        self._notify()
+
+    def _timed_out(self, stats: _RouteStats) -> MemoryBudgetExceeded:
+        stats.shed += 1
+        return MemoryBudgetExceeded('服务繁忙(等待内存预算超时),请稍后重试', self._retry_after(stats))
+
+    def _admit(self, route: str, estimate: int, reserved: int, start: float) -> Reservation:
+        """记入预算并创建占用(需持有锁)"""
+        stats = self._route(route)
+        sampled = self._should_sample()
+        if self._tracing is not None:
+            self._tracing.trace_shared = True
+        self._reserved += reserved
+        self._in_flight += 1
+        stats.admitted += 1
+        stats.estimate_sum += estimate
+        stats.estimate_max = max(stats.estimate_max, estimate)
+        wait_seconds = time.time() - start
+        stats.wait_seconds += wait_seconds
+        reservation = Reservation(route, estimate, reserved, wait_seconds, sampled)
+        if sampled:
+            self._tracing = reservation
+        return reservation
+
+    def _started(self, reservation: Reservation, waited: bool) -> Reservation:
+        if waited:
+            print(f"⏳ 内存预算排队 {reservation.waited * 1000:.0f}ms: "
+                  f"{reservation.route} ({reservation.estimate / MB:.0f}MB)")
+        if reservation.sampled:
+            tracemalloc.start()
+            reservation.trace_base = tracemalloc.get_traced_memory()[0]
+        return reservation
+
+    def acquire(self, route: str, estimate: int) -> Reservation:
+        """
+        申请预算,不足时排队
+
+        超过整个预算的单个请求只在没有其他请求占用时准入(独占运行)
+
+        Args:
+            route: 路由名
+            estimate: 估算字节数
+
+        Returns:
+            Reservation: 用完后交给release()
+
+        Raises:
+            MemoryBudgetExceeded: 队列已满或等待超时
+        """
+        reserved = min(estimate, self.budget)
+        start = time.time()
+        with self._cond:
+            if not self._waiting and self._fits(reserved):
+                return self._started(self._admit(route, estimate, reserved, start), False)
+
+            stats = self._route(route)
+            waiter = self._enqueue(stats)
+            deadline = start + self.queue_timeout
+            try:
+                while not self._ready(waiter, reserved):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise self._timed_out(stats)
+                    self._cond.wait(remaining)
+            finally:
+                self._dequeue(waiter)
+            reservation = self._admit(route, estimate, reserved, start)
+
+        return self._started(reservation, True)
+
+    async def acquire_async(self, route: str, estimate: int) -> Reservation:
+        """
+        申请预算(协程版,参数与返回值同acquire)
+
+        排队期间不占用线程,预算变化时通过call_soon_threadsafe唤醒后重新检查
+
+        Raises:
+            MemoryBudgetExceeded: 队列已满或等待超时
+        """
+        reserved = min(estimate, self.budget)
+        start = time.time()
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if not self._waiting and self._fits(reserved):
+                return self._started(self._admit(route, estimate, reserved, start), False)
+            stats = self._route(route)
+            waiter = self._enqueue(stats, loop)
+
+        deadline = start + self.queue_timeout
+        try:
+            while True:
+                with self._cond:
+                    if self._ready(waiter, reserved):
+                        self._dequeue(waiter)
+                        waiter = None
+                        reservation = self._admit(route, estimate, reserved, start)
+                        break
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise self._timed_out(stats)
+                    waiter.future = loop.create_future()
+                try:
+                    await asyncio.wait_for(waiter.future, remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # 超时或客户端断开(CancelledError)时退出队列
+            if waiter is not None:
+                with self._cond:
+                    self._dequeue(waiter)
+
+        return self._started(reservation, True)
+
+    def release(self, reservation: Reservation):
+        """归还预算并记录处理时长与抽样峰值"""
+        peak = None
+        if reservation.sampled:
+            _, traced_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            peak = max(0, traced_peak - reservation.trace_base)
+
+        with self._cond:
+            self._reserved -= reservation.reserved
+            self._in_flight -= 1
+            stats = self._route(reservation.route)
+            stats.finished += 1
+            stats.duration_seconds += time.time() - reservation.started
+            if peak is not None:
+                self._tracing = None
+                if reservation.trace_shared:
+                    stats.sample_discarded += 1
+                else:
+                    stats.sampled += 1
+                    stats.peak_sum += peak
+                    stats.peak_max = max(stats.peak_max, peak)
+                    stats.ratio_sum += peak / max(reservation.estimate, 1)
+            self._notify()
+
+    @contextmanager
+    def reserve(self, route: str, estimate: int):
+        """acquire/release的上下文管理器形式"""
+        reservation = self.acquire(route, estimate)
+        try:
+            yield reservation
+        finally:
+            self.release(reservation)
+
+    def stats(self) -> dict:
+        """预算占用与各路由统计"""
+        with self._cond:
+            stats = {
+                'budget_mb': round(self.budget / MB, 1),
+                'reserved_mb': round(self._reserved / MB, 1),
+                'in_flight': self._in_flight,
+                'waiting': len(self._waiting),
+                'sample_rate': self.sample_rate,
+                'routes': {name: route.to_dict() for name, route in self._routes.items()},
+            }
+        if RESOURCE_AVAILABLE:
+            # Linux下ru_maxrss单位为KB
+            stats['process_peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        return stats
+
+
+_memory_budget = None
+_memory_budget_lock = threading.Lock()
+
+
+def get_memory_budget() -> MemoryBudget:
+    """
+    获取工作进程的内存预算(懒加载)
+
+    环境变量:
+        MEMORY_BUDGET_MB: 预算(MB),默认为内存上限的一半按WEB_CONCURRENCY均分
+        MEMORY_QUEUE_TIMEOUT: 最长排队秒数,默认10
+        MEMORY_MAX_QUEUE: 最多排队请求数,默认16
+        MEMORY_TRACE_SAMPLE: tracemalloc抽样比例,默认0(只抽样进程内没有其他请求时的请求)
+    """
+    global _memory_budget
+    with _memory_budget_lock:
+        if _memory_budget is None:
+            _memory_budget = MemoryBudget()
+        return _memory_budget
+
+
+def main():
+    """测试函数: 估算一张图在各路由下的内存占用"""
+    import sys
+
+    if len(sys.argv) < 2:
+        print("用法: python memory_budget.py <图片路径>")
+        return
+    with open(sys.argv[1], 'rb') as f:
+        dimensions = image_dimensions(f)
+    if dimensions is None:
+        print("❌ 无法识别图像")
+        return
+    print(f"📐 尺寸: {dimensions[0]}x{dimensions[1]}")
+    for route in ROUTE_STAGES:
+        estimate = estimate_request(route, [dimensions], os.path.getsize(sys.argv[1]))
+        stages = ', '.join(f'{name} {size / MB:.1f}MB' for name, size in estimate.items() if name != 'total')
+        print(f"   {route}: {estimate['total'] / MB:.1f}MB ({stages})")
+    print(f"   工作进程预算: {get_memory_budget().budget / MB:.0f}MB")
+
+
+if __name__ == '__main__':
+    main()
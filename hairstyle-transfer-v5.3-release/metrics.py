@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+统计工具
+调度器、实时素描、批量处理和压测共用的百分位计算
+"""
+
+from typing import Iterable, Optional
+
+
+def percentile(values: Iterable[float], pct: float, default: Optional[float] = None) -> Optional[float]:
+    """
+    最近秩法计算百分位
+
+    Args:
+        values: 样本
+        pct: 百分位(0-100)
+        default: 没有样本时的返回值
+
+    Returns:
+        样本中排在该百分位的值
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return default
+    rank = max(1, int(round(pct / 100.0 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
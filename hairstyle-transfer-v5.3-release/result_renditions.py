@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+结果图多规格输出
+为融合结果/素描图生成 预览图、屏幕尺寸图(WebP + JPEG)、原图 和 放大查看用的DZI瓦片,
+文件名带内容哈希,可配合强ETag与immutable缓存头长期缓存
+"""
+
+import hashlib
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from file_hash import compute_file_hash
+
+try:
+    from tile_pyramid import TilePyramid
+    TILES_AVAILABLE = True
+except ImportError as e:
+    TILES_AVAILABLE = False
+    TilePyramid = None
+    print(f"⚠️  瓦片金字塔不可用: {e}")
+
+
+class ResultRenditions:
+    """结果图多规格生成器"""
+
+    # 规格名 -> 长边像素
+    SIZES = {
+        'preview': 480,
+        'screen': 1600,
+    }
+
+    # 格式 -> (扩展名, 编码参数)
+    FORMATS = {
+        'webp': ('.webp', [cv2.IMWRITE_WEBP_QUALITY, 80]),
+        'jpeg': ('.jpg', [cv2.IMWRITE_JPEG_QUALITY, 82, cv2.IMWRITE_JPEG_PROGRESSIVE, 1]),
+    }
+
+    DEFAULT_OUTPUT_DIR = 'static/renditions'
+    URL_PREFIX = '/renditions'
+
+    def __init__(self, output_dir: Optional[str] = None, workers: Optional[int] = None, tiles: bool = True):
+        """
+        初始化
+
+        Args:
+            output_dir: 输出目录,默认环境变量RENDITION_DIR或static/renditions
+            workers: 并行编码线程数,默认 min(4, CPU核数)
+            tiles: 是否(在后台)生成DZI瓦片金字塔
+        """
+        self.output_dir = output_dir or os.getenv('RENDITION_DIR', self.DEFAULT_OUTPUT_DIR)
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.tiles = tiles and TILES_AVAILABLE
+
+    @staticmethod
+    def etag_from_filename(filename: str) -> Optional[str]:
+        """从 name.<hash>.ext 形式的文件名中取出内容哈希作为ETag"""
+        parts = os.path.basename(filename).split('.')
+        return parts[-2] if len(parts) >= 3 else None
+
+    def _write(self, directory: str, name: str, ext: str, data: bytes) -> str:
+        """按内容哈希命名写出文件,返回文件名"""
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        filename = f'{name}.{digest}{ext}'
+        with open(os.path.join(directory, filename), 'wb') as f:
+            f.write(data)
+        return filename
+
+    def _encode(self, image: np.ndarray, long_edge: int, fmt: str) -> tuple:
+        """缩放并编码一个规格,返回 (宽, 高, 字节)"""
+        height, width = image.shape[:2]
+        scale = min(1.0, long_edge / max(height, width))
+        if scale < 1.0:
+            image = cv2.resize(
+                image,
+                (max(1, round(width * scale)), max(1, round(height * scale))),
+                interpolation=cv2.INTER_AREA
+            )
+        if image.ndim == 3 and image.shape[2] == 4 and fmt == 'jpeg':
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+
+        ext, params = self.FORMATS[fmt]
+        ok, buffer = cv2.imencode(ext, image, params)
+        if not ok:
+            raise ValueError(f"编码失败: {fmt}")
+        return image.shape[1], image.shape[0], buffer.tobytes()
+
+    def generate(self, image_path: str, executor: Optional[ThreadPoolExecutor] = None) -> Dict[str, dict]:
+        """
+        为一张结果图生成全部规格
+
+        Args:
+            image_path: 结果图路径(PNG)
+            executor: 共享的线程池(批量生成时使用)
+
+        Returns:
+            dict: {规格名: {'width', 'height', 格式: URL}},另含 'original'
+        """
+        image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError(f"无法读取图像: {image_path}")
+
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        directory = os.path.join(self.output_dir, stem)
+        os.makedirs(directory, exist_ok=True)
+
+        # 各规格/格式的缩放与编码互不依赖,OpenCV释放GIL,可在线程中并行
+        jobs = [(name, fmt) for name in self.SIZES for fmt in self.FORMATS]
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            futures = [executor.submit(self._encode, image, self.SIZES[name], fmt) for name, fmt in jobs]
+            encoded = [future.result() for future in futures]
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+        renditions = {}
+        for (name, fmt), (width, height, data) in zip(jobs, encoded):
+            filename = self._write(directory, name, self.FORMATS[fmt][0], data)
+            entry = renditions.setdefault(name, {'width': width, 'height': height})
+            entry[fmt] = f'{self.URL_PREFIX}/{stem}/{filename}'
+            entry[f'{fmt}_bytes'] = len(data)
+
+        # 原图: 按内容哈希命名的硬链接(不支持时复制),同样可长期缓存
+        digest = compute_file_hash(image_path)[:16]
+        ext = os.path.splitext(image_path)[1]
+        original_name = f'original.{digest}{ext}'
+        original_path = os.path.join(directory, original_name)
+        if not os.path.exists(original_path):
+            try:
+                os.link(image_path, original_path)
+            except OSError:
+                shutil.copyfile(image_path, original_path)
+        renditions['original'] = {
+            'width': image.shape[1],
+            'height': image.shape[0],
+            ext.lstrip('.'): f'{self.URL_PREFIX}/{stem}/{original_name}',
+            f"{ext.lstrip('.')}_bytes": os.path.getsize(image_path),
+        }
+
+        # DZI瓦片: 后台生成,.dzi描述文件最后写出,前端取不到时退回原图
+        if self.tiles:
+            pyramid = TilePyramid()
+            name = f'tiles.{digest}'
+            if not os.path.exists(os.path.join(directory, f'{name}.dzi')):
+                pyramid.generate_background(original_path, directory, name)
+            renditions['tiles'] = {
+                'dzi': f'{self.URL_PREFIX}/{stem}/{name}.dzi',
+                'width': image.shape[1],
+                'height': image.shape[0],
+                'tile_size': pyramid.tile_size,
+                'overlap': pyramid.overlap,
+                'format': pyramid.tile_format,
+            }
+        return renditions
+
+    def generate_many(self, image_paths: List[str]) -> List[Dict[str, dict]]:
+        """并行生成多张结果图(如融合结果+素描)的全部规格"""
+        if len(image_paths) <= 1:
+            return [self.generate(path) for path in image_paths]
+        # 外层按图片并行(读取/哈希/写文件),内层共享编码线程池
+        with ThreadPoolExecutor(max_workers=self.workers) as encoder, \
+                ThreadPoolExecutor(max_workers=len(image_paths)) as outer:
+            return list(outer.map(lambda path: self.generate(path, encoder), image_paths))
+
+
+def main():
+    """测试函数"""
+    import sys
+    import json
+
+    if len(sys.argv) < 2:
+        print("用法: python result_renditions.py <结果图路径> [...]")
+        return
+
+    renditions = ResultRenditions().generate_many(sys.argv[1:])
+    print(json.dumps(renditions, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
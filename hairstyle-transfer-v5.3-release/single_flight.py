@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+相同上游调用合并(single-flight)
+多位发型师同时选中同一热门发型时,相同内容的 OSS上传 / 创建融合模板 / 头发分割
+只向上游发出一次请求,其余并发调用等待并共享结果:
+- 同一进程内: 按 (操作, 内容哈希) 合并,跟随线程等待领头线程的结果
+- 多个工作进程间: 通过本地锁文件(fcntl)串行化,领头进程把结果写入JSON,
+  等待期间完成的结果直接复用,不再重复调用
+- 异步服务模式: 同一事件循环内的协程共享一次执行(do_async)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    # Windows等平台没有fcntl,退化为仅进程内合并
+    FCNTL_AVAILABLE = False
+
+
+class _Call:
+    """一次进行中的调用"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.shared = 0
+
+
+class SingleFlight:
+    """按 (操作, 键) 合并并发的相同调用"""
+
+    DEFAULT_LOCK_DIR = 'instance/single_flight'
+    # 锁文件/结果文件的保留时间(秒),超过后清理
+    FILE_MAX_AGE = 3600
+    PRUNE_EVERY = 200
+
+    def __init__(self, lock_dir: Optional[str] = None, cross_process: bool = True):
+        """
+        初始化
+
+        Args:
+            lock_dir: 锁文件与结果文件目录,默认环境变量SINGLE_FLIGHT_DIR或instance/single_flight
+            cross_process: 是否跨进程合并(需要fcntl)
+        """
+        self.lock_dir = lock_dir or os.getenv('SINGLE_FLIGHT_DIR', self.DEFAULT_LOCK_DIR)
+        self.cross_process = cross_process and FCNTL_AVAILABLE
+        if self.cross_process:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        self._counters = {'leader': 0, 'shared_thread': 0, 'shared_async': 0, 'shared_process': 0, 'errors': 0}
+        self._since_prune = 0
+
+    def _file_stem(self, operation: str, key: str) -> str:
+        digest = hashlib.sha256(f'{operation}\0{key}'.encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.lock_dir, f'{operation}.{digest}')
+
+    def _count(self, name: str, delta: int = 1):
+        with self._lock:
+            self._counters[name] += delta
+
+    def do(self, operation: str, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        执行调用,相同 (operation, key) 的并发调用共享一次执行结果
+
+        Args:
+            operation: 操作名,如 'oss_upload' / 'face_template' / 'segment_hair'
+            key: 输入内容哈希
+            fn: 实际调用(无参数)
+
+        Returns:
+            调用结果;领头调用抛出的异常会同样抛给本进程内的跟随者
+        """
+        call_key = (operation, key)
+        with self._lock:
+            call = self._calls.get(call_key)
+            if call is not None:
+                call.shared += 1
+                leader = False
+            else:
+                call = self._calls[call_key] = _Call()
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            self._count('shared_thread')
+            print(f"🔗 合并相同请求: {operation} ({key[:12]})")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_cross_process(operation, key, fn)
+        except Exception as e:
+            call.error = e
+            self._count('errors')
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(call_key, None)
+            call.done.set()
+        return call.result
+
+    async def do_async(self, operation: str, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        协程版: 同一事件循环内相同 (operation, key) 的并发调用共享一次执行结果
+
+        异步服务为单进程,不做跨进程合并(锁文件会阻塞事件循环)
+
+        Args:
+            operation: 操作名
+            key: 输入内容哈希
+            fn: 返回协程的无参函数
+
+        Returns:
+            调用结果;领头协程抛出的异常会同样抛给跟随者
+        """
+        loop = asyncio.get_running_loop()
+        call_key = (id(loop), operation, key)
+        future = self._async_calls.get(call_key)
+        if future is not None:
+            self._count('shared_async')
+            print(f"🔗 合并相同请求: {operation} ({key[:12]})")
+            # shield: 跟随者被取消时不影响领头协程和其他跟随者
+            return await asyncio.shield(future)
+
+        future = self._async_calls[call_key] = loop.create_future()
+        self._count('leader')
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._count('errors')
+            if isinstance(e, Exception):
+                future.set_exception(e)
+            else:
+                future.cancel()
+            # 没有跟随者时避免"异常未被获取"的警告
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._async_calls.pop(call_key, None)
+
+    def _run_cross_process(self, operation: str, key: str, fn: Callable[[], Any]) -> Any:
+        """持有锁文件执行调用;等待期间其他进程已完成的结果直接复用"""
+        if not self.cross_process:
+            self._count('leader')
+            return fn()
+
+        stem = self._file_stem(operation, key)
+        result_path = f'{stem}.json'
+        waiting_since = time.time()
+
+        with self._lock_file(f'{stem}.lock') as lock_file:
+            try:
+                # 结果写于开始等待之后,说明是刚结束的同一次调用,不是过期结果
+                shared = self._read_result(result_path, waiting_since)
+                if shared is not None:
+                    self._count('shared_process')
+                    print(f"🔗 复用其他进程的结果: {operation} ({key[:12]})")
+                    return shared['value']
+
+                self._count('leader')
+                result = fn()
+                self._write_result(result_path, result)
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                self._maybe_prune()
+
+    @staticmethod
+    def _lock_file(path: str):
+        """
+        打开并锁定锁文件
+
+        锁定后确认路径仍指向同一个文件: 等待期间文件被清理并由其他进程重新创建时,
+        继续持有旧文件的锁不能互斥,需重新打开。锁定后更新修改时间,正在使用的锁文件不会被清理
+        """
+        while True:
+            lock_file = open(path, 'a+')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                current = os.stat(path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current == os.fstat(lock_file.fileno()).st_ino:
+                os.utime(lock_file.fileno())
+                return lock_file
+            lock_file.close()
+
+    @staticmethod
+    def _read_result(path: str, not_before: float) -> Optional[dict]:
+        try:
+            if os.path.getmtime(path) < not_before:
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_result(path: str, result: Any):
+        """写出结果供等待中的进程读取;无法JSON序列化的结果不共享"""
+        try:
+            data = json.dumps({'value': result}, ensure_ascii=False)
+        except (TypeError, ValueError):
+            return
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _maybe_prune(self):
+        """定期清理长时间未使用的锁文件和结果文件"""
+        with self._lock:
+            self._since_prune += 1
+            if self._since_prune < self.PRUNE_EVERY:
+                return
+            self._since_prune = 0
+
+        cutoff = time.time() - self.FILE_MAX_AGE
+        for name in os.listdir(self.lock_dir):
+            path = os.path.join(self.lock_dir, name)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                if name.endswith('.lock'):
+                    self._prune_lock(path, cutoff)
+                else:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _prune_lock(path: str, cutoff: float):
+        """删除未被持有的过期锁文件(持有者或等待者正在使用时跳过)"""
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            # 取得锁之前可能刚被使用过
+            if os.fstat(fd).st_mtime < cutoff:
+                os.remove(path)
+        finally:
+            os.close(fd)
+
+    def stats(self) -> dict:
+        """合并统计: 实际调用次数 / 进程内合并 / 跨进程复用"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['in_flight'] = len(self._calls) + len(self._async_calls)
+        total = stats['leader'] + stats['shared_thread'] + stats['shared_async'] + stats['shared_process']
+        stats['coalesce_rate'] = round(1 - stats['leader'] / total, 3) if total else None
+        stats['cross_process'] = self.cross_process
+        return stats
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """
+    获取全局合并器(懒加载)
+
+    环境变量:
+        SINGLE_FLIGHT_DIR: 锁文件目录,多个工作进程需指向同一目录
+        SINGLE_FLIGHT_CROSS_PROCESS: 设为0则只在进程内合并
+    """
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight(
+                cross_process=os.getenv('SINGLE_FLIGHT_CROSS_PROCESS', '1') != '0'
+            )
+        return _single_flight
+
+
+def main():
+    """测试函数: 8个线程同时发起相同调用,只应执行一次"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    calls = []
+
+    def slow_upload():
+        calls.append(1)
+        time.sleep(1)
+        return 'https://example.com/hairstyle.jpg'
+
+    flight = get_single_flight()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: flight.do('demo', 'same-content', slow_upload), range(8)))
+
+    print(f"\n✅ 结果: {set(results)}, 实际调用次数: {len(calls)}")
+    print(f"   统计: {flight.stats()}")
+
+
+if __name__ == '__main__':
+    main()
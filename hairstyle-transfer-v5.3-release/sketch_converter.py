@@ -4,17 +4,84 @@
 将图像转换为素描风格
 """
 
+import os
+import threading
+import time
+
 import cv2
 import numpy as np
-from typing import Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional, Tuple
+
+
+_finalize_executor = None
+_finalize_executor_lock = threading.Lock()
+
+
+def get_finalize_executor() -> ThreadPoolExecutor:
+    """
+    获取两阶段模式的后台完整渲染线程池(懒加载)
+
+    环境变量:
+        SKETCH_FINALIZE_WORKERS: 同时进行的完整渲染数,默认2
+    """
+    global _finalize_executor
+    with _finalize_executor_lock:
+        if _finalize_executor is None:
+            _finalize_executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv('SKETCH_FINALIZE_WORKERS', '2')),
+                thread_name_prefix='sketch-finalize'
+            )
+        return _finalize_executor
+
+
+class ProgressiveSketch:
+    """两阶段素描: 低分辨率预览立即可用,完整分辨率结果在后台渲染"""
+
+    def __init__(self, preview: np.ndarray, scale: float, elapsed_ms: float, future: Future):
+        self.preview = preview
+        # 预览相对于原图的缩放比例
+        self.scale = scale
+        # 预览耗时(毫秒)
+        self.elapsed_ms = elapsed_ms
+        self.future = future
+
+    def done(self) -> bool:
+        """完整结果是否已完成"""
+        return self.future.done()
+
+    def result(self, timeout: Optional[float] = None) -> np.ndarray:
+        """等待并返回完整分辨率结果"""
+        return self.future.result(timeout)
+
+    def add_done_callback(self, fn: Callable[[Future], None]):
+        """完整结果完成(或失败)时回调,参数为Future"""
+        self.future.add_done_callback(fn)
 
 
 class SketchConverter:
     """素描效果转换器"""
     
-    def __init__(self):
-        """初始化转换器"""
-        pass
+    # 分块处理配置: 超过该像素数自动按条带分块,控制峰值内存
+    TILE_MIN_PIXELS = 12 * 1000 * 1000
+    TILE_HEIGHT = 512
+    # Canny滞后阈值的边缘连接可跨越较远距离,额外加宽重叠区
+    CANNY_EXTRA_HALO = 32
+    # 两阶段模式的预览长边(像素),预览耗时与原图分辨率基本无关
+    PREVIEW_LONG_EDGE = 640
+    
+    STYLES = ('pencil', 'detailed', 'artistic', 'color')
+    
+    def __init__(self, tile_height: int = TILE_HEIGHT, tile_workers: Optional[int] = None):
+        """
+        初始化转换器
+        
+        Args:
+            tile_height: 分块模式下每个条带的高度(像素,不含重叠区)
+            tile_workers: 并行处理条带的线程数,默认与OpenCV线程数一致
+        """
+        self.tile_height = tile_height
+        self.tile_workers = tile_workers
     
     def to_grayscale(self, image: np.ndarray) -> np.ndarray:
         """
@@ -208,8 +275,10 @@ class SketchConverter:
         self,
         image: np.ndarray,
         style: str = 'pencil',
+        tiled: Optional[bool] = None,
+        preview: bool = False,
         **kwargs
-    ) -> np.ndarray:
+    ):
         """
         转换为素描效果(统一接口)
         
@@ -220,14 +289,193 @@ class SketchConverter:
                 - 'detailed': 细节素描
                 - 'artistic': 艺术素描
                 - 'color': 彩色素描
+            tiled: 是否分块处理,默认超过TILE_MIN_PIXELS时自动启用
+            preview: 两阶段模式: 先返回低分辨率预览,完整分辨率在后台渲染(见convert_progressive)
             **kwargs: 其他参数
         
         Returns:
-            sketch: 素描图像
+            sketch: 素描图像;preview=True时为ProgressiveSketch
         """
+        if preview:
+            return self.convert_progressive(image, style, tiled=tiled, **kwargs)
+        
         print(f"\n🎨 转换为素描效果")
         print(f"   风格: {style}")
         
+        if tiled is None:
+            tiled = image.shape[0] * image.shape[1] >= self.TILE_MIN_PIXELS
+        
+        if tiled and image.shape[0] > self.tile_height:
+            sketch = self.convert_tiled(image, style, **kwargs)
+        else:
+            sketch = self._render(image, style, **kwargs)
+        
+        print(f"✅ 素描转换完成")
+        
+        return sketch
+    
+    def scale_params(self, style: str, scale: float, **kwargs) -> dict:
+        """
+        按缩放比例调整风格参数: 模糊核尺寸与分辨率成正比,缩小后的预览与完整结果观感一致
+        
+        Args:
+            style: 素描风格
+            scale: 处理分辨率相对于原图的比例
+            **kwargs: 原图分辨率下的风格参数
+        
+        Returns:
+            dict: 调整后的风格参数
+        """
+        default_sigma = 15 if style == 'detailed' else 21
+        params = dict(kwargs)
+        params['blur_sigma'] = max(3, int(round(kwargs.get('blur_sigma', default_sigma) * scale)))
+        return params
+    
+    def convert_preview(
+        self,
+        image: np.ndarray,
+        style: str = 'pencil',
+        long_edge: Optional[int] = None,
+        **kwargs
+    ) -> Tuple[np.ndarray, float]:
+        """
+        低分辨率预览: 缩小到长边long_edge后按比例调整参数再转换
+        
+        Args:
+            image: 输入图像
+            style: 素描风格
+            long_edge: 预览长边,默认PREVIEW_LONG_EDGE
+            **kwargs: 原图分辨率下的风格参数
+        
+        Returns:
+            (preview, scale): 预览图像和缩放比例(原图不大于long_edge时为原图结果, scale=1.0)
+        """
+        long_edge = long_edge or self.PREVIEW_LONG_EDGE
+        height, width = image.shape[:2]
+        scale = min(1.0, long_edge / max(height, width))
+        if scale < 1.0:
+            image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+        return self._render(image, style, **self.scale_params(style, scale, **kwargs)), scale
+    
+    def convert_progressive(
+        self,
+        image: np.ndarray,
+        style: str = 'pencil',
+        tiled: Optional[bool] = None,
+        preview_edge: Optional[int] = None,
+        **kwargs
+    ) -> ProgressiveSketch:
+        """
+        两阶段转换: 立即返回低分辨率预览,完整分辨率结果提交到后台线程池
+        
+        浏览风格时只需等待预览,完整结果完成后再替换显示
+        
+        Args:
+            image: 输入图像(后台渲染期间不要修改)
+            style: 素描风格
+            tiled: 完整渲染是否分块处理(同convert)
+            preview_edge: 预览长边,默认PREVIEW_LONG_EDGE
+            **kwargs: 风格参数
+        
+        Returns:
+            ProgressiveSketch: preview为预览图像,result()等待完整结果
+        """
+        if style not in self.STYLES:
+            raise ValueError(f"未知的素描风格: {style}")
+        start = time.time()
+        preview, scale = self.convert_preview(image, style, preview_edge, **kwargs)
+        elapsed_ms = round((time.time() - start) * 1000, 1)
+        print(f"🎨 素描预览: {style}, {preview.shape[1]}x{preview.shape[0]}, {elapsed_ms}ms,完整分辨率后台渲染")
+        
+        if scale == 1.0:
+            # 原图不大于预览尺寸: 预览即完整结果
+            future = Future()
+            future.set_result(preview)
+        else:
+            future = get_finalize_executor().submit(self.convert, image, style, tiled, **kwargs)
+        return ProgressiveSketch(preview, scale, elapsed_ms, future)
+    
+    def tile_halo(self, style: str, **kwargs) -> int:
+        """
+        计算分块所需的重叠区(halo)高度
+        
+        重叠区覆盖模糊核半径及后续邻域运算,保证条带内部结果与整图处理一致
+        
+        Args:
+            style: 素描风格
+            **kwargs: 风格参数
+        
+        Returns:
+            halo: 上下各需扩展的行数
+        """
+        default_sigma = 15 if style == 'detailed' else 21
+        blur_sigma = kwargs.get('blur_sigma', default_sigma)
+        if blur_sigma % 2 == 0:
+            blur_sigma += 1
+        halo = blur_sigma // 2
+        
+        if style == 'artistic' and kwargs.get('sharpen', True):
+            halo += 1  # 3x3锐化核
+        elif style == 'detailed':
+            halo += self.CANNY_EXTRA_HALO
+        return halo
+    
+    def convert_tiled(
+        self,
+        image: np.ndarray,
+        style: str = 'pencil',
+        **kwargs
+    ) -> np.ndarray:
+        """
+        分块转换素描: 按带重叠区的水平条带并行处理
+        
+        只有输出图是整幅分配的,float32等中间结果只按条带大小分配,
+        峰值内存与输入尺寸基本无关
+        
+        Args:
+            image: 输入图像
+            style: 素描风格
+            **kwargs: 风格参数
+        
+        Returns:
+            sketch: 素描图像(与整图处理结果一致)
+        """
+        height = image.shape[0]
+        halo = self.tile_halo(style, **kwargs)
+        strips = [(y, min(y + self.tile_height, height)) for y in range(0, height, self.tile_height)]
+        workers = self.tile_workers or max(1, cv2.getNumThreads())
+        
+        print(f"   分块处理: {len(strips)}个条带, 重叠区={halo}px, 线程数={workers}")
+        
+        output = None
+        
+        def render_strip(bounds: Tuple[int, int]) -> None:
+            y0, y1 = bounds
+            top = max(0, y0 - halo)
+            bottom = min(height, y1 + halo)
+            strip = self._render(image[top:bottom], style, **kwargs)
+            output[y0:y1] = strip[y0 - top:y1 - top]
+        
+        # 先处理首个条带以确定输出形状(灰度或彩色)
+        y0, y1 = strips[0]
+        first = self._render(image[0:min(height, y1 + halo)], style, **kwargs)
+        output = np.empty((height,) + first.shape[1:], dtype=first.dtype)
+        output[y0:y1] = first[y0:y1]
+        del first
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(render_strip, strips[1:]))
+        
+        return output
+    
+    def _render(
+        self,
+        image: np.ndarray,
+        style: str,
+        **kwargs
+    ) -> np.ndarray:
+        """按风格分发到具体的素描算法"""
         if style == 'pencil':
             sketch = self.pencil_sketch(
                 image,
@@ -255,10 +503,24 @@ class SketchConverter:
         else:
             raise ValueError(f"未知的素描风格: {style}")
         
-        print(f"✅ 素描转换完成")
-        
         return sketch
     
+    def live(self, source=0, style: str = 'pencil', **kwargs):
+        """
+        实时素描模式: 摄像头/视频帧逐帧转换(见live_sketch.LiveSketch)
+        
+        Args:
+            source: 摄像头编号或视频路径
+            style: 素描风格
+            **kwargs: LiveSketch参数(target_fps、max_width、mirror等)和风格参数
+        
+        Returns:
+            LiveSketch: 已启动,read()取最新帧,stats()查看帧率与延迟,用完调用stop()
+        """
+        from live_sketch import LiveSketch
+        
+        return LiveSketch(source, style, **kwargs).start()
+    
     def convert_file(
         self,
         input_path: str,
@@ -316,6 +578,7 @@ def main():
     print("converter = SketchConverter()")
     print("sketch = converter.convert(image, style='pencil')")
     print("converter.convert_file('input.jpg', 'output.jpg', style='artistic')")
+    print("live = converter.live(0, style='pencil')  # 实时素描(摄像头)")
     print("```")
 
 
@@ -0,0 +1,95 @@
+"""人脸融合模板注册表: 并发创建不超配额,淘汰只删除一次"""
+
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from face_template_registry import FaceTemplateRegistry  # noqa: E402
+
+
+class FaceBodyError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f'{code}: {message}')
+        self.code = code
+
+
+class SlowService:
+    """模拟FaceBody: 接口有延迟,记录云端模板数峰值与重复删除"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.templates = set()
+        self.peak = 0
+        self.missing_deletes = 0
+
+    def add_face_template(self, image_url):
+        time.sleep(self.delay)
+        template_id = uuid.uuid4().hex
+        with self.lock:
+            self.templates.add(template_id)
+            self.peak = max(self.peak, len(self.templates))
+        return template_id
+
+    def delete_face_template(self, template_id):
+        time.sleep(self.delay)
+        with self.lock:
+            if template_id not in self.templates:
+                self.missing_deletes += 1
+                raise FaceBodyError('InvalidParameter.TemplateId', 'template not found')
+            self.templates.remove(template_id)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'templates.db')
+
+
+def test_concurrent_creates_stay_within_quota(db_path):
+    service = SlowService()
+    registry = FaceTemplateRegistry(service, db_path=db_path, capacity=3)
+    for i in range(3):
+        registry.acquire(f'warm-{i}', f'https://oss.example/warm-{i}.jpg')
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: registry.acquire(f'key-{i}', f'https://oss.example/{i}.jpg'), range(16)))
+
+    stats = registry.stats()
+    assert service.peak <= 3
+    assert service.missing_deletes == 0
+    assert stats['occupied'] == len(service.templates) == 3
+    assert stats['evictions'] == 16
+
+
+def test_quota_full_of_pinned_templates_releases_reservation(db_path):
+    service = SlowService(delay=0)
+    registry = FaceTemplateRegistry(service, db_path=db_path, capacity=2)
+    registry.prewarm([('a', 'https://oss.example/a.jpg'), ('b', 'https://oss.example/b.jpg')])
+
+    with pytest.raises(Exception, match='常驻'):
+        registry.acquire('c', 'https://oss.example/c.jpg')
+    assert registry.stats()['occupied'] == 2
+
+    registry.pin('a', False)
+    assert registry.acquire('c', 'https://oss.example/c.jpg')
+    assert registry.lookup('a') is None
+
+
+def test_delete_error_mentioning_template_keeps_row(db_path):
+    service = SlowService(delay=0)
+    registry = FaceTemplateRegistry(service, db_path=db_path, capacity=1)
+    template_id = registry.acquire('a', 'https://oss.example/a.jpg')
+
+    def fail(_):
+        raise FaceBodyError('Throttling.User', 'cannot delete template now')
+    service.delete_face_template = fail
+
+    assert registry.evict(1) == []
+    assert registry.lookup('a') == template_id
@@ -0,0 +1,91 @@
+"""发型目录: 下架或更换图片后释放常驻模板"""
+
+import os
+import sys
+import uuid
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from face_template_registry import FaceTemplateRegistry  # noqa: E402
+from hairstyle_catalog import HairstyleCatalog  # noqa: E402
+
+
+class FakeService:
+    """模拟FaceBody模板接口,记录云端现存模板"""
+
+    def __init__(self, db_path, capacity):
+        self.templates = {}
+        self.template_registry = FaceTemplateRegistry(self, db_path=db_path, capacity=capacity)
+
+    def add_face_template(self, image_url):
+        template_id = uuid.uuid4().hex
+        self.templates[template_id] = image_url
+        return template_id
+
+    def delete_face_template(self, template_id):
+        self.templates.pop(template_id)
+
+
+def write_source(path, seed):
+    rng = np.random.default_rng(seed)
+    cv2.imwrite(path, rng.integers(0, 255, (600, 450, 3), dtype=np.uint8))
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    return HairstyleCatalog(asset_dir=str(tmp_path / 'catalog'), index_path=str(tmp_path / 'index.json'))
+
+
+@pytest.fixture
+def service(tmp_path):
+    return FakeService(str(tmp_path / 'templates.db'), capacity=3)
+
+
+def ingest(catalog, service, source):
+    return catalog.ingest_file(source, lambda path: f'https://oss.example/{os.path.basename(path)}',
+                               service, segment=False)
+
+
+def test_reingest_changed_source_releases_old_template(tmp_path, catalog, service):
+    source = str(tmp_path / 'style.jpg')
+    for seed in range(4):
+        write_source(source, seed)
+        entry = ingest(catalog, service, source)
+
+    registry = service.template_registry
+    assert list(service.templates) == [entry['template_id']]
+    assert registry.stats()['occupied'] == 1
+    assert registry.stats()['pinned'] == 1
+    assert registry.lookup(entry['content_hash']) == entry['template_id']
+
+
+def test_remove_releases_pinned_template(tmp_path, catalog, service):
+    source = str(tmp_path / 'style.jpg')
+    write_source(source, 0)
+    entry = ingest(catalog, service, source)
+
+    assert catalog.remove(entry['id'], service)
+    assert catalog.list_entries() == []
+    assert service.templates == {}
+    assert service.template_registry.stats()['occupied'] == 0
+
+    # 配额已归还,普通迁移可以继续创建模板
+    for i in range(3):
+        service.template_registry.acquire(f'key-{i}', f'https://oss.example/{i}.jpg')
+    assert len(service.templates) == 3
+
+
+def test_remove_keeps_template_shared_by_another_entry(tmp_path, catalog, service):
+    first, second = str(tmp_path / 'a.jpg'), str(tmp_path / 'b.jpg')
+    write_source(first, 0)
+    write_source(second, 0)
+    entry = ingest(catalog, service, first)
+    ingest(catalog, service, second)
+
+    assert catalog.remove(entry['id'], service)
+    assert list(service.templates) == [entry['template_id']]
+    assert service.template_registry.stats()['pinned'] == 1
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+深度缩放瓦片金字塔(DZI格式)
+将结果图切分为多级256px瓦片,前端放大查看时只加载当前缩放级别下可见的瓦片
+"""
+
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+try:
+    from memory_budget import STAGE_FOOTPRINTS, get_memory_budget, image_dimensions
+    MEMORY_BUDGET_AVAILABLE = True
+except ImportError:
+    MEMORY_BUDGET_AVAILABLE = False
+    get_memory_budget = None
+
+
+DZI_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+    'Format="{format}" Overlap="{overlap}" TileSize="{tile_size}">'
+    '<Size Width="{width}" Height="{height}"/></Image>\n'
+)
+
+
+class TilePyramid:
+    """DZI瓦片金字塔生成器"""
+
+    # 后台生成队列(单线程,避免多个大图同时切片占满CPU);排队的只是文件路径,
+    # 满了就跳过(前端取不到瓦片时退回原图),不会随负载无限堆积
+    MAX_BACKGROUND_QUEUE = int(os.getenv('TILE_QUEUE_SIZE', '8'))
+    _background = None
+    _background_lock = threading.Lock()
+    _queued = set()
+
+    def __init__(
+        self,
+        tile_size: int = 256,
+        overlap: int = 1,
+        tile_format: str = 'jpg',
+        quality: int = 85,
+        workers: Optional[int] = None
+    ):
+        """
+        初始化
+
+        Args:
+            tile_size: 瓦片边长
+            overlap: 瓦片重叠像素(避免缩放时瓦片间出现接缝)
+            tile_format: 瓦片格式 jpg/png/webp
+            quality: JPEG/WebP质量
+            workers: 编码线程数,默认 min(4, CPU核数)
+        """
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.tile_format = tile_format
+        self.quality = quality
+        self.workers = workers or min(4, os.cpu_count() or 1)
+
+    @staticmethod
+    def max_level(width: int, height: int) -> int:
+        """最高级别(原图尺寸);第0级为1x1"""
+        return int(math.ceil(math.log2(max(width, height, 1))))
+
+    def _encode_params(self) -> list:
+        if self.tile_format == 'jpg':
+            return [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        if self.tile_format == 'webp':
+            return [cv2.IMWRITE_WEBP_QUALITY, self.quality]
+        return []
+
+    def tile_bounds(self, level_width: int, level_height: int) -> List[Tuple[int, int, int, int, int, int]]:
+        """
+        计算一个级别内所有瓦片的范围
+
+        Returns:
+            [(col, row, x0, y0, x1, y1), ...] 含重叠区
+        """
+        bounds = []
+        cols = int(math.ceil(level_width / self.tile_size))
+        rows = int(math.ceil(level_height / self.tile_size))
+        for row in range(rows):
+            for col in range(cols):
+                x0 = max(0, col * self.tile_size - self.overlap)
+                y0 = max(0, row * self.tile_size - self.overlap)
+                x1 = min(level_width, (col + 1) * self.tile_size + self.overlap)
+                y1 = min(level_height, (row + 1) * self.tile_size + self.overlap)
+                bounds.append((col, row, x0, y0, x1, y1))
+        return bounds
+
+    def generate(self, image: np.ndarray, output_dir: str, name: str = 'tiles') -> dict:
+        """
+        生成瓦片金字塔
+
+        Args:
+            image: BGR/BGRA图像
+            output_dir: 输出目录,写出 {name}.dzi 和 {name}_files/{level}/{col}_{row}.{format}
+            name: 金字塔名称
+
+        Returns:
+            dict: 金字塔描述(尺寸、瓦片大小、重叠、格式、级别数)
+        """
+        if image.ndim == 3 and image.shape[2] == 4 and self.tile_format == 'jpg':
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+
+        height, width = image.shape[:2]
+        top = self.max_level(width, height)
+        files_dir = os.path.join(output_dir, f'{name}_files')
+        ext = f'.{self.tile_format}'
+        params = self._encode_params()
+
+        def write_level(level: int, level_image: np.ndarray):
+            level_dir = os.path.join(files_dir, str(level))
+            os.makedirs(level_dir, exist_ok=True)
+            level_height, level_width = level_image.shape[:2]
+            for col, row, x0, y0, x1, y1 in self.tile_bounds(level_width, level_height):
+                cv2.imwrite(os.path.join(level_dir, f'{col}_{row}{ext}'), level_image[y0:y1, x0:x1], params)
+
+        # 自顶向下逐级减半(每级由上一级缩放,计算量约为原图的4/3);各级编码并行
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = []
+            level_image = image
+            for level in range(top, -1, -1):
+                futures.append(executor.submit(write_level, level, level_image))
+                if level > 0:
+                    level_height, level_width = level_image.shape[:2]
+                    level_image = cv2.resize(
+                        level_image,
+                        (max(1, (level_width + 1) // 2), max(1, (level_height + 1) // 2)),
+                        interpolation=cv2.INTER_AREA
+                    )
+            for future in futures:
+                future.result()
+
+        # 描述文件最后写出,存在即表示瓦片已全部就绪
+        with open(os.path.join(output_dir, f'{name}.dzi'), 'w', encoding='utf-8') as f:
+            f.write(DZI_TEMPLATE.format(
+                format=self.tile_format, overlap=self.overlap, tile_size=self.tile_size,
+                width=width, height=height
+            ))
+
+        return {
+            'width': width,
+            'height': height,
+            'tile_size': self.tile_size,
+            'overlap': self.overlap,
+            'format': self.tile_format,
+            'levels': top + 1,
+        }
+
+    def generate_file(self, image_path: str, output_dir: str, name: str = 'tiles') -> dict:
+        """
+        读取图像文件并生成瓦片金字塔;启用内存预算时按图像尺寸申请预算后再解码
+
+        Raises:
+            ValueError: 无法读取图像
+            MemoryBudgetExceeded: 内存预算排队已满或等待超时
+        """
+        reservation = None
+        if MEMORY_BUDGET_AVAILABLE:
+            with open(image_path, 'rb') as f:
+                dimensions = image_dimensions(f)
+            if dimensions:
+                estimate = dimensions[0] * dimensions[1] * STAGE_FOOTPRINTS['tiles']
+                reservation = get_memory_budget().acquire('tiles', estimate)
+        try:
+            image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+            if image is None:
+                raise ValueError(f"无法读取图像: {image_path}")
+            return self.generate(image, output_dir, name)
+        finally:
+            if reservation is not None:
+                get_memory_budget().release(reservation)
+
+    def generate_background(self, image_path: str, output_dir: str, name: str = 'tiles'):
+        """
+        在后台队列中生成瓦片,不阻塞请求
+
+        Args:
+            image_path: 图像文件路径(生成时才解码,排队期间不占用内存)
+            output_dir: 输出目录
+            name: 金字塔名称
+
+        Returns:
+            Future,已在排队或队列已满时返回None
+        """
+        key = (os.path.abspath(output_dir), name)
+        with self._background_lock:
+            if key in TilePyramid._queued:
+                return None
+            if len(TilePyramid._queued) >= self.MAX_BACKGROUND_QUEUE:
+                print(f"⚠️  瓦片队列已满({self.MAX_BACKGROUND_QUEUE}),跳过: {output_dir}/{name}")
+                return None
+            if TilePyramid._background is None:
+                TilePyramid._background = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tile-pyramid')
+            TilePyramid._queued.add(key)
+            executor = TilePyramid._background
+
+        def run():
+            try:
+                self.generate_file(image_path, output_dir, name)
+            except Exception as e:
+                print(f"⚠️  瓦片金字塔生成失败: {output_dir}/{name}, {e}")
+            finally:
+                with self._background_lock:
+                    TilePyramid._queued.discard(key)
+
+        return executor.submit(run)
+
+
+def main():
+    """测试函数"""
+    import sys
+
+    if len(sys.argv) < 3:
+        print("用法: python tile_pyramid.py <图像路径> <输出目录>")
+        return
+
+    image = cv2.imread(sys.argv[1], cv2.IMREAD_UNCHANGED)
+    if image is None:
+        print(f"❌ 无法读取图像: {sys.argv[1]}")
+        return
+    os.makedirs(sys.argv[2], exist_ok=True)
+    info = TilePyramid().generate(image, sys.argv[2])
+    print(f"✅ 瓦片金字塔已生成: {info}")
+
+
+if __name__ == '__main__':
+    main()
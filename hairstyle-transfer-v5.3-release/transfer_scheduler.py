@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+发型迁移调度器
+所有迁移请求在进入人脸融合/素描之前领取执行槽位:
+- 优先级: 店内实时请求(interactive)总是先于批量任务(batch),
+  并且固定预留若干槽位给实时请求,批量任务占满其余槽位时新到的实时请求也不用等
+- 同一优先级内按租户(门店/API Key)做加权公平排队(WFQ),
+  一家门店的批量任务不会挤占其他门店
+- 队列溢出或等待超时时拒绝(429 + Retry-After),由调用方稍后重试
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from metrics import percentile
+
+
+# 优先级(靠前的优先)
+PRIORITIES = ('interactive', 'batch')
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """
+    解析租户权重配置
+
+    Args:
+        value: 形如 "salon-a:3,salon-b:1" 的字符串
+
+    Returns:
+        dict: {租户: 权重}
+    """
+    weights = {}
+    for item in value.split(','):
+        if ':' not in item:
+            continue
+        tenant, weight = item.rsplit(':', 1)
+        try:
+            weights[tenant.strip()] = max(0.01, float(weight))
+        except ValueError:
+            print(f"⚠️  忽略无效的租户权重: {item}")
+    return weights
+
+
+class SchedulerBusy(Exception):
+    """队列已满或等待超时"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """一次排队/执行中的迁移请求"""
+
+    def __init__(self, tenant: str, priority: str, start_tag: float, finish_tag: float):
+        self.tenant = tenant
+        self.priority = priority
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.enqueued = time.time()
+        self.started = None
+        self.admitted = False
+        self.cancelled = False
+        # 协程等待者: (事件循环, future),放行时在其事件循环中唤醒
+        self.waiter = None
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class TransferScheduler:
+    """执行槽位调度(线程安全,单个工作进程内)"""
+
+    DEFAULT_CONCURRENCY = 8
+    # 各优先级的队列上限 / 最长等待秒数
+    DEFAULT_QUEUE_LIMITS = {'interactive': 32, 'batch': 256}
+    DEFAULT_QUEUE_TIMEOUTS = {'interactive': 30.0, 'batch': 600.0}
+    # 单个租户在一个优先级中最多排队的请求数
+    DEFAULT_TENANT_QUEUE_LIMIT = 64
+    # 统计等待时间的样本数
+    WAIT_SAMPLES = 1000
+
+    def __init__(
+        self,
+        concurrency: Optional[int] = None,
+        interactive_reserved: Optional[int] = None,
+        weights: Optional[Dict[str, float]] = None,
+        queue_limits: Optional[Dict[str, int]] = None,
+        queue_timeouts: Optional[Dict[str, float]] = None,
+        tenant_queue_limit: Optional[int] = None
+    ):
+        """
+        初始化
+
+        Args:
+            concurrency: 同时执行的迁移数,默认环境变量TRANSFER_CONCURRENCY或8
+            interactive_reserved: 为实时请求预留的槽位数,默认环境变量TRANSFER_INTERACTIVE_RESERVED或并发数的一半
+                                  (槽位不可抢占,预留数应覆盖店内实时请求的常见并发)
+            weights: 租户权重,默认解析环境变量TENANT_WEIGHTS,未配置的租户权重为1
+            queue_limits: 各优先级队列上限,默认环境变量TRANSFER_QUEUE_LIMIT / TRANSFER_BATCH_QUEUE_LIMIT
+            queue_timeouts: 各优先级最长等待秒数,默认环境变量TRANSFER_QUEUE_TIMEOUT / TRANSFER_BATCH_QUEUE_TIMEOUT
+            tenant_queue_limit: 单个租户排队上限,默认环境变量TRANSFER_TENANT_QUEUE_LIMIT或64
+        """
+        self.concurrency = concurrency or int(os.getenv('TRANSFER_CONCURRENCY', self.DEFAULT_CONCURRENCY))
+        reserved = interactive_reserved if interactive_reserved is not None else int(
+            os.getenv('TRANSFER_INTERACTIVE_RESERVED', self.concurrency // 2))
+        # 批量任务至少能用一个槽位
+        self.batch_limit = max(1, self.concurrency - reserved)
+        self.weights = weights if weights is not None else parse_weights(os.getenv('TENANT_WEIGHTS', ''))
+        self.queue_limits = queue_limits or {
+            'interactive': int(os.getenv('TRANSFER_QUEUE_LIMIT', self.DEFAULT_QUEUE_LIMITS['interactive'])),
+            'batch': int(os.getenv('TRANSFER_BATCH_QUEUE_LIMIT', self.DEFAULT_QUEUE_LIMITS['batch'])),
+        }
+        self.queue_timeouts = queue_timeouts or {
+            'interactive': float(os.getenv('TRANSFER_QUEUE_TIMEOUT', self.DEFAULT_QUEUE_TIMEOUTS['interactive'])),
+            'batch': float(os.getenv('TRANSFER_BATCH_QUEUE_TIMEOUT', self.DEFAULT_QUEUE_TIMEOUTS['batch'])),
+        }
+        self.tenant_queue_limit = tenant_queue_limit or int(
+            os.getenv('TRANSFER_TENANT_QUEUE_LIMIT', self.DEFAULT_TENANT_QUEUE_LIMIT))
+
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        # 每个优先级一个按完成标签排序的堆: (finish_tag, seq, ticket)
+        self._queues = {p: [] for p in PRIORITIES}
+        self._queued = {p: 0 for p in PRIORITIES}
+        self._running = {p: 0 for p in PRIORITIES}
+        # WFQ虚拟时间与各租户最后一个请求的完成标签
+        self._virtual = {p: 0.0 for p in PRIORITIES}
+        self._tenant_finish = {}
+        self._tenant_queued = {}
+        self._waits = {p: deque(maxlen=self.WAIT_SAMPLES) for p in PRIORITIES}
+        self._service = {p: deque(maxlen=self.WAIT_SAMPLES) for p in PRIORITIES}
+        self._tenants = {}
+
+    def _tenant_stats(self, tenant: str) -> dict:
+        stats = self._tenants.get(tenant)
+        if stats is None:
+            stats = self._tenants[tenant] = {'admitted': 0, 'rejected': 0, 'timeouts': 0}
+        return stats
+
+    def _avg_service(self, priority: str) -> float:
+        samples = self._service[priority]
+        return sum(samples) / len(samples) if samples else 5.0
+
+    def _retry_after(self, priority: str) -> int:
+        """建议的重试等待秒数: 排在前面的请求按当前并发处理完所需的时间"""
+        slots = self.concurrency if priority == 'interactive' else self.batch_limit
+        ahead = self._queued['interactive'] + (self._queued['batch'] if priority == 'batch' else 0)
+        return max(1, math.ceil((ahead / slots + 1) * self._avg_service(priority)))
+
+    def _can_run(self, priority: str) -> bool:
+        total = sum(self._running.values())
+        if total >= self.concurrency:
+            return False
+        if priority == 'batch':
+            # 实时请求在排队时不放行批量任务,且批量任务不占用预留槽位
+            return self._queued['interactive'] == 0 and self._running['batch'] < self.batch_limit
+        return True
+
+    def _dispatch(self):
+        """按优先级和WFQ完成标签放行排队请求(需持有锁)"""
+        admitted = False
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue and self._can_run(priority):
+                _, _, ticket = heapq.heappop(queue)
+                if ticket.cancelled:
+                    continue
+                self._admit(ticket)
+                self._queued[priority] -= 1
+                self._tenant_queued[(priority, ticket.tenant)] -= 1
+                self._virtual[priority] = ticket.start_tag
+                admitted = True
+        if admitted:
+            self._cond.notify_all()
+
+    def _admit(self, ticket: Ticket):
+        ticket.admitted = True
+        ticket.started = time.time()
+        self._running[ticket.priority] += 1
+        self._waits[ticket.priority].append(ticket.started - ticket.enqueued)
+        self._tenant_stats(ticket.tenant)['admitted'] += 1
+        if ticket.waiter is not None:
+            loop, future = ticket.waiter
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # 事件循环已关闭,等待者不会再取走槽位
+                pass
+
+    def _enqueue(self, tenant: str, priority: str, waiter=None) -> Ticket:
+        """
+        排队并尝试立即放行(需持有锁)
+
+        Raises:
+            SchedulerBusy: 队列已满
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的优先级: {priority}")
+        key = (priority, tenant)
+        if (self._queued[priority] >= self.queue_limits[priority]
+                or self._tenant_queued.get(key, 0) >= self.tenant_queue_limit):
+            self._tenant_stats(tenant)['rejected'] += 1
+            raise SchedulerBusy('排队人数过多,请稍后重试', self._retry_after(priority))
+
+        # WFQ: 开始标签取虚拟时间与该租户上一个请求完成标签中较大者,权重越大完成标签增长越慢
+        start_tag = max(self._virtual[priority], self._tenant_finish.get(key, 0.0))
+        finish_tag = start_tag + 1.0 / self.weights.get(tenant, 1.0)
+        self._tenant_finish[key] = finish_tag
+        self._tenant_queued[key] = self._tenant_queued.get(key, 0) + 1
+        self._queued[priority] += 1
+        ticket = Ticket(tenant, priority, start_tag, finish_tag)
+        ticket.waiter = waiter
+        heapq.heappush(self._queues[priority], (finish_tag, next(self._seq), ticket))
+        # 有空闲槽位时立即放行(队首不一定是自己)
+        self._dispatch()
+        return ticket
+
+    def _withdraw(self, ticket: Ticket, timed_out: bool = True):
+        """撤回仍在排队的请求(需持有锁)"""
+        ticket.cancelled = True
+        self._queued[ticket.priority] -= 1
+        self._tenant_queued[(ticket.priority, ticket.tenant)] -= 1
+        if timed_out:
+            stats = self._tenant_stats(ticket.tenant)
+            stats['rejected'] += 1
+            stats['timeouts'] += 1
+
+    @staticmethod
+    def _log_wait(ticket: Ticket):
+        wait = ticket.started - ticket.enqueued
+        if wait >= 1:
+            print(f"⏳ 迁移排队 {wait:.1f}秒: {ticket.tenant} ({ticket.priority})")
+
+    def acquire(self, tenant: str = 'default', priority: str = 'interactive',
+                timeout: Optional[float] = None) -> Ticket:
+        """
+        领取执行槽位,需要时排队
+
+        Args:
+            tenant: 租户(门店ID或API Key)
+            priority: 'interactive' 或 'batch'
+            timeout: 最长等待秒数,默认按优先级配置
+
+        Returns:
+            Ticket: 执行完成后交给release()
+
+        Raises:
+            SchedulerBusy: 队列已满或等待超时
+        """
+        timeout = self.queue_timeouts.get(priority, 0.0) if timeout is None else timeout
+
+        with self._cond:
+            ticket = self._enqueue(tenant, priority)
+            deadline = ticket.enqueued + timeout
+            while not ticket.admitted:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._withdraw(ticket)
+                    raise SchedulerBusy('排队等待超时,请稍后重试', self._retry_after(priority))
+                self._cond.wait(remaining)
+
+        self._log_wait(ticket)
+        return ticket
+
+    async def acquire_async(self, tenant: str = 'default', priority: str = 'interactive',
+                            timeout: Optional[float] = None) -> Ticket:
+        """
+        领取执行槽位(协程版,参数与返回值同acquire)
+
+        排队期间不占用线程: 放行时由_dispatch通过call_soon_threadsafe唤醒,
+        异步服务中大量排队的批量请求不会占满线程池、饿死已在执行的请求
+
+        Raises:
+            SchedulerBusy: 队列已满或等待超时
+        """
+        timeout = self.queue_timeouts.get(priority, 0.0) if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        with self._cond:
+            ticket = self._enqueue(tenant, priority, (loop, future))
+            if ticket.admitted:
+                return ticket
+
+        try:
+            await asyncio.wait_for(future, max(0.0, ticket.enqueued + timeout - time.time()))
+        except asyncio.TimeoutError:
+            with self._cond:
+                # 超时与放行同时发生时以放行为准
+                if not ticket.admitted:
+                    self._withdraw(ticket)
+                    raise SchedulerBusy('排队等待超时,请稍后重试', self._retry_after(priority))
+        except asyncio.CancelledError:
+            # 客户端断开: 撤回排队,已放行的归还槽位
+            with self._cond:
+                if not ticket.admitted:
+                    self._withdraw(ticket, timed_out=False)
+                    ticket = None
+            if ticket is not None:
+                self.release(ticket)
+            raise
+
+        self._log_wait(ticket)
+        return ticket
+
+    def release(self, ticket: Ticket):
+        """归还槽位并放行下一个请求"""
+        with self._cond:
+            self._running[ticket.priority] -= 1
+            self._service[ticket.priority].append(time.time() - ticket.started)
+            # 没有排队请求的租户不再需要完成标签
+            for key in [k for k, n in self._tenant_queued.items() if n == 0]:
+                if self._tenant_finish.get(key, 0.0) <= self._virtual[key[0]]:
+                    self._tenant_queued.pop(key, None)
+                    self._tenant_finish.pop(key, None)
+            self._dispatch()
+
+    def stats(self) -> dict:
+        """各优先级的排队/执行数、等待时间百分位,以及各租户的放行/拒绝数"""
+        with self._cond:
+            priorities = {}
+            for priority in PRIORITIES:
+                waits = list(self._waits[priority])
+                p50, p99 = percentile(waits, 50), percentile(waits, 99)
+                priorities[priority] = {
+                    'running': self._running[priority],
+                    'queued': self._queued[priority],
+                    'wait_p50_ms': round(p50 * 1000, 1) if p50 is not None else None,
+                    'wait_p99_ms': round(p99 * 1000, 1) if p99 is not None else None,
+                    'avg_service_s': round(self._avg_service(priority), 2) if self._service[priority] else None,
+                }
+            return {
+                'concurrency': self.concurrency,
+                'batch_limit': self.batch_limit,
+                'priorities': priorities,
+                'tenants': {tenant: dict(stats) for tenant, stats in self._tenants.items()},
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_transfer_scheduler() -> TransferScheduler:
+    """
+    获取工作进程的迁移调度器(懒加载)
+
+    环境变量:
+        TRANSFER_CONCURRENCY: 同时执行的迁移数,默认8
+        TRANSFER_INTERACTIVE_RESERVED: 为实时请求预留的槽位数,默认为并发数的一半
+        TENANT_WEIGHTS: 租户权重,如 "salon-a:3,salon-b:1",默认均为1
+        TRANSFER_QUEUE_LIMIT / TRANSFER_BATCH_QUEUE_LIMIT: 队列上限,默认32 / 256
+        TRANSFER_QUEUE_TIMEOUT / TRANSFER_BATCH_QUEUE_TIMEOUT: 最长等待秒数,默认30 / 600
+        TRANSFER_TENANT_QUEUE_LIMIT: 单个租户排队上限,默认64
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = TransferScheduler()
+        return _scheduler
+
+
+def main():
+    """测试函数: 一家门店批量提交时,其他门店的实时请求仍立即执行"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    scheduler = TransferScheduler(concurrency=4, interactive_reserved=1)
+
+    def job(tenant, priority, seconds):
+        ticket = scheduler.acquire(tenant, priority)
+        try:
+            time.sleep(seconds)
+        finally:
+            scheduler.release(ticket)
+        return time.time() - ticket.enqueued
+
+    with ThreadPoolExecutor(max_workers=64) as executor:
+        batch = [executor.submit(job, 'bulk-salon', 'batch', 0.2) for _ in range(40)]
+        time.sleep(0.1)
+        interactive = []
+        for i in range(10):
+            interactive.append(executor.submit(job, f'salon-{i % 3}', 'interactive', 0.2))
+            time.sleep(0.1)
+        latencies = [f.result() for f in interactive]
+        [f.result() for f in batch]
+
+    print(f"✅ 实时请求延迟 p50={percentile(latencies, 50):.2f}秒 p99={percentile(latencies, 99):.2f}秒")
+    print(f"   统计: {scheduler.stats()}")
+
+
+if __name__ == '__main__':
+    main()